@@ -0,0 +1,679 @@
+"""
+近似最近邻（ANN）索引
+在 EmbeddingStore 之上提供统一的向量检索接口，QuestionMatcher 和 EnhancedMatcher 共用：
+- FlatIndex: 精确检索（整库矩阵-向量乘法），题库较小时使用
+- IVFFlatIndex: NumPy 实现的倒排文件索引，球面 k-means 把向量分到 nlist 个簇，
+  查询只扫描与查询最接近的 nprobe 个簇；nprobe 越大召回越高、延迟越大
+- HNSWIndex: 可选的 hnswlib 图索引（需要安装 hnswlib），ef 控制召回/延迟
+- SQ8Index / PQIndex: 压缩编码索引（每维 int8 标量量化 / 乘积量化），
+  内存中只常驻编码，查询向量不量化、直接与编码计算近似内积（非对称距离），
+  再对前 top_k × rerank_factor 个候选用 EmbeddingStore 中的 float32 向量精确重排
+
+索引只保存聚类、图结构或量化码本，float32 向量本身仍在 EmbeddingStore 中（内存映射的嵌入文件）；
+插入、删除需通过索引进行，以保持两者一致
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import ANN_CONFIG
+from embedding_store import EmbeddingStore, normalize, top_k_indices
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+# k-means 训练参数：每个簇最多取这么多个训练样本，迭代次数
+KMEANS_SAMPLES_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+KMEANS_SEED = 20240601
+
+# 分批计算簇分配时每批的行数
+ASSIGN_BATCH = 8192
+
+# 压缩编码上计算近似内积时每批的行数（解码后的块留在 CPU 缓存内）
+SCORE_BATCH = 1024
+
+# 乘积量化每个子空间的码字数（编码为 uint8）
+PQ_CODEWORDS = 256
+
+
+def spherical_kmeans(matrix: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS,
+                     seed: int = KMEANS_SEED) -> np.ndarray:
+    """归一化向量的球面 k-means，返回 k 个归一化簇中心"""
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    k = max(1, min(k, n))
+    sample_size = min(n, k * KMEANS_SAMPLES_PER_LIST)
+    sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))] if sample_size < n else matrix
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=k)
+        # 空簇用随机样本重新初始化
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def kmeans(matrix: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS,
+           seed: int = KMEANS_SEED) -> np.ndarray:
+    """欧氏距离 k-means（用于乘积量化的子空间），返回 k 个簇中心"""
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    k = max(1, min(k, n))
+    sample_size = min(n, k * KMEANS_SAMPLES_PER_LIST)
+    sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))] if sample_size < n else matrix
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            counts[empty] = 1
+        centroids = (sums / counts[:, None]).astype(np.float32)
+    return centroids
+
+
+def nearest_centroids(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """每行欧氏距离最近的簇中心编号（argmin |x-c|² = argmax x·c - |c|²/2）"""
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BATCH):
+        block = matrix[start:start + ASSIGN_BATCH]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+def assign_lists(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """每行所属的簇编号（分批计算，避免一次生成 n × nlist 的大矩阵）"""
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BATCH):
+        block = matrix[start:start + ASSIGN_BATCH]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+class FlatIndex:
+    """精确检索：整库矩阵-向量乘法"""
+
+    kind = 'flat'
+
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def build(self):
+        pass
+
+    def add(self, question_id: str, embedding: Optional[np.ndarray]):
+        with self._lock:
+            self.store.add(question_id, embedding)
+
+    def remove(self, question_id: str):
+        with self._lock:
+            self.store.remove(question_id)
+
+    def search(self, query: np.ndarray, top_k: int, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """最相似的题目 [(question_id, 余弦相似度), ...]，按相似度降序"""
+        with self._lock:
+            return self.store.search(query, top_k, threshold)
+
+    def save(self, path: str):
+        pass
+
+    def load(self, path: str) -> bool:
+        return True
+
+
+class IVFFlatIndex:
+    """倒排文件索引（IVF-Flat）"""
+
+    kind = 'ivf'
+
+    def __init__(self, store: EmbeddingStore, nlist: Optional[int] = None, nprobe: int = None):
+        """
+        Args:
+            store: 向量存储
+            nlist: 簇数，默认约为 sqrt(题目数)
+            nprobe: 每次查询扫描的簇数（召回/延迟旋钮）
+        """
+        self.store = store
+        self.nlist = nlist
+        self.nprobe = ANN_CONFIG['nprobe'] if nprobe is None else nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self._labels = np.zeros(0, dtype=np.int32)  # 存储行号 -> 簇编号
+        self._lists: List[List[int]] = []  # 簇编号 -> 存储行号列表
+        self._arrays: Dict[int, np.ndarray] = {}  # 簇的行号数组缓存
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def build(self):
+        """训练簇中心并把全部向量分配到簇"""
+        with self._lock:
+            matrix = self.store.matrix
+            if len(matrix) == 0:
+                self.centroids = None
+                self._set_labels(np.zeros(0, dtype=np.int32), 0)
+                return
+            nlist = self.nlist or max(1, int(np.sqrt(len(matrix))))
+            self.centroids = spherical_kmeans(matrix, nlist)
+            self._set_labels(assign_lists(matrix, self.centroids), len(self.centroids))
+
+    def _set_labels(self, labels: np.ndarray, nlist: int):
+        self._labels = labels.astype(np.int32)
+        self._lists = [[] for _ in range(nlist)]
+        for row, label in enumerate(self._labels.tolist()):
+            self._lists[label].append(row)
+        self._arrays = {}
+
+    def _list_rows(self, label: int) -> np.ndarray:
+        rows = self._arrays.get(label)
+        if rows is None:
+            rows = np.array(self._lists[label], dtype=np.int64)
+            self._arrays[label] = rows
+        return rows
+
+    def _detach(self, row: int):
+        label = int(self._labels[row])
+        self._lists[label].remove(row)
+        self._arrays.pop(label, None)
+
+    def add(self, question_id: str, embedding: Optional[np.ndarray]):
+        """插入或更新向量（未训练时只写入存储，查询退化为精确检索）"""
+        with self._lock:
+            self._remove(question_id)
+            row = self.store.add(question_id, embedding)
+            if row is None or self.centroids is None:
+                return
+            if row >= len(self._labels):
+                labels = np.zeros(max(16, 2 * len(self._labels), row + 1), dtype=np.int32)
+                labels[:len(self._labels)] = self._labels
+                self._labels = labels
+            label = int(np.argmax(self.centroids @ self.store.matrix[row]))
+            self._labels[row] = label
+            self._lists[label].append(row)
+            self._arrays.pop(label, None)
+
+    def remove(self, question_id: str):
+        with self._lock:
+            self._remove(question_id)
+
+    def _remove(self, question_id: str):
+        if self.centroids is not None and question_id in self.store:
+            self._detach(int(self.store.rows_of([question_id])[0]))
+        moved = self.store.remove(question_id)
+        if moved is None or self.centroids is None:
+            return
+        row, last = moved
+        if row != last:
+            # 原最后一行移到了 row
+            label = int(self._labels[last])
+            members = self._lists[label]
+            members[members.index(last)] = row
+            self._labels[row] = label
+            self._arrays.pop(label, None)
+
+    def search(self, query: np.ndarray, top_k: int, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """扫描与查询最接近的 nprobe 个簇，返回 [(question_id, 余弦相似度), ...]"""
+        with self._lock:
+            if self.centroids is None:
+                return self.store.search(query, top_k, threshold)
+            query = normalize(query)
+            if query is None:
+                return []
+            nprobe = min(self.nprobe, len(self.centroids))
+            probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.concatenate([self._list_rows(int(label)) for label in probe])
+            if len(rows) == 0:
+                return []
+            scores = self.store.similarities(query, rows)
+            top = top_k_indices(scores, top_k, threshold)
+            return list(zip(self.store.ids_at(rows[top].tolist()), scores[top].tolist()))
+
+    def save(self, path: str):
+        """保存簇中心和簇分配（向量本身不保存）"""
+        with self._lock:
+            if self.centroids is None:
+                return
+            np.savez(path, centroids=self.centroids,
+                     labels=self._labels[:len(self.store)],
+                     question_ids=np.array(self.store.question_ids, dtype=str))
+
+    def load(self, path: str) -> bool:
+        """读取已保存的簇结构；题目与存储不一致时返回 False（需要重新 build）"""
+        if not os.path.exists(path):
+            return False
+        try:
+            data = np.load(path)
+            if data['question_ids'].tolist() != self.store.question_ids:
+                return False
+            centroids = data['centroids']
+            if centroids.shape[1] != self.store.dim:
+                return False
+            with self._lock:
+                self.centroids = centroids.astype(np.float32)
+                self._set_labels(data['labels'], len(centroids))
+            return True
+        except Exception as e:
+            print(f"[Warning] Failed to load IVF index {path}: {e}")
+            return False
+
+
+class HNSWIndex:
+    """hnswlib 图索引（可选后端）"""
+
+    kind = 'hnsw'
+
+    def __init__(self, store: EmbeddingStore, ef: int = None, m: int = 16, ef_construction: int = 200):
+        if not HNSWLIB_AVAILABLE:
+            raise ImportError("hnswlib is not installed")
+        self.store = store
+        self.ef = ANN_CONFIG['ef_search'] if ef is None else ef
+        self.m = m
+        self.ef_construction = ef_construction
+        self._index = None
+        self._labels: Dict[str, int] = {}  # question_id -> hnsw 标签
+        self._ids: Dict[int, str] = {}
+        self._next_label = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def _new_index(self, capacity: int):
+        index = hnswlib.Index(space='ip', dim=self.store.dim)
+        index.init_index(max_elements=max(capacity, 16), ef_construction=self.ef_construction,
+                         M=self.m, allow_replace_deleted=True)
+        index.set_ef(self.ef)
+        return index
+
+    def build(self):
+        with self._lock:
+            ids = self.store.question_ids
+            self._labels = {qid: label for label, qid in enumerate(ids)}
+            self._ids = dict(enumerate(ids))
+            self._next_label = len(ids)
+            if not ids:
+                self._index = None
+                return
+            self._index = self._new_index(len(ids))
+            self._index.add_items(self.store.matrix, np.arange(len(ids)))
+
+    def add(self, question_id: str, embedding: Optional[np.ndarray]):
+        with self._lock:
+            self._remove(question_id)
+            if self.store.add(question_id, embedding) is None:
+                return
+            if self._index is None:
+                self._index = self._new_index(16)
+            if self._index.get_current_count() >= self._index.get_max_elements():
+                self._index.resize_index(2 * self._index.get_max_elements())
+            label = self._next_label
+            self._next_label += 1
+            self._labels[question_id] = label
+            self._ids[label] = question_id
+            self._index.add_items(self.store.vector(question_id)[None, :], [label], replace_deleted=True)
+
+    def remove(self, question_id: str):
+        with self._lock:
+            self._remove(question_id)
+
+    def _remove(self, question_id: str):
+        self.store.remove(question_id)
+        label = self._labels.pop(question_id, None)
+        if label is not None:
+            self._ids.pop(label, None)
+            self._index.mark_deleted(label)
+
+    def search(self, query: np.ndarray, top_k: int, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        with self._lock:
+            query = normalize(query)
+            if query is None or self._index is None or not self._labels:
+                return []
+            self._index.set_ef(max(self.ef, top_k))
+            labels, distances = self._index.knn_query(query, k=min(top_k, len(self._labels)))
+        results = [(self._ids[int(label)], 1.0 - float(distance))
+                   for label, distance in zip(labels[0], distances[0])]
+        if threshold is not None:
+            results = [r for r in results if r[1] >= threshold]
+        return results
+
+    def save(self, path: str):
+        with self._lock:
+            if self._index is None:
+                return
+            self._index.save_index(path)
+            # 标签 -> 题号（已删除的标签为空字符串）
+            np.save(path + '.ids.npy', np.array([self._ids.get(i, '') for i in range(self._next_label)], dtype=str))
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path) or not os.path.exists(path + '.ids.npy'):
+            return False
+        try:
+            ids = np.load(path + '.ids.npy').tolist()
+            live = {label: qid for label, qid in enumerate(ids) if qid}
+            if sorted(live.values()) != sorted(self.store.question_ids):
+                return False
+            index = hnswlib.Index(space='ip', dim=self.store.dim)
+            index.load_index(path, max_elements=max(len(ids), 16), allow_replace_deleted=True)
+            index.set_ef(self.ef)
+            with self._lock:
+                self._index = index
+                self._ids = live
+                self._labels = {qid: label for label, qid in live.items()}
+                self._next_label = len(ids)
+            return True
+        except Exception as e:
+            print(f"[Warning] Failed to load HNSW index {path}: {e}")
+            return False
+
+
+class _QuantizedIndex(ABC):
+    """
+    压缩编码索引的公共部分
+
+    编码按存储行号排列（与 EmbeddingStore 的 swap-remove 保持一致）；
+    子类实现 _train / _encode / _approx_scores 以及码本的保存字段
+    """
+
+    kind = None
+
+    def __init__(self, store: EmbeddingStore, rerank_factor: int = None):
+        self.store = store
+        self.rerank_factor = ANN_CONFIG['rerank_factor'] if rerank_factor is None else rerank_factor
+        self.trained = False
+        self._codes: Optional[np.ndarray] = None  # 存储行号 -> 编码
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[:len(self.store)]
+
+    def build(self):
+        """由题库训练码本并编码全部向量"""
+        with self._lock:
+            matrix = self.store.matrix
+            if len(matrix) == 0:
+                self.trained = False
+                self._codes = None
+                return
+            self._train(matrix)
+            self._codes = self._encode_all(matrix)
+            self.trained = True
+
+    def _encode_all(self, matrix: np.ndarray) -> np.ndarray:
+        codes = [self._encode(matrix[start:start + ASSIGN_BATCH])
+                 for start in range(0, len(matrix), ASSIGN_BATCH)]
+        return np.concatenate(codes)
+
+    def add(self, question_id: str, embedding: Optional[np.ndarray]):
+        """插入或更新向量（未训练时只写入存储，查询退化为精确检索；码本不随插入更新）"""
+        with self._lock:
+            self._remove(question_id)
+            row = self.store.add(question_id, embedding)
+            if row is None or not self.trained:
+                return
+            if row >= len(self._codes):
+                codes = np.zeros((max(16, 2 * len(self._codes), row + 1),) + self._codes.shape[1:],
+                                 dtype=self._codes.dtype)
+                codes[:len(self._codes)] = self._codes
+                self._codes = codes
+            self._codes[row] = self._encode(self.store.matrix[row:row + 1])[0]
+
+    def remove(self, question_id: str):
+        with self._lock:
+            self._remove(question_id)
+
+    def _remove(self, question_id: str):
+        moved = self.store.remove(question_id)
+        if moved is None or not self.trained:
+            return
+        row, last = moved
+        if row != last:
+            self._codes[row] = self._codes[last]
+
+    def search(self, query: np.ndarray, top_k: int, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        编码上的近似内积取前 top_k × rerank_factor 个候选，再用 float32 向量精确重排，
+        返回 [(question_id, 余弦相似度), ...]
+        """
+        with self._lock:
+            if not self.trained:
+                return self.store.search(query, top_k, threshold)
+            query = normalize(query)
+            if query is None or len(self.store) == 0:
+                return []
+            codes = self.codes
+            approx = self._approx_scores(query, codes)
+            rows = top_k_indices(approx, max(top_k, 1) * self.rerank_factor)
+            scores = self.store.similarities(query, rows)
+            top = top_k_indices(scores, top_k, threshold)
+            return list(zip(self.store.ids_at(rows[top].tolist()), scores[top].tolist()))
+
+    @abstractmethod
+    def _train(self, matrix: np.ndarray):
+        """由 (n, dim) 的归一化向量训练码本"""
+
+    @abstractmethod
+    def _encode(self, matrix: np.ndarray) -> np.ndarray:
+        """(n, dim) 的向量 -> n 行编码"""
+
+    @abstractmethod
+    def _approx_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """归一化查询向量与各行编码的近似内积"""
+
+    @abstractmethod
+    def _codebook(self) -> Dict[str, np.ndarray]:
+        """保存到索引文件的码本字段"""
+
+    @abstractmethod
+    def _set_codebook(self, data) -> bool:
+        """从索引文件读取码本；与存储维度不一致时返回 False"""
+
+    def save(self, path: str):
+        """保存码本和编码（float32 向量不保存）"""
+        with self._lock:
+            if not self.trained:
+                return
+            np.savez(path, codes=self.codes,
+                     question_ids=np.array(self.store.question_ids, dtype=str),
+                     **self._codebook())
+
+    def load(self, path: str) -> bool:
+        """读取已保存的码本和编码；题目与存储不一致时返回 False（需要重新 build）"""
+        if not os.path.exists(path):
+            return False
+        try:
+            data = np.load(path)
+            if data['question_ids'].tolist() != self.store.question_ids:
+                return False
+            with self._lock:
+                if not self._set_codebook(data):
+                    return False
+                self._codes = data['codes']
+                self.trained = True
+            return True
+        except Exception as e:
+            print(f"[Warning] Failed to load {self.kind} index {path}: {e}")
+            return False
+
+
+class SQ8Index(_QuantizedIndex):
+    """
+    int8 标量量化：每维按题库中的最小值和范围线性映射到 0..255，压缩 4 倍
+
+    x ≈ low + scale * code，近似内积 q·x ≈ q·low + (q*scale)·code
+    """
+
+    kind = 'sq8'
+
+    def __init__(self, store: EmbeddingStore, rerank_factor: int = None):
+        super().__init__(store, rerank_factor)
+        self.low: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def _train(self, matrix: np.ndarray):
+        low = np.asarray(matrix.min(axis=0), dtype=np.float32)
+        high = np.asarray(matrix.max(axis=0), dtype=np.float32)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        self.low, self.scale = low, scale.astype(np.float32)
+
+    def _encode(self, matrix: np.ndarray) -> np.ndarray:
+        codes = np.rint((matrix - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _approx_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        weights = query * self.scale
+        scores = np.concatenate([codes[start:start + SCORE_BATCH].astype(np.float32) @ weights
+                                 for start in range(0, len(codes), SCORE_BATCH)])
+        return scores + float(query @ self.low)
+
+    def _codebook(self) -> Dict[str, np.ndarray]:
+        return {'low': self.low, 'scale': self.scale}
+
+    def _set_codebook(self, data) -> bool:
+        if data['low'].shape != (self.store.dim,):
+            return False
+        self.low = data['low'].astype(np.float32)
+        self.scale = data['scale'].astype(np.float32)
+        return True
+
+
+class PQIndex(_QuantizedIndex):
+    """
+    乘积量化：向量切成 m 个子空间，每个子空间用 k-means 训练 256 个码字，
+    每道题只存 m 个字节（2048 维、m=64 时每题 64 字节，压缩 128 倍）
+
+    查询时先算查询子向量与各码字的内积表（m × 256），近似内积为各子空间查表之和
+    """
+
+    kind = 'pq'
+
+    def __init__(self, store: EmbeddingStore, subspaces: int = None, rerank_factor: int = None):
+        super().__init__(store, rerank_factor)
+        subspaces = ANN_CONFIG['pq_subspaces'] if subspaces is None else subspaces
+        # 子空间数需整除维度
+        self.subspaces = int(np.gcd(subspaces, store.dim)) if store.dim else subspaces
+        self.codebooks: Optional[np.ndarray] = None  # (m, 码字数, 子空间维度)
+
+    def _split(self, matrix: np.ndarray) -> np.ndarray:
+        """(n, dim) -> (m, n, 子空间维度)"""
+        return matrix.reshape(len(matrix), self.subspaces, -1).transpose(1, 0, 2)
+
+    def _train(self, matrix: np.ndarray):
+        rng = np.random.default_rng(KMEANS_SEED)
+        sample_size = min(len(matrix), PQ_CODEWORDS * KMEANS_SAMPLES_PER_LIST)
+        sample = matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))]
+        parts = self._split(np.ascontiguousarray(sample))
+        codebooks = [kmeans(part, PQ_CODEWORDS) for part in parts]
+        # 样本少于 256 条时码字数相应减少，补齐为相同形状（补齐的码字不会被选中）
+        codewords = max(len(c) for c in codebooks)
+        self.codebooks = np.stack([np.pad(c, ((0, codewords - len(c)), (0, 0)), mode='edge')
+                                   for c in codebooks]).astype(np.float32)
+
+    def _encode(self, matrix: np.ndarray) -> np.ndarray:
+        parts = self._split(np.ascontiguousarray(matrix, dtype=np.float32))
+        return np.stack([nearest_centroids(part, codebook)
+                         for part, codebook in zip(parts, self.codebooks)], axis=1).astype(np.uint8)
+
+    def _approx_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # 内积表 (m, 码字数)
+        table = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.subspaces, -1))
+        # 按子空间逐列查表累加（先转成列连续，take 比二维花式索引快数倍）
+        columns = np.ascontiguousarray(codes.T)
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for subspace in range(self.subspaces):
+            scores += table[subspace].take(columns[subspace])
+        return scores
+
+    def _codebook(self) -> Dict[str, np.ndarray]:
+        return {'codebooks': self.codebooks}
+
+    def _set_codebook(self, data) -> bool:
+        codebooks = data['codebooks']
+        if codebooks.shape[0] * codebooks.shape[2] != self.store.dim:
+            return False
+        self.codebooks = codebooks.astype(np.float32)
+        self.subspaces = codebooks.shape[0]
+        return True
+
+
+def create_index(store: EmbeddingStore, backend: Optional[str] = None):
+    """
+    按配置为存储创建索引（未 build）
+
+    backend: 'flat' / 'ivf' / 'hnsw' / 'sq8' / 'pq' / 'auto'（默认 ANN_CONFIG['backend']）；
+    'auto' 时题目数少于 ANN_CONFIG['min_size'] 用精确检索，否则优先 hnswlib，其次 IVF
+    """
+    backend = backend or ANN_CONFIG['backend']
+    if backend == 'auto':
+        if len(store) < ANN_CONFIG['min_size']:
+            backend = 'flat'
+        else:
+            backend = 'hnsw' if HNSWLIB_AVAILABLE else 'ivf'
+    if backend == 'hnsw' and not HNSWLIB_AVAILABLE:
+        print("[Warning] hnswlib not installed, using IVF index")
+        backend = 'ivf'
+    if backend == 'hnsw':
+        return HNSWIndex(store)
+    if backend == 'ivf':
+        return IVFFlatIndex(store, nlist=ANN_CONFIG['nlist'])
+    if backend == 'sq8':
+        return SQ8Index(store)
+    if backend == 'pq':
+        return PQIndex(store)
+    return FlatIndex(store)
+
+
+def load_or_build_index(store: EmbeddingStore, name: str, backend: Optional[str] = None,
+                        index_dir: Optional[str] = None):
+    """
+    创建索引：ANN_CONFIG['index_dir'] 中已有与存储一致的索引文件时直接读取，否则重新训练并保存
+
+    Args:
+        store: 向量存储
+        name: 索引文件名（如 'text'、'image'），ANN_CONFIG['backend_overrides'] 可为其单独指定后端
+    """
+    index = create_index(store, backend or ANN_CONFIG['backend_overrides'].get(name))
+    if index.kind == 'flat':
+        return index
+    index_dir = index_dir or ANN_CONFIG['index_dir']
+    path = os.path.join(index_dir, f"{name}.{index.kind}" + ('.bin' if index.kind == 'hnsw' else '.npz'))
+    if index.load(path):
+        print(f"[Info] Loaded {index.kind} index {path} ({len(index)} vectors)")
+        return index
+    index.build()
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        index.save(path)
+    except Exception as e:
+        print(f"[Warning] Failed to save {index.kind} index {path}: {e}")
+    print(f"[Info] Built {index.kind} index for {len(index)} {name} vectors")
+    return index
@@ -0,0 +1,363 @@
+"""
+答案语料库
+启动时把答案目录读入内存，预先计算每个答案的小写文本、数字集合和关键词出现情况，
+之后由目录监视器推送变化增量更新；文本匹配时不再读取答案文件
+
+打分时整个题库一次向量化计算：关键词/公式特征按词存成稀疏倒排（每个词对应包含它的答案行号），
+数字也存成稀疏倒排，学科和文本长度存成数组。
+为了与逐文件计算的结果逐位一致，各项按原来的顺序逐项累加，而不是做一次矩阵乘法
+（浮点加法顺序不同会产生末位误差）
+
+另外维护一份字符 n-gram 的 BM25 倒排索引（见 text_index.py），随答案增删同步更新
+"""
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from keyword_automaton import get_keyword_automaton
+from text_index import BM25Index
+
+# 题目类型关键词及权重
+TYPE_KEYWORDS = {
+    '求': 0.05, '计算': 0.05, '证明': 0.05, '判断': 0.05,
+    '极值': 0.1, '极大值': 0.1, '极小值': 0.1, '最值': 0.1,
+    '导数': 0.08, '积分': 0.08, '微分': 0.08, '级数': 0.08,
+    '泰勒': 0.1, 'taylor': 0.1, 'sin': 0.08, 'cos': 0.08,
+    '复数': 0.08, '复变': 0.08, '解析': 0.08,
+    '矩阵': 0.08, '特征值': 0.08, '行列式': 0.08,
+    '电路': 0.08, '电压': 0.08, '电流': 0.08, '电阻': 0.08
+}
+
+# 数学符号和公式特征及权重
+MATH_PATTERNS = [
+    ('f(x)', 0.1), ('f(z)', 0.1), ('x²', 0.05), ('x^2', 0.05),
+    ('x³', 0.05), ('x^3', 0.05), ('∫', 0.05), ('∑', 0.05),
+    ('lim', 0.05), ('sin', 0.05), ('cos', 0.05), ('tan', 0.05),
+    ('z₀', 0.05), ('z_0', 0.05), ('z0', 0.05)
+]
+
+# 题号前缀对应的学科关键词
+SUBJECT_MAP = {
+    'calculus': ['微积分', '导数', '积分', '极值', 'f(x)'],
+    'complex': ['复变', '复数', 'z', '解析', 'taylor', '泰勒'],
+    'physics': ['物理', '力', '速度', '加速度', '能量'],
+    'circuit': ['电路', '电压', '电流', '电阻', '功率'],
+    'mechanics': ['力学', '动力', '静力', '平衡', '力矩']
+}
+
+# 需要预先检查是否出现在答案中的词
+VOCABULARY = tuple(dict.fromkeys(list(TYPE_KEYWORDS) + [p for p, _ in MATH_PATTERNS]))
+
+# 词表登记到共享的关键词自动机，一次扫描得到全部命中
+_automaton = get_keyword_automaton()
+_automaton.add_vocabulary('type_keyword', TYPE_KEYWORDS)
+_automaton.add_vocabulary('math_pattern', MATH_PATTERNS)
+for _subject_key, _subject_keywords in SUBJECT_MAP.items():
+    for _keyword in _subject_keywords:
+        _automaton.add(_keyword, 'subject', label=_subject_key)
+
+
+def extract_keywords(text: str) -> Tuple[frozenset, frozenset, frozenset]:
+    """
+    一次扫描得到文本中出现的 (题型关键词集合, 公式特征集合, 命中的学科前缀集合)
+    （与逐词 `keyword in text.lower()` 的结果相同）
+    """
+    type_keywords, math_patterns, subjects = set(), set(), set()
+    for _, keyword in _automaton.scan(text):
+        if keyword.category == 'type_keyword':
+            type_keywords.add(keyword.pattern)
+        elif keyword.category == 'math_pattern':
+            math_patterns.add(keyword.pattern)
+        elif keyword.category == 'subject':
+            subjects.add(keyword.label)
+    return frozenset(type_keywords), frozenset(math_patterns), frozenset(subjects)
+
+_NUMBER_PATTERN = re.compile(r'\d+')
+
+# 出现在超过 1/DENSE_TERM_RATIO 的答案中的词使用稠密列存储
+DENSE_TERM_RATIO = 8
+
+
+class AnswerEntry:
+    """单个答案的预处理结果"""
+
+    __slots__ = ('question_id', 'text', 'lower', 'numbers', 'terms', 'length')
+
+    def __init__(self, question_id: str, text: str):
+        self.question_id = question_id
+        self.text = text
+        self.lower = text.lower()
+        self.numbers = frozenset(_NUMBER_PATTERN.findall(self.lower))
+        type_keywords, math_patterns, _ = extract_keywords(text)
+        self.terms = type_keywords | math_patterns
+        self.length = len(self.lower)
+
+
+class QueryFeatures:
+    """OCR 文本的预处理结果（每次搜索只计算一次）"""
+
+    def __init__(self, ocr_text: str):
+        self.text = ocr_text
+        self.lower = ocr_text.lower()
+        self.numbers = set(_NUMBER_PATTERN.findall(self.lower))
+        type_keywords, math_patterns, self.subjects = extract_keywords(ocr_text)
+        # 保持词表顺序（打分时按此顺序累加）
+        self.type_keywords = [(k, w) for k, w in TYPE_KEYWORDS.items() if k in type_keywords]
+        self.math_patterns = [(p, w) for p, w in MATH_PATTERNS if p in math_patterns]
+
+
+def calculate_text_similarity(question_id, ocr_text, answers_dir):
+    """
+    计算文本相似度 - 智能匹配
+    通过答案文件内容和OCR文本的关键词匹配
+    （逐文件读取的参考实现，搜索时使用 AnswerCorpus 的向量化打分）
+    """
+    answer_file = os.path.join(answers_dir, f"{question_id}.txt")
+    
+    if not os.path.exists(answer_file):
+        return 0.0
+    
+    try:
+        # 读取答案文件
+        with open(answer_file, 'r', encoding='utf-8') as f:
+            answer_content = f.read().lower()
+        
+        ocr_lower = ocr_text.lower()
+        
+        # 基础分数
+        similarity = 0.0
+        
+        # 1. 检查题目类型关键词（权重：0.3）
+        for keyword, weight in TYPE_KEYWORDS.items():
+            if keyword in ocr_lower and keyword in answer_content:
+                similarity += weight
+        
+        # 2. 检查数学符号和公式特征（权重：0.2）
+        for pattern, weight in MATH_PATTERNS:
+            if pattern in ocr_lower and pattern in answer_content:
+                similarity += weight
+        
+        # 3. 检查数字特征（权重：0.15）
+        ocr_numbers = set(re.findall(r'\d+', ocr_lower))
+        answer_numbers = set(re.findall(r'\d+', answer_content))
+        
+        if ocr_numbers and answer_numbers:
+            common_numbers = ocr_numbers & answer_numbers
+            if common_numbers:
+                similarity += 0.15 * (len(common_numbers) / max(len(ocr_numbers), len(answer_numbers)))
+        
+        # 4. 学科分类加分（权重：0.1）
+        for subject_key, subject_keywords in SUBJECT_MAP.items():
+            if subject_key in question_id.lower():
+                for keyword in subject_keywords:
+                    if keyword in ocr_lower:
+                        similarity += 0.1
+                        break
+                break
+        
+        # 5. 文本长度相似度加分（权重：0.05）
+        if len(ocr_text) > 10:
+            length_ratio = min(len(ocr_text), len(answer_content)) / max(len(ocr_text), len(answer_content))
+            if length_ratio > 0.3:
+                similarity += 0.05 * length_ratio
+        
+        # 限制在0-1之间
+        return min(similarity, 1.0)
+        
+    except Exception as e:
+        print(f"[Warning] Text similarity calculation failed for {question_id}: {e}")
+        return 0.0
+
+
+class _ScoringIndex:
+    """题库的向量化打分结构（语料变化后重新构建）"""
+
+    def __init__(self, entries: Dict[str, AnswerEntry]):
+        self.question_ids = sorted(entries)
+        ordered = [entries[question_id] for question_id in self.question_ids]
+        n = len(ordered)
+
+        # 关键词/公式特征的稀疏倒排 {词: 包含该词的行号数组}；
+        # 出现在大部分答案中的词改存 0/1 稠密列，整列相加比按行号散列写入更快
+        rows_by_term: Dict[str, List[int]] = {}
+        for row, entry in enumerate(ordered):
+            for term in entry.terms:
+                rows_by_term.setdefault(term, []).append(row)
+        self.term_rows: Dict[str, np.ndarray] = {}
+        self.term_columns: Dict[str, np.ndarray] = {}
+        for term, rows in rows_by_term.items():
+            if len(rows) * DENSE_TERM_RATIO > n:
+                column = np.zeros(n, dtype=np.float64)
+                column[rows] = 1.0
+                self.term_columns[term] = column
+            else:
+                self.term_rows[term] = np.array(rows, dtype=np.int64)
+
+        # 数字的稀疏倒排 {数字: 包含该数字的行号数组} 和每行的数字个数
+        rows_by_number: Dict[str, List[int]] = {}
+        for row, entry in enumerate(ordered):
+            for number in entry.numbers:
+                rows_by_number.setdefault(number, []).append(row)
+        self.number_rows = {number: np.array(rows, dtype=np.int64) for number, rows in rows_by_number.items()}
+        self.number_counts = np.array([len(entry.numbers) for entry in ordered], dtype=np.int64)
+
+        # 学科序号（题号不含任何学科前缀时为 len(SUBJECT_MAP)）
+        subject_keys = list(SUBJECT_MAP)
+        self.subjects = np.full(n, len(subject_keys), dtype=np.int64)
+        for row, entry in enumerate(ordered):
+            question_id = entry.question_id.lower()
+            for i, subject_key in enumerate(subject_keys):
+                if subject_key in question_id:
+                    self.subjects[row] = i
+                    break
+
+        self.lengths = np.array([entry.length for entry in ordered], dtype=np.int64)
+
+    def scores(self, query: QueryFeatures) -> np.ndarray:
+        """所有答案的相似度，与 question_ids 一一对应"""
+        n = len(self.question_ids)
+        similarity = np.zeros(n, dtype=np.float64)
+
+        # 1. 题目类型关键词  2. 数学符号和公式特征
+        # （稠密列中不含该词的行加的是 0.0，不改变累加结果）
+        for term, weight in query.type_keywords + query.math_patterns:
+            rows = self.term_rows.get(term)
+            if rows is not None:
+                similarity[rows] += weight
+            elif term in self.term_columns:
+                similarity += weight * self.term_columns[term]
+
+        # 3. 数字特征：合并查询中各数字的倒排，统计每行共有的数字个数
+        postings = [self.number_rows[x] for x in query.numbers if x in self.number_rows]
+        if postings:
+            common = np.bincount(np.concatenate(postings), minlength=n)
+            rows = np.flatnonzero(common)
+            similarity[rows] += 0.15 * (
+                common[rows] / np.maximum(len(query.numbers), self.number_counts[rows])
+            )
+
+        # 4. 学科分类加分
+        subject_hits = np.array([subject_key in query.subjects for subject_key in SUBJECT_MAP] + [False])
+        similarity[subject_hits[self.subjects]] += 0.1
+
+        # 5. 文本长度相似度加分
+        query_length = len(query.text)
+        if query_length > 10:
+            length_ratio = (np.minimum(self.lengths, query_length)
+                            / np.maximum(self.lengths, query_length))
+            rows = length_ratio > 0.3
+            similarity[rows] += 0.05 * length_ratio[rows]
+
+        return np.minimum(similarity, 1.0)
+
+
+class AnswerCorpus:
+    """内存中的答案语料库（question_id -> AnswerEntry）"""
+
+    def __init__(self, answers_dir: str):
+        self.answers_dir = answers_dir
+        self._entries: Dict[str, AnswerEntry] = {}
+        self._index: Optional[_ScoringIndex] = None
+        self._bm25 = BM25Index()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self._entries
+
+    def load(self) -> int:
+        """读取答案目录中的全部答案"""
+        entries = {}
+        for filename in os.listdir(self.answers_dir):
+            if filename.endswith('.txt'):
+                entry = self._read(filename)
+                if entry is not None:
+                    entries[entry.question_id] = entry
+        bm25 = BM25Index()
+        for question_id in sorted(entries):
+            bm25.add(question_id, entries[question_id].text)
+        with self._lock:
+            self._entries = entries
+            self._index = None
+            self._bm25 = bm25
+        print(f"[Info] Loaded {len(entries)} answers from {self.answers_dir}")
+        return len(entries)
+
+    def _read(self, filename: str) -> Optional[AnswerEntry]:
+        question_id = os.path.splitext(filename)[0]
+        try:
+            with open(os.path.join(self.answers_dir, filename), 'r', encoding='utf-8') as f:
+                return AnswerEntry(question_id, f.read())
+        except Exception as e:
+            print(f"[Warning] Failed to load answer {filename}: {e}")
+            return None
+
+    def update(self, filename: str):
+        """新增或重新读取一个答案文件"""
+        entry = self._read(filename)
+        question_id = os.path.splitext(filename)[0]
+        with self._lock:
+            if entry is None:
+                self._entries.pop(question_id, None)
+                self._bm25.remove(question_id)
+            else:
+                self._entries[question_id] = entry
+                self._bm25.add(question_id, entry.text)
+            self._index = None
+
+    def remove(self, filename: str):
+        question_id = os.path.splitext(filename)[0]
+        with self._lock:
+            self._entries.pop(question_id, None)
+            self._bm25.remove(question_id)
+            self._index = None
+
+    def get(self, question_id: str) -> Optional[AnswerEntry]:
+        return self._entries.get(question_id)
+
+    def question_ids(self) -> List[str]:
+        return sorted(self._entries)
+
+    def _scoring_index(self) -> _ScoringIndex:
+        with self._lock:
+            if self._index is None:
+                self._index = _ScoringIndex(self._entries)
+            return self._index
+
+    def scores(self, ocr_text: str) -> Tuple[List[str], np.ndarray]:
+        """OCR 文本与所有答案的相似度 (按题号排序的题号列表, 相似度数组)"""
+        index = self._scoring_index()
+        return index.question_ids, index.scores(QueryFeatures(ocr_text))
+
+    def similarities(self, ocr_text: str) -> List[Tuple[str, float]]:
+        """OCR 文本与所有答案的相似度 [(question_id, 相似度), ...]，按题号排序"""
+        question_ids, scores = self.scores(ocr_text)
+        return list(zip(question_ids, scores.tolist()))
+
+    def matches(self, ocr_text: str, threshold: float, top_k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        相似度大于 threshold 的答案 [(question_id, 相似度), ...]
+        按相似度降序，相同分数按题号升序，最多返回 top_k 个
+        """
+        question_ids, scores = self.scores(ocr_text)
+        rows = np.flatnonzero(scores > threshold)
+        if top_k is not None and len(rows) > top_k:
+            # 先用第 top_k 大的分数筛掉其余行（保留并列），再稳定排序
+            kth = np.partition(scores[rows], len(rows) - top_k)[len(rows) - top_k]
+            rows = rows[scores[rows] >= kth]
+        rows = rows[np.argsort(-scores[rows], kind='stable')][:top_k]
+        return [(question_ids[row], float(scores[row])) for row in rows]
+
+    def bm25_matches(self, ocr_text: str, threshold: float, top_k: int = 5) -> List[Tuple[str, float]]:
+        """
+        BM25 检索 [(question_id, 归一化分数), ...]，按分数降序
+        归一化分数为查询 n-gram 按 idf 加权后被答案覆盖的比例，只返回大于 threshold 的结果
+        """
+        return [(question_id, normalized)
+                for question_id, _, normalized in self._bm25.search(ocr_text, top_k)
+                if normalized > threshold]
@@ -9,10 +9,11 @@ import os
 from werkzeug.utils import secure_filename
 import traceback
 
-from config import FLASK_CONFIG, UPLOAD_CONFIG, config as ai_config
+from config import FLASK_CONFIG, UPLOAD_CONFIG, MATCHING_CONFIG, config as ai_config
 from database import QuestionDatabase
 from ocr_service import get_ocr_service
 from matcher import get_matcher
+from formula_index import get_formula_index
 from ai_service import ai_service
 
 # 初始化 Flask 应用
@@ -23,6 +24,8 @@ CORS(app)  # 允许跨域请求
 db = QuestionDatabase()
 ocr_service = get_ocr_service()
 matcher = get_matcher(db)
+# 共享的公式索引，已由匹配器的候选检索（RetrievalPipeline）从数据库加载
+formula_index = get_formula_index()
 
 # 打印配置状态
 ai_config.print_status()
@@ -76,8 +79,19 @@ def search_question():
         ocr_result = ocr_service.recognize_image(upload_path)
         ocr_text = ocr_result['text']
         
-        # 题目匹配（使用ML增强）
-        matches = matcher.match_question(upload_path, ocr_text, use_ml=True)
+        # 公式精确匹配：查询中的公式全部命中时直接返回，跳过向量检索和AI解答
+        formulas = [f['latex'] for f in ocr_result.get('formulas', [])]
+        formula_matches = formula_index.lookup_text(ocr_text, formulas)
+        matches = []
+        if formula_matches and formula_matches[0][1] >= 1.0:
+            for question_id, similarity in formula_matches[:MATCHING_CONFIG['top_k']]:
+                question = db.get_question_by_id(question_id)
+                if question:
+                    matches.append({'question_id': question_id, 'question': question, 'similarity': similarity})
+        
+        # 题目匹配（先由廉价索引收集候选，再只对候选做向量和ML增强打分）
+        if not matches:
+            matches = matcher.match_question(upload_path, ocr_text, use_ml=True, formulas=formulas)
         
         # 格式化结果
         results = []
@@ -105,6 +119,7 @@ def search_question():
                 'category': question.get('category'),
                 'confidence': ocr_result.get('confidence', 0),
                 'ml_similarity': match.get('ml_similarity'),  # ML增强分数
+                'source_scores': match.get('source_scores'),  # 各检索来源的原始分数
                 'source': 'database'  # 标记来源
             })
         
@@ -214,6 +229,36 @@ def list_questions():
         }), 500
 
 
+@app.route('/api/questions/search', methods=['GET'])
+def search_questions_text():
+    """
+    全文检索题库（OCR 文本、公式和答案）
+
+    Query Parameters:
+        - q: 查询文本
+        - category: 类别过滤（可选）
+        - limit: 返回数量（默认10）
+    """
+    try:
+        text = request.args.get('q', '')
+        category = request.args.get('category')
+        limit = min(int(request.args.get('limit', 10)), 100)
+
+        results = db.search_text(text, limit=limit, category=category)
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'total': len(results),
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/question/<question_id>', methods=['GET'])
 def get_question(question_id):
     """
@@ -12,17 +12,30 @@ import json
 from datetime import datetime
 import re
 import random
+import threading
+import hashlib
+import itertools
+import unicodedata
 
 # 导入自定义模块
+from file_watcher import watch_directory, DELETED
+from bounded_cache import BoundedCache, get_cache_stats
+from answer_corpus import AnswerCorpus
+from keyword_automaton import get_keyword_automaton
+from formula_index import get_formula_index
+from minhash_index import MinHashLSH
+from config import RETRIEVAL_CONFIG
+from retrieval import gather_candidates
+
 try:
-    from image_matcher import find_similar_from_bytes, preload_image_hashes
+    from image_matcher import find_similar_fused, find_similar_tiled, preload_image_hashes, watch_image_folder
     IMAGE_MATCHER_AVAILABLE = True
 except ImportError:
     IMAGE_MATCHER_AVAILABLE = False
     print("[Warning] image_matcher not available, using basic matching")
 
 try:
-    from database import get_extended_db, init_all_tables
+    from database import get_extended_db, init_all_tables, get_db_path, get_question_db
     DATABASE_AVAILABLE = True
 except ImportError:
     DATABASE_AVAILABLE = False
@@ -38,6 +51,41 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, '../data/uploads')
 QUESTION_IMAGES_DIR = os.path.join(BASE_DIR, '../data/question_images')
 ANSWERS_DIR = os.path.join(BASE_DIR, '../data/answers')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'gif', 'webp'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+# 搜索结果缓存：同一张照片（内容SHA-256）或同一段OCR文本直接返回之前的结果
+QUERY_CACHE_TTL = 30 * 60
+QUERY_CACHE_MAX_ENTRIES = 1024
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_query_cache_by_image = BoundedCache(
+    max_entries=QUERY_CACHE_MAX_ENTRIES,
+    max_bytes=QUERY_CACHE_MAX_BYTES,
+    ttl=QUERY_CACHE_TTL,
+    name='search_by_image'
+)
+_query_cache_by_text = BoundedCache(
+    max_entries=QUERY_CACHE_MAX_ENTRIES,
+    max_bytes=QUERY_CACHE_MAX_BYTES,
+    ttl=QUERY_CACHE_TTL,
+    name='search_by_ocr_text'
+)
+
+# 题库内容版本：题目图片或答案变化时递增，缓存键带上版本号，
+# 变化前开始、变化后才写入缓存的搜索结果也不会再被读到
+_bank_generations = itertools.count()
+_bank_generation = next(_bank_generations)
+
+
+def _invalidate_query_cache():
+    """题库内容变化后丢弃所有缓存的搜索结果"""
+    global _bank_generation
+    _bank_generation = next(_bank_generations)
+    _query_cache_by_image.clear()
+    _query_cache_by_text.clear()
+
+# 整图匹配最高分低于该值时，追加分块匹配（局部拍摄、旋转拍摄的照片）
+TILED_FALLBACK_THRESHOLD = 0.8
 
 # 创建必要目录
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -51,6 +99,100 @@ if DATABASE_AVAILABLE:
     except Exception as e:
         print(f"[Warning] Database init failed: {e}")
 
+# ==================== 题库文件索引 ====================
+# 启动时扫描一次，之后由目录监视器增量维护，处理请求时不再扫描目录
+_question_images = {}  # question_id -> 图片文件名
+_answer_ids = set()
+_answer_corpus = AnswerCorpus(ANSWERS_DIR)  # 答案内容（文本匹配用）
+_near_duplicates = MinHashLSH()  # 题库题目 OCR 文本的 MinHash 签名（近似重复查找用）
+_content_watchers = []
+_content_ready = threading.Event()  # 初始扫描完成
+# 监视器回调也持有该锁：初始扫描期间到达的事件等扫描完成后再按顺序应用
+_content_lock = threading.RLock()
+
+
+def _on_question_image_event(event, filename):
+    """题目图片目录变化"""
+    if not filename.lower().endswith(IMAGE_EXTENSIONS):
+        return
+    question_id = os.path.splitext(filename)[0]
+    with _content_lock:
+        if event == DELETED:
+            if _question_images.get(question_id) == filename:
+                del _question_images[question_id]
+        else:
+            _question_images[question_id] = filename
+        _invalidate_query_cache()
+
+
+def _on_answer_event(event, filename):
+    """答案目录变化"""
+    question_id = os.path.splitext(filename)[0]
+    with _content_lock:
+        if event == DELETED:
+            _answer_ids.discard(question_id)
+            _answer_corpus.remove(filename)
+        else:
+            _answer_ids.add(question_id)
+            _answer_corpus.update(filename)
+        _invalidate_query_cache()
+
+
+def init_content_index():
+    """
+    启动目录监视器并扫描题库目录（只执行一次）
+
+    先启动监视器取得基线再扫描，两者之间新增的文件由扫描补上，之后的变化由监视器推送
+    """
+    with _content_lock:
+        if _content_ready.is_set():
+            return
+        
+        if IMAGE_MATCHER_AVAILABLE:
+            try:
+                # 预加载图像指纹（加速首次搜索）
+                preload_image_hashes(QUESTION_IMAGES_DIR)
+                _content_watchers.append(
+                    watch_image_folder(QUESTION_IMAGES_DIR, on_change=_on_question_image_event)
+                )
+            except Exception as e:
+                print(f"[Warning] Failed to preload image hashes: {e}")
+        
+        if not _content_watchers:
+            _content_watchers.append(
+                watch_directory(QUESTION_IMAGES_DIR, _on_question_image_event, extensions=IMAGE_EXTENSIONS)
+            )
+        _content_watchers.append(
+            watch_directory(ANSWERS_DIR, _on_answer_event, extensions={'.txt'})
+        )
+        
+        for filename in os.listdir(QUESTION_IMAGES_DIR):
+            _on_question_image_event('added', filename)
+        for filename in os.listdir(ANSWERS_DIR):
+            if filename.endswith('.txt'):
+                _answer_ids.add(os.path.splitext(filename)[0])
+        _answer_corpus.load()
+        
+        if DATABASE_AVAILABLE:
+            try:
+                get_formula_index().load_from_database(get_db_path())
+            except Exception as e:
+                print(f"[Warning] Failed to build formula index: {e}")
+            try:
+                for question_id, signature in get_question_db().get_minhash_signatures().items():
+                    _near_duplicates.add(question_id, signature)
+                print(f"[Info] MinHash index: {len(_near_duplicates)} questions")
+            except Exception as e:
+                print(f"[Warning] Failed to build MinHash index: {e}")
+        
+        _content_ready.set()
+
+
+def _ensure_content_index():
+    if not _content_ready.is_set():
+        init_content_index()
+
+
 # 知识点标签库
 KNOWLEDGE_TAGS = {
     '高等数学': {
@@ -97,17 +239,64 @@ QUESTION_TYPES = {
     '作图类': ['画图', '作图', '画出', '绘制']
 }
 
+# 后备相似度计算：题号前缀对应的关键词
+SIMPLE_SIMILARITY_KEYWORDS = {
+    'calc': ['微积分', '导数', '积分', '极限'],
+    'calculus': ['微积分', '导数', '积分', '极值'],
+    'phys': ['物理', '力', '能量', '动量'],
+    'physics': ['物理', '力学', '电磁'],
+    'mech': ['力学', '机械', '动力'],
+    'mechanics': ['力学', '静力', '动力'],
+    'circuit': ['电路', '电阻', '电压', '电流'],
+    'complex': ['复变', '复数', '解析']
+}
+
+# 题号关键词对应的分类（按顺序取第一个命中的）
+CATEGORY_RULES = [
+    ('高等数学', ['calc']),
+    ('大学物理', ['phys']),
+    ('电路分析', ['circuit']),
+    ('复变函数', ['complex']),
+    ('理论力学', ['mech']),
+    ('线性代数', ['linear', 'matrix']),
+    ('概率论', ['prob']),
+]
+
+# 以上词表登记到共享的关键词自动机（与答案语料库的词表共用），一次扫描得到全部命中
+_keyword_automaton = get_keyword_automaton()
+for _subject, _info in KNOWLEDGE_TAGS.items():
+    for _keyword in _info['keywords']:
+        _keyword_automaton.add(_keyword, 'knowledge_tag', label=_subject)
+for _qtype, _keywords in QUESTION_TYPES.items():
+    for _keyword in _keywords:
+        _keyword_automaton.add(_keyword, 'question_type', label=_qtype, case_sensitive=True)
+for _key, _words in SIMPLE_SIMILARITY_KEYWORDS.items():
+    for _word in _words:
+        _keyword_automaton.add(_word, 'simple_similarity', label=_key, case_sensitive=True)
+for _category, _keys in CATEGORY_RULES:
+    for _key in _keys:
+        _keyword_automaton.add(_key, 'category_rule', label=_category)
+
+
+def scan_keywords(text):
+    """一次扫描文本，返回命中的 {(词表名称, 标签): {关键词, ...}}"""
+    return _keyword_automaton.hits(text)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def identify_knowledge_tags(text):
-    """识别文本中的知识点标签"""
+def identify_knowledge_tags(text, hits=None):
+    """识别文本中的知识点标签（hits 为 scan_keywords 的结果，已扫描过时传入可避免重复扫描）"""
+    if hits is None:
+        hits = scan_keywords(text)
     tags = []
-    text_lower = text.lower()
     
     for subject, info in KNOWLEDGE_TAGS.items():
+        found = hits.get(('knowledge_tag', subject))
+        if not found:
+            continue
         for keyword in info['keywords']:
-            if keyword.lower() in text_lower:
+            if keyword in found:
                 tags.append({
                     'name': subject,
                     'keyword': keyword,
@@ -117,12 +306,13 @@ def identify_knowledge_tags(text):
     
     return tags
 
-def identify_question_type(text):
+def identify_question_type(text, hits=None):
     """识别题目类型"""
-    for qtype, keywords in QUESTION_TYPES.items():
-        for keyword in keywords:
-            if keyword in text:
-                return qtype
+    if hits is None:
+        hits = scan_keywords(text)
+    for qtype in QUESTION_TYPES:
+        if ('question_type', qtype) in hits:
+            return qtype
     return '综合类'
 
 def generate_difficulty(similarity):
@@ -159,6 +349,12 @@ def simulate_ocr(filename):
     }
 
 
+def normalize_ocr_text(text):
+    """规范化OCR文本（全角转半角、统一大小写、去掉所有空白），作为查询缓存的次级键"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return re.sub(r'\s+', '', text)
+
+
 def perform_real_ocr(image_path):
     """使用真实的豆包OCR进行识别"""
     try:
@@ -224,35 +420,67 @@ def search_question():
         if not allowed_file(file.filename):
             return jsonify({'success': False, 'error': '不支持的文件类型'}), 400
         
-        # 保存文件
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        
-        # 读取图片字节数据（用于图像匹配）
-        with open(filepath, 'rb') as f:
-            image_bytes = f.read()
+        # 读取图片字节数据（用于图像匹配和查询缓存）
+        image_bytes = file.read()
+        generation = _bank_generation
+        image_key = (generation, hashlib.sha256(image_bytes).hexdigest())
         
         # 获取参数
         use_ai = request.form.get('use_ai', 'true').lower() == 'true'
         college = request.form.get('college', '')
         
-        # 使用真实的豆包OCR识别
-        ocr_result = perform_real_ocr(filepath)
-        ocr_text = ocr_result['text']
-        
-        # 识别知识点标签
-        knowledge_tags = identify_knowledge_tags(ocr_text)
-        question_type = identify_question_type(ocr_text)
-        
-        # 增强OCR结果
-        ocr_result['knowledge_tags'] = knowledge_tags
-        ocr_result['question_type'] = question_type
+        # 同一张照片已经搜索过：跳过OCR和匹配
+        cached = _query_cache_by_image.get(image_key)
+        if cached is None:
+            # 保存文件
+            filename = secure_filename(file.filename)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"{timestamp}_{filename}"
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            with open(filepath, 'wb') as f:
+                f.write(image_bytes)
+            
+            # 使用真实的豆包OCR识别
+            ocr_result = perform_real_ocr(filepath)
+            ocr_text = ocr_result['text']
+            
+            # 模拟OCR的结果是随机的，不能缓存
+            cacheable = 'source' in ocr_result
+            text_key = normalize_ocr_text(ocr_text)
+            
+            # 不同照片识别出同一道题：复用之前的匹配结果
+            cached = _query_cache_by_text.get((generation, text_key)) if cacheable and text_key else None
+            if cached is not None:
+                cached = dict(cached, ocr_result=dict(cached['ocr_result'], **ocr_result))
+            else:
+                # 识别知识点标签
+                keyword_hits = scan_keywords(ocr_text)
+                knowledge_tags = identify_knowledge_tags(ocr_text, keyword_hits)
+                question_type = identify_question_type(ocr_text, keyword_hits)
+                
+                # 增强OCR结果
+                ocr_result['knowledge_tags'] = knowledge_tags
+                ocr_result['question_type'] = question_type
+                
+                # 生成搜索结果（传递图片字节数据）
+                results = generate_search_results(ocr_text, use_ai, knowledge_tags, question_type, image_bytes)
+                
+                cached = {
+                    'ocr_result': ocr_result,
+                    'results': results,
+                    'knowledge_tags': knowledge_tags,
+                    'question_type': question_type,
+                }
+                if cacheable and text_key:
+                    _query_cache_by_text.put((generation, text_key), cached)
+            
+            if cacheable:
+                _query_cache_by_image.put(image_key, cached)
         
-        # 生成搜索结果（传递图片字节数据）
-        results = generate_search_results(ocr_text, use_ai, knowledge_tags, question_type, image_bytes)
+        ocr_result = cached['ocr_result']
+        results = cached['results']
+        knowledge_tags = cached['knowledge_tags']
+        question_type = cached['question_type']
         
         return jsonify({
             'success': True,
@@ -560,7 +788,13 @@ def generate_general_answer(text, subject):
 
 
 def generate_database_results(ocr_text, main_subject, knowledge_tags, uploaded_image_bytes=None):
-    """生成题库匹配结果 - 支持图像匹配和文本匹配"""
+    """
+    生成题库匹配结果 - 支持图像匹配和文本匹配
+    
+    第一阶段由公式索引、图像哈希、关键词/BM25 文本检索和 MinHash 各自给出候选
+    （每个来源最多 source_limit 个），用倒数名次融合合并排序，
+    第二阶段只读取融合排名前5的候选的答案生成结果
+    """
     results = []
     
     if not os.path.exists(QUESTION_IMAGES_DIR):
@@ -570,116 +804,123 @@ def generate_database_results(ocr_text, main_subject, knowledge_tags, uploaded_i
         print(f"[Warning] Answers directory not found: {ANSWERS_DIR}")
         return results
     
-    # 获取所有图片文件
-    image_files = []
-    if os.path.exists(QUESTION_IMAGES_DIR):
-        for file in os.listdir(QUESTION_IMAGES_DIR):
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif')):
-                image_files.append(file)
+    _ensure_content_index()
+    print(f"[Info] Found {len(_question_images)} images in question_images directory")
     
-    print(f"[Info] Found {len(image_files)} images in question_images directory")
+    source_limit = RETRIEVAL_CONFIG['source_limit']
     
-    # ==================== 方式1: 图像相似度匹配 ====================
+    # ==================== 第一阶段 ====================
+    # 方式0: 公式精确匹配
+    # 查询中的公式全部命中某道题时直接返回，不再做图像和文本匹配
+    formula_matches = get_formula_index().lookup_text(ocr_text)
+    if formula_matches:
+        print(f"[Info] Formula index found {len(formula_matches)} matches")
+    if formula_matches and formula_matches[0][1] >= 1.0:
+        for question_id, similarity in formula_matches[:5]:
+            results.append(_database_result(question_id, similarity, 'formula', main_subject, knowledge_tags))
+        return results
+    
+    # 方式1: 图像相似度匹配
     image_matches = []
     if IMAGE_MATCHER_AVAILABLE and uploaded_image_bytes:
         try:
-            image_matches = find_similar_from_bytes(
+            image_matches = find_similar_fused(
                 uploaded_image_bytes, 
                 QUESTION_IMAGES_DIR, 
-                algorithm='phash', 
-                threshold=0.5
+                threshold=0.5,
+                top_k=source_limit
             )
             print(f"[Info] Image matcher found {len(image_matches)} matches")
+            
+            if not image_matches or image_matches[0][1] < TILED_FALLBACK_THRESHOLD:
+                tiled_matches = find_similar_tiled(
+                    uploaded_image_bytes,
+                    QUESTION_IMAGES_DIR,
+                    top_k=source_limit,
+                    min_score=0.15
+                )
+                print(f"[Info] Tiled matcher found {len(tiled_matches)} matches")
+                tiled_files = {img_file for img_file, _ in tiled_matches}
+                image_matches = tiled_matches + [m for m in image_matches if m[0] not in tiled_files]
         except Exception as e:
             print(f"[Warning] Image matching failed: {e}")
+    image_matches = [(os.path.splitext(img_file)[0], similarity) for img_file, similarity in image_matches]
     
-    # 处理图像匹配结果
-    if image_matches:
-        for img_file, similarity in image_matches[:5]:
-            question_id = os.path.splitext(img_file)[0]
-            answer_text = load_answer_file(question_id)
-            
-            result = {
-                'question_id': question_id,
-                'similarity': round(similarity, 2),
-                'category': main_subject,
-                'source': 'database',
-                'match_type': 'image',
-                'confidence': round(similarity, 2),
-                'answer': answer_text,
-                'knowledge_tags': knowledge_tags,
-                'difficulty': generate_difficulty(similarity),
-                'image_path': img_file,
-                'image_url': f'/api/question_image/{img_file}'
-            }
-            results.append(result)
+    # 方式2: 文本内容匹配
+    # 用内存中的答案语料库对所有答案打分（文本匹配阈值 0.3）
+    text_matches = _answer_corpus.matches(ocr_text, 0.3, top_k=source_limit)
+    print(f"[Info] Text matcher found {len(text_matches)} matches")
     
-    # ==================== 方式2: 文本内容匹配（新增） ====================
-    # 扫描所有答案文件，通过文本相似度匹配
-    text_matches = []
-    if os.path.exists(ANSWERS_DIR):
-        for answer_file in os.listdir(ANSWERS_DIR):
-            if answer_file.endswith('.txt') and answer_file != '.gitkeep':
-                question_id = os.path.splitext(answer_file)[0]
-                
-                # 计算文本相似度
-                similarity = calculate_text_similarity(question_id, ocr_text, ANSWERS_DIR)
-                
-                if similarity > 0.3:  # 文本匹配阈值
-                    text_matches.append((question_id, similarity))
-        
-        # 按相似度排序
-        text_matches.sort(key=lambda x: x[1], reverse=True)
-        print(f"[Info] Text matcher found {len(text_matches)} matches")
-        
-        # 添加文本匹配结果（避免重复）
-        existing_ids = {r['question_id'] for r in results}
-        for question_id, similarity in text_matches[:5]:
-            if question_id not in existing_ids:
-                answer_text = load_answer_file(question_id)
-                
-                # 检查是否有对应图片
-                has_image = False
-                image_url = None
-                for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif']:
-                    img_path = os.path.join(QUESTION_IMAGES_DIR, f"{question_id}{ext}")
-                    if os.path.exists(img_path):
-                        has_image = True
-                        image_url = f'/api/question_image/{question_id}{ext}'
-                        break
-                
-                result = {
-                    'question_id': question_id,
-                    'similarity': round(similarity, 2),
-                    'category': main_subject,
-                    'source': 'database',
-                    'match_type': 'text',
-                    'confidence': round(similarity, 2),
-                    'answer': answer_text,
-                    'knowledge_tags': knowledge_tags,
-                    'difficulty': generate_difficulty(similarity),
-                    'image_path': None if not has_image else f"{question_id}{ext}",
-                    'image_url': image_url
-                }
-                results.append(result)
+    # BM25 字符 n-gram 检索补充关键词匹配漏掉的题目（作为单独的来源参与融合）
+    bm25_matches = _answer_corpus.bm25_matches(ocr_text, 0.3, top_k=source_limit)
+    print(f"[Info] BM25 matcher found {len(bm25_matches)} matches")
     
-    # 按相似度排序
-    results.sort(key=lambda x: x['similarity'], reverse=True)
+    # 方式3: 题库中 OCR 文本近似重复的题目（MinHash/LSH）
+    near_matches = _near_duplicates.query_text(ocr_text)
+    if near_matches:
+        print(f"[Info] MinHash index found {len(near_matches)} near duplicates")
     
-    # 最多返回5个结果
-    return results[:5]
+    # 各来源的分数尺度不同，只按名次融合；同一题被多个来源命中时，
+    # 展示的相似度和匹配方式取列表中靠前的来源
+    sources = [
+        ('image', image_matches),
+        ('text', text_matches),
+        ('bm25', bm25_matches),
+        ('formula', formula_matches),
+        ('near_duplicate', near_matches),
+    ]
+    candidates = gather_candidates(sources)
+    
+    # ==================== 第二阶段 ====================
+    # 候选已按融合分数排序，读取前5个候选的答案
+    for question_id in candidates.question_ids(5):
+        scores = candidates.scores(question_id)
+        match_type = next(name for name, _ in sources if name in scores)
+        result = _database_result(question_id, scores[match_type], match_type, main_subject, knowledge_tags)
+        result['fusion_score'] = round(candidates.fused_score(question_id), 4)
+        result['source_scores'] = {name: round(score, 4) for name, score in scores.items()}
+        results.append(result)
+    
+    return results
+
+
+def _database_result(question_id, similarity, match_type, main_subject, knowledge_tags):
+    """构造一条题库匹配结果（图片按题号查找）"""
+    answer_text = load_answer_file(question_id)
+    
+    # 检查是否有对应图片
+    img_file = _question_images.get(question_id)
+    image_url = f'/api/question_image/{img_file}' if img_file else None
+    
+    return {
+        'question_id': question_id,
+        'similarity': round(similarity, 2),
+        'category': main_subject,
+        'source': 'database',
+        'match_type': match_type,
+        'confidence': round(similarity, 2),
+        'answer': answer_text,
+        'knowledge_tags': knowledge_tags,
+        'difficulty': generate_difficulty(similarity),
+        'image_path': img_file,
+        'image_url': image_url
+    }
 
 
 def load_answer_file(question_id):
-    """加载答案文件"""
+    """加载答案文件（优先使用内存中的答案语料库）"""
+    entry = _answer_corpus.get(question_id)
     answer_file = os.path.join(ANSWERS_DIR, f"{question_id}.txt")
     
-    if not os.path.exists(answer_file):
+    if entry is None and not os.path.exists(answer_file):
         return f"## 题库题目\n\n**题目编号**：{question_id}\n\n暂无答案文件\n\n💡 请创建对应的答案文件：`data/answers/{question_id}.txt`"
     
     try:
-        with open(answer_file, 'r', encoding='utf-8') as f:
-            answer_text = f.read()
+        if entry is not None:
+            answer_text = entry.text
+        else:
+            with open(answer_file, 'r', encoding='utf-8') as f:
+                answer_text = f.read()
         
         # 检查是否是有效文本
         if answer_text.startswith('\ufffd') or '\ufffd' in answer_text[:100]:
@@ -694,117 +935,16 @@ def load_answer_file(question_id):
 
 def calculate_simple_similarity(question_id, ocr_text):
     """简单相似度计算 - 基于关键词匹配（用于后备）"""
-    keywords_map = {
-        'calc': ['微积分', '导数', '积分', '极限'],
-        'calculus': ['微积分', '导数', '积分', '极值'],
-        'phys': ['物理', '力', '能量', '动量'],
-        'physics': ['物理', '力学', '电磁'],
-        'mech': ['力学', '机械', '动力'],
-        'mechanics': ['力学', '静力', '动力'],
-        'circuit': ['电路', '电阻', '电压', '电流'],
-        'complex': ['复变', '复数', '解析']
-    }
-    
+    hits = scan_keywords(ocr_text)
     base_similarity = 0.7
     
-    for key, words in keywords_map.items():
-        if key in question_id.lower():
-            for word in words:
-                if word in ocr_text:
-                    base_similarity += 0.1
-                    break
+    for key in SIMPLE_SIMILARITY_KEYWORDS:
+        if key in question_id.lower() and ('simple_similarity', key) in hits:
+            base_similarity += 0.1
     
     return min(base_similarity, 0.99)
 
 
-def calculate_text_similarity(question_id, ocr_text, answers_dir):
-    """
-    计算文本相似度 - 智能匹配
-    通过答案文件内容和OCR文本的关键词匹配
-    """
-    answer_file = os.path.join(answers_dir, f"{question_id}.txt")
-    
-    if not os.path.exists(answer_file):
-        return 0.0
-    
-    try:
-        # 读取答案文件
-        with open(answer_file, 'r', encoding='utf-8') as f:
-            answer_content = f.read().lower()
-        
-        ocr_lower = ocr_text.lower()
-        
-        # 基础分数
-        similarity = 0.0
-        
-        # 1. 检查题目类型关键词（权重：0.3）
-        type_keywords = {
-            '求': 0.05, '计算': 0.05, '证明': 0.05, '判断': 0.05,
-            '极值': 0.1, '极大值': 0.1, '极小值': 0.1, '最值': 0.1,
-            '导数': 0.08, '积分': 0.08, '微分': 0.08, '级数': 0.08,
-            '泰勒': 0.1, 'taylor': 0.1, 'sin': 0.08, 'cos': 0.08,
-            '复数': 0.08, '复变': 0.08, '解析': 0.08,
-            '矩阵': 0.08, '特征值': 0.08, '行列式': 0.08,
-            '电路': 0.08, '电压': 0.08, '电流': 0.08, '电阻': 0.08
-        }
-        
-        for keyword, weight in type_keywords.items():
-            if keyword in ocr_lower and keyword in answer_content:
-                similarity += weight
-        
-        # 2. 检查数学符号和公式特征（权重：0.2）
-        math_patterns = [
-            ('f(x)', 0.1), ('f(z)', 0.1), ('x²', 0.05), ('x^2', 0.05), 
-            ('x³', 0.05), ('x^3', 0.05), ('∫', 0.05), ('∑', 0.05),
-            ('lim', 0.05), ('sin', 0.05), ('cos', 0.05), ('tan', 0.05),
-            ('z₀', 0.05), ('z_0', 0.05), ('z0', 0.05)
-        ]
-        
-        for pattern, weight in math_patterns:
-            if pattern in ocr_lower and pattern in answer_content:
-                similarity += weight
-        
-        # 3. 检查数字特征（权重：0.15）
-        import re
-        ocr_numbers = set(re.findall(r'\d+', ocr_lower))
-        answer_numbers = set(re.findall(r'\d+', answer_content))
-        
-        if ocr_numbers and answer_numbers:
-            common_numbers = ocr_numbers & answer_numbers
-            if common_numbers:
-                similarity += 0.15 * (len(common_numbers) / max(len(ocr_numbers), len(answer_numbers)))
-        
-        # 4. 学科分类加分（权重：0.1）
-        subject_map = {
-            'calculus': ['微积分', '导数', '积分', '极值', 'f(x)'],
-            'complex': ['复变', '复数', 'z', '解析', 'taylor', '泰勒'],
-            'physics': ['物理', '力', '速度', '加速度', '能量'],
-            'circuit': ['电路', '电压', '电流', '电阻', '功率'],
-            'mechanics': ['力学', '动力', '静力', '平衡', '力矩']
-        }
-        
-        for subject_key, subject_keywords in subject_map.items():
-            if subject_key in question_id.lower():
-                for keyword in subject_keywords:
-                    if keyword in ocr_lower:
-                        similarity += 0.1
-                        break
-                break
-        
-        # 5. 文本长度相似度加分（权重：0.05）
-        if len(ocr_text) > 10:
-            length_ratio = min(len(ocr_text), len(answer_content)) / max(len(ocr_text), len(answer_content))
-            if length_ratio > 0.3:
-                similarity += 0.05 * length_ratio
-        
-        # 限制在0-1之间
-        return min(similarity, 1.0)
-        
-    except Exception as e:
-        print(f"[Warning] Text similarity calculation failed for {question_id}: {e}")
-        return 0.0
-
-
 @app.route('/api/ai_answer', methods=['POST'])
 def get_ai_answer():
     """获取AI解答 - 由用户手动触发"""
@@ -840,19 +980,11 @@ def get_ai_answer():
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """获取真实统计信息"""
-    # 统计题目图片数量
-    question_count = 0
-    if os.path.exists(QUESTION_IMAGES_DIR):
-        for f in os.listdir(QUESTION_IMAGES_DIR):
-            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif')):
-                question_count += 1
+    _ensure_content_index()
     
-    # 统计答案数量
-    answer_count = 0
-    if os.path.exists(ANSWERS_DIR):
-        for f in os.listdir(ANSWERS_DIR):
-            if f.endswith('.txt'):
-                answer_count += 1
+    # 统计题目图片和答案数量
+    question_count = len(_question_images)
+    answer_count = len(_answer_ids)
     
     # 获取数据库统计
     db_stats = {}
@@ -874,6 +1006,15 @@ def get_stats():
     })
 
 
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats_api():
+    """获取各缓存的命中率和内存占用"""
+    return jsonify({
+        'success': True,
+        'caches': get_cache_stats()
+    })
+
+
 # ==================== 新增API接口 ====================
 
 @app.route('/api/questions', methods=['GET'])
@@ -883,32 +1024,32 @@ def get_questions():
     per_page = request.args.get('per_page', 20, type=int)
     category = request.args.get('category', '')
     
+    _ensure_content_index()
+    
     questions = []
-    if os.path.exists(QUESTION_IMAGES_DIR):
-        all_files = [f for f in os.listdir(QUESTION_IMAGES_DIR) 
-                     if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif'))]
-        
-        # 分页
-        start = (page - 1) * per_page
-        end = start + per_page
-        page_files = all_files[start:end]
+    all_files = sorted(_question_images.values())
+    
+    # 分页
+    start = (page - 1) * per_page
+    end = start + per_page
+    page_files = all_files[start:end]
+    
+    for img_file in page_files:
+        question_id = os.path.splitext(img_file)[0]
+        has_answer = question_id in _answer_ids
         
-        for img_file in page_files:
-            question_id = os.path.splitext(img_file)[0]
-            has_answer = os.path.exists(os.path.join(ANSWERS_DIR, f"{question_id}.txt"))
-            
-            questions.append({
-                'question_id': question_id,
-                'image_path': img_file,
-                'image_url': f'/api/question_image/{img_file}',
-                'has_answer': has_answer,
-                'category': guess_category(question_id)
-            })
+        questions.append({
+            'question_id': question_id,
+            'image_path': img_file,
+            'image_url': f'/api/question_image/{img_file}',
+            'has_answer': has_answer,
+            'category': guess_category(question_id)
+        })
     
     return jsonify({
         'success': True,
         'questions': questions,
-        'total': len(os.listdir(QUESTION_IMAGES_DIR)) if os.path.exists(QUESTION_IMAGES_DIR) else 0,
+        'total': len(all_files),
         'page': page,
         'per_page': per_page
     })
@@ -918,12 +1059,8 @@ def get_questions():
 def get_question_detail(question_id):
     """获取题目详情"""
     # 查找图片
-    image_path = None
-    for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif']:
-        test_path = os.path.join(QUESTION_IMAGES_DIR, f"{question_id}{ext}")
-        if os.path.exists(test_path):
-            image_path = f"{question_id}{ext}"
-            break
+    _ensure_content_index()
+    image_path = _question_images.get(question_id)
     
     if not image_path:
         return jsonify({'success': False, 'error': '题目不存在'}), 404
@@ -1026,14 +1163,12 @@ def submit_report():
 @app.route('/api/categories', methods=['GET'])
 def get_categories():
     """获取所有分类"""
+    _ensure_content_index()
     categories = {}
     
-    if os.path.exists(QUESTION_IMAGES_DIR):
-        for f in os.listdir(QUESTION_IMAGES_DIR):
-            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif')):
-                question_id = os.path.splitext(f)[0]
-                cat = guess_category(question_id)
-                categories[cat] = categories.get(cat, 0) + 1
+    for question_id in list(_question_images):
+        cat = guess_category(question_id)
+        categories[cat] = categories.get(cat, 0) + 1
     
     result = [{'name': k, 'count': v} for k, v in categories.items()]
     result.sort(key=lambda x: x['count'], reverse=True)
@@ -1043,42 +1178,21 @@ def get_categories():
 
 def guess_category(question_id):
     """根据题目ID猜测分类"""
-    qid = question_id.lower()
-    if 'calc' in qid:
-        return '高等数学'
-    elif 'phys' in qid:
-        return '大学物理'
-    elif 'circuit' in qid:
-        return '电路分析'
-    elif 'complex' in qid:
-        return '复变函数'
-    elif 'mech' in qid:
-        return '理论力学'
-    elif 'linear' in qid or 'matrix' in qid:
-        return '线性代数'
-    elif 'prob' in qid:
-        return '概率论'
-    else:
-        return '其他'
+    hits = scan_keywords(question_id)
+    for category, _ in CATEGORY_RULES:
+        if ('category_rule', category) in hits:
+            return category
+    return '其他'
 
 if __name__ == '__main__':
     from waitress import serve
     
-    # 预加载图像哈希（加速首次搜索）
-    if IMAGE_MATCHER_AVAILABLE and os.path.exists(QUESTION_IMAGES_DIR):
-        try:
-            preload_image_hashes(QUESTION_IMAGES_DIR)
-        except Exception as e:
-            print(f"[Warning] Failed to preload image hashes: {e}")
+    # 预加载图像指纹并启动目录监视
+    init_content_index()
     
     # 统计题库信息
-    question_count = 0
-    answer_count = 0
-    if os.path.exists(QUESTION_IMAGES_DIR):
-        question_count = len([f for f in os.listdir(QUESTION_IMAGES_DIR) 
-                             if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif'))])
-    if os.path.exists(ANSWERS_DIR):
-        answer_count = len([f for f in os.listdir(ANSWERS_DIR) if f.endswith('.txt')])
+    question_count = len(_question_images)
+    answer_count = len(_answer_ids)
     
     print("=" * 60)
     print("🎓 HUST专属搜题系统 v3.0 - 生产服务器")
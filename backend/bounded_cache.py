@@ -0,0 +1,245 @@
+"""
+有界缓存
+按条目数和估算字节数限制容量，支持 LRU（最近最少使用）和 LFU（最不经常使用）淘汰，
+可选的过期时间（TTL），并记录命中、未命中和淘汰次数，供长期运行的服务观察内存占用和命中率
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 已命名的缓存 {名称: 缓存}，用于统计接口
+_registry: Dict[str, 'BoundedCache'] = {}
+_registry_lock = threading.Lock()
+
+
+def estimate_size(value: Any) -> int:
+    """估算对象占用的字节数（numpy 数组按数据大小，PIL 图像按像素数据大小，容器递归累加）"""
+    if NUMPY_AVAILABLE and isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(np.empty(0))
+    if hasattr(value, 'getbands') and hasattr(value, 'size'):
+        width, height = value.size
+        return width * height * len(value.getbands())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class BoundedCache:
+    """
+    线程安全的有界缓存
+
+    任一限制（max_entries / max_bytes）超出时淘汰条目，直到重新满足限制。
+    单个条目超过 max_bytes 时不缓存。设置 ttl 时，条目写入 ttl 秒后视为不存在。
+    """
+
+    POLICIES = ('lru', 'lfu')
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        policy: str = 'lru',
+        sizeof: Callable[[Any], int] = estimate_size,
+        name: Optional[str] = None,
+        ttl: Optional[float] = None
+    ):
+        """
+        Args:
+            max_entries: 最大条目数，None 表示不限
+            max_bytes: 最大估算字节数，None 表示不限
+            policy: 淘汰策略 'lru' 或 'lfu'
+            sizeof: 估算条目大小的函数
+            name: 缓存名称，给定时注册到全局统计
+            ttl: 条目有效期（秒），None 表示永不过期
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"policy must be one of {self.POLICIES}")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sizeof = sizeof
+        self.name = name
+        self.ttl = ttl
+
+        self._lock = threading.RLock()
+        self._values: Dict[Hashable, Any] = {}
+        self._sizes: Dict[Hashable, int] = {}
+        self._expires: Dict[Hashable, float] = {}
+        self._bytes = 0
+        # LRU: 按访问顺序排列的键；LFU: {访问次数: 按访问顺序排列的键}
+        self._order: 'OrderedDict[Hashable, None]' = OrderedDict()
+        self._freq: Dict[Hashable, int] = {}
+        self._freq_buckets: Dict[int, 'OrderedDict[Hashable, None]'] = {}
+        self._min_freq = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if name:
+            with _registry_lock:
+                _registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._live(key)
+
+    @property
+    def current_bytes(self) -> int:
+        return self._bytes
+
+    def _live(self, key) -> bool:
+        """条目存在且未过期（过期条目顺便删除，调用方持有锁）"""
+        if key not in self._values:
+            return False
+        if self.ttl is not None and time.monotonic() >= self._expires[key]:
+            self._discard(key)
+            self.expirations += 1
+            return False
+        return True
+
+    def _touch(self, key):
+        """记录一次访问"""
+        if self.policy == 'lru':
+            self._order.move_to_end(key)
+            return
+
+        freq = self._freq[key]
+        bucket = self._freq_buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._freq_buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._freq[key] = freq + 1
+        self._freq_buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def _insert_order(self, key):
+        if self.policy == 'lru':
+            self._order[key] = None
+        else:
+            self._freq[key] = 1
+            self._freq_buckets.setdefault(1, OrderedDict())[key] = None
+            self._min_freq = 1
+
+    def _victim(self) -> Hashable:
+        if self.policy == 'lru':
+            return next(iter(self._order))
+        while self._min_freq not in self._freq_buckets:
+            self._min_freq += 1
+        return next(iter(self._freq_buckets[self._min_freq]))
+
+    def _discard(self, key):
+        """删除条目（调用方持有锁）"""
+        self._values.pop(key)
+        self._bytes -= self._sizes.pop(key)
+        self._expires.pop(key, None)
+        if self.policy == 'lru':
+            del self._order[key]
+        else:
+            freq = self._freq.pop(key)
+            bucket = self._freq_buckets[freq]
+            del bucket[key]
+            if not bucket:
+                del self._freq_buckets[freq]
+
+    def _over_limit(self) -> bool:
+        return ((self.max_entries is not None and len(self._values) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes))
+
+    def get(self, key, default=None):
+        with self._lock:
+            if self._live(key):
+                self.hits += 1
+                self._touch(key)
+                return self._values[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """读取条目，不计入命中统计也不影响淘汰顺序"""
+        with self._lock:
+            return self._values[key] if self._live(key) else default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._values:
+                self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._values[key] = value
+            self._sizes[key] = size
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            self._bytes += size
+            self._insert_order(key)
+
+            while self._over_limit():
+                self._discard(self._victim())
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if not self._live(key):
+                return default
+            value = self._values[key]
+            self._discard(key)
+            return value
+
+    def clear(self):
+        """清空条目（保留统计计数）"""
+        with self._lock:
+            self._values.clear()
+            self._sizes.clear()
+            self._expires.clear()
+            self._bytes = 0
+            self._order.clear()
+            self._freq.clear()
+            self._freq_buckets.clear()
+            self._min_freq = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'policy': self.policy,
+                'entries': len(self._values),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def get_cache_stats() -> Dict[str, Dict]:
+    """所有已命名缓存的统计信息"""
+    with _registry_lock:
+        caches = dict(_registry)
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -73,6 +73,41 @@ MATCHING_CONFIG = {
     'top_k': 5,  # 返回前K个最相似结果
 }
 
+# 两阶段检索配置
+# 第一阶段由图像哈希、全文检索、公式索引、MinHash 等廉价索引收集候选；
+# 第二阶段的嵌入向量、ML 分类器和 Ollama 重排只对候选打分
+RETRIEVAL_CONFIG = {
+    'candidate_limit': 50,  # 第一阶段候选总数上限
+    'source_limit': 20,  # 每个候选来源最多提供的候选数
+    'rerank_limit': 50,  # 第二阶段计算嵌入相似度的候选数上限
+    'ml_limit': 10,  # ML 分类器重新评分的结果数上限
+    'ollama_limit': 5,  # Ollama 重排的结果数上限
+    'fallback_full_scan': True,  # 第一阶段没有候选时（如纯图片查询）由向量索引在整个题库中检索
+    'rrf_k': 60,  # 倒数名次融合常数：第 r 名贡献 权重 / (rrf_k + r)
+    'fusion_weights': {},  # 各来源的融合权重（来源名称 -> 权重），未列出的来源为 1.0
+}
+
+# 向量近似最近邻索引配置（matcher / enhanced_matcher 的整库检索）
+ANN_CONFIG = {
+    'backend': 'auto',  # flat（精确）/ ivf（NumPy 倒排）/ hnsw（需安装 hnswlib）/ sq8 / pq（压缩编码）/ auto
+    'backend_overrides': {},  # 按索引名单独指定后端，如 {'image': 'pq'}（2048 维图像向量内存只需编码）
+    'min_size': 5000,  # auto 模式下题目数少于此值时使用精确检索
+    'nlist': None,  # IVF 簇数，None 表示约 sqrt(题目数)
+    'nprobe': 8,  # IVF 每次查询扫描的簇数，越大召回越高、越慢
+    'ef_search': 64,  # HNSW 查询时的候选队列长度，越大召回越高、越慢
+    'pq_subspaces': 64,  # 乘积量化子空间数（每题编码字节数），需整除向量维度
+    'rerank_factor': 10,  # 压缩编码索引取 top_k 的多少倍候选做 float32 精确重排
+    'index_dir': os.path.join(DATA_DIR, 'ann_index'),  # 索引文件目录
+}
+
+# 图像特征降维投影（scripts/fit_projection.py 离线拟合，导入和查询时一致使用）
+PROJECTION_CONFIG = {
+    'enabled': True,  # 投影文件存在时对图像特征降维
+    'dim': 256,  # 降维后的维度（128-256）
+    'whiten': False,  # 是否白化（各主成分方差归一）
+    'path': os.path.join(DATA_DIR, 'projection', 'image_pca.npz'),  # 当前使用的投影矩阵
+}
+
 # 文本向量化模型
 TEXT_EMBEDDING_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
 
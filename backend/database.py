@@ -5,6 +5,7 @@
 import sqlite3
 import json
 import os
+import unicodedata
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
@@ -14,19 +15,81 @@ try:
 except ImportError:
     np = None
 
+try:
+    from minhash_index import compute_signature, signature_from_bytes
+    MINHASH_AVAILABLE = True
+except ImportError:
+    MINHASH_AVAILABLE = False
+
+try:
+    from embedding_store import EmbeddingFile, EmbeddingStore
+    EMBEDDING_FILES_AVAILABLE = True
+except ImportError:
+    EMBEDDING_FILES_AVAILABLE = False
+
 # 数据库路径
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), '../data/database.db')
 
 
+# 嵌入向量的种类（对应 questions 表中旧的 BLOB 列和嵌入文件名）
+EMBEDDING_KINDS = ('text', 'image')
+# 只存在于嵌入文件中的种类：降维前的原始图像特征（匹配器不加载，用于重新拟合投影）
+EMBEDDING_FILE_KINDS = EMBEDDING_KINDS + ('image_raw',)
+
+
+# 全文检索单次查询最多使用的 trigram 数（限制长 OCR 文本的查询开销）
+FTS_MAX_QUERY_TERMS = 64
+
+# 全文检索各列的 bm25 权重 (question_id, ocr_text, latex_formula, answer_text)
+FTS_COLUMN_WEIGHTS = (0.0, 2.0, 2.0, 1.0)
+
+
 def get_db_path():
     return DATABASE_PATH
 
 
+def _read_text_file(path: Optional[str]) -> Optional[str]:
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except Exception as e:
+            print(f"[Warning] Failed to read {path}: {e}")
+    return None
+
+
+def _minhash_blob(text: Optional[str]) -> Optional[bytes]:
+    """题目文本的 MinHash 签名（数据库存储格式）"""
+    if not MINHASH_AVAILABLE:
+        return None
+    signature = compute_signature(text or '')
+    return signature.tobytes() if signature is not None else None
+
+
+def build_fts_query(text: str, max_terms: int = FTS_MAX_QUERY_TERMS) -> str:
+    """
+    把查询文本转换为 FTS5 trigram 查询：按空白切分后取每段的全部 3 字符子串，
+    用 OR 连接，由 bm25 按命中的 trigram 多少排序（OCR 文本很少能整段精确命中）
+    """
+    terms = []
+    seen = set()
+    for segment in unicodedata.normalize('NFKC', text or '').lower().split():
+        for i in range(len(segment) - 2):
+            gram = segment[i:i + 3]
+            if gram not in seen:
+                seen.add(gram)
+                terms.append('"' + gram.replace('"', '""') + '"')
+    return ' OR '.join(terms[:max_terms])
+
+
 class QuestionDatabase:
     """题库数据库管理类"""
     
     def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
+        # 嵌入向量存放在数据库旁的追加写入文件中（以内存映射读取）
+        self.embeddings_dir = os.path.splitext(db_path)[0] + '_embeddings'
+        self._embedding_files = {}
         self.init_database()
     
     def init_database(self):
@@ -49,10 +112,26 @@ class QuestionDatabase:
                 difficulty TEXT,
                 tags TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                answer_text TEXT,
+                minhash BLOB
             )
         ''')
         
+        # 旧库补充答案文本列，并从答案文件回填
+        cursor.execute('PRAGMA table_info(questions)')
+        if 'answer_text' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE questions ADD COLUMN answer_text TEXT')
+            cursor.execute('SELECT id, answer_path FROM questions WHERE answer_path IS NOT NULL')
+            cursor.executemany('UPDATE questions SET answer_text = ? WHERE id = ?', [
+                (_read_text_file(answer_path), row_id) for row_id, answer_path in cursor.fetchall()
+            ])
+        
+        # 旧库补充 MinHash 签名列（签名在 get_minhash_signatures 中按需补算）
+        cursor.execute('PRAGMA table_info(questions)')
+        if 'minhash' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE questions ADD COLUMN minhash BLOB')
+        
         # 创建索引
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_question_id 
@@ -64,31 +143,106 @@ class QuestionDatabase:
             ON questions(category)
         ''')
         
+        self.fts_available = self._init_fts(cursor)
+        
+        if EMBEDDING_FILES_AVAILABLE:
+            self._export_embedding_blobs(cursor)
+        
         conn.commit()
         conn.close()
     
+    def _embedding_file(self, kind: str) -> 'EmbeddingFile':
+        if kind not in self._embedding_files:
+            self._embedding_files[kind] = EmbeddingFile(os.path.join(self.embeddings_dir, kind))
+        return self._embedding_files[kind]
+    
+    def _export_embedding_blobs(self, cursor):
+        """把旧版本写在 BLOB 列中的嵌入迁移到嵌入文件，并清空这些 BLOB"""
+        for kind in EMBEDDING_KINDS:
+            column = f'{kind}_embedding'
+            cursor.execute(f'SELECT question_id, {column} FROM questions WHERE {column} IS NOT NULL ORDER BY id')
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            self._embedding_file(kind).append(
+                (question_id, np.frombuffer(blob, dtype=np.float32)) for question_id, blob in rows
+            )
+            cursor.execute(f'UPDATE questions SET {column} = NULL WHERE {column} IS NOT NULL')
+            print(f"[Info] Moved {len(rows)} {kind} embeddings to {self.embeddings_dir}")
+    
+    def _init_fts(self, cursor) -> bool:
+        """
+        创建全文检索表（FTS5 外部内容表，trigram 分词，中文和公式无需分词）
+        并用触发器与 questions 表保持同步。SQLite 不支持 FTS5 或 trigram 时返回 False
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+                    question_id UNINDEXED, ocr_text, latex_formula, answer_text,
+                    content='questions', content_rowid='id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"[Warning] FTS5 full-text index unavailable: {e}")
+            return False
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+                INSERT INTO questions_fts(rowid, question_id, ocr_text, latex_formula, answer_text)
+                VALUES (new.id, new.question_id, new.ocr_text, new.latex_formula, new.answer_text);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+                INSERT INTO questions_fts(questions_fts, rowid, question_id, ocr_text, latex_formula, answer_text)
+                VALUES ('delete', old.id, old.question_id, old.ocr_text, old.latex_formula, old.answer_text);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS questions_fts_update
+            AFTER UPDATE OF question_id, ocr_text, latex_formula, answer_text ON questions BEGIN
+                INSERT INTO questions_fts(questions_fts, rowid, question_id, ocr_text, latex_formula, answer_text)
+                VALUES ('delete', old.id, old.question_id, old.ocr_text, old.latex_formula, old.answer_text);
+                INSERT INTO questions_fts(rowid, question_id, ocr_text, latex_formula, answer_text)
+                VALUES (new.id, new.question_id, new.ocr_text, new.latex_formula, new.answer_text);
+            END
+        ''')
+        
+        if not exists:
+            # 新建索引时为已有题目建立索引
+            cursor.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+        return True
+    
     def insert_question(self, question_data: Dict) -> int:
         """插入题目数据"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        # 将 numpy 数组转换为 bytes
+        # 嵌入写入嵌入文件；没有 numpy 时才退回 BLOB 列
         text_embedding = None
-        if 'text_embedding' in question_data and question_data['text_embedding'] is not None:
-            text_embedding = question_data['text_embedding'].tobytes()
-        
         image_embedding = None
-        if 'image_embedding' in question_data and question_data['image_embedding'] is not None:
-            image_embedding = question_data['image_embedding'].tobytes()
+        if not EMBEDDING_FILES_AVAILABLE:
+            if question_data.get('text_embedding') is not None:
+                text_embedding = question_data['text_embedding'].tobytes()
+            if question_data.get('image_embedding') is not None:
+                image_embedding = question_data['image_embedding'].tobytes()
         
         tags_json = json.dumps(question_data.get('tags', []))
         
+        answer_text = question_data.get('answer_text')
+        if answer_text is None:
+            answer_text = _read_text_file(question_data.get('answer_path'))
+        
         try:
+            # REPLACE 删除旧行时只有开启递归触发器才会触发删除触发器（全文索引同步需要）
+            cursor.execute('PRAGMA recursive_triggers = ON')
             cursor.execute('''
                 INSERT OR REPLACE INTO questions 
                 (question_id, image_path, answer_path, ocr_text, latex_formula, 
-                 text_embedding, image_embedding, category, difficulty, tags)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 text_embedding, image_embedding, category, difficulty, tags, answer_text, minhash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 question_data['question_id'],
                 question_data['image_path'],
@@ -99,11 +253,20 @@ class QuestionDatabase:
                 image_embedding,
                 question_data.get('category'),
                 question_data.get('difficulty'),
-                tags_json
+                tags_json,
+                answer_text,
+                _minhash_blob(question_data.get('ocr_text'))
             ))
             
             question_id = cursor.lastrowid
             conn.commit()
+            
+            # REPLACE 语义：未提供的嵌入视为删除
+            if EMBEDDING_FILES_AVAILABLE:
+                for kind in EMBEDDING_FILE_KINDS:
+                    self._embedding_file(kind).put(
+                        question_data['question_id'], question_data.get(f'{kind}_embedding')
+                    )
             return question_id
         except Exception as e:
             conn.rollback()
@@ -152,41 +315,76 @@ class QuestionDatabase:
         
         return [self._row_to_dict(row) for row in rows]
     
-    def get_embeddings(self) -> Tuple[List[str], list, list]:
-        """获取所有题目的嵌入向量"""
-        if np is None:
-            return [], [], []
-        
+    def get_embedding_stores(self) -> Tuple[List[str], 'EmbeddingStore', 'EmbeddingStore']:
+        """
+        获取题号列表和文本、图像嵌入存储
+
+        嵌入文件以内存映射打开，多个进程共享页缓存中的同一份数据；
+        嵌入文件中有、数据库中已不存在的题目会被排除
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT question_id, text_embedding, image_embedding 
-            FROM questions
-        ''')
-        
-        rows = cursor.fetchall()
+        cursor.execute('SELECT question_id FROM questions ORDER BY id')
+        question_ids = [row[0] for row in cursor.fetchall()]
         conn.close()
         
-        question_ids = []
-        text_embeddings = []
-        image_embeddings = []
+        known = set(question_ids)
+        stores = []
+        for kind in EMBEDDING_KINDS:
+            store = self._embedding_file(kind).load_store()
+            for question_id in [q for q in store.question_ids if q not in known]:
+                store.remove(question_id)
+            stores.append(store)
+        return question_ids, stores[0], stores[1]
+    
+    def get_embedding_store(self, kind: str) -> 'EmbeddingStore':
+        """某一种类的嵌入存储（如 'image_raw'），数据库中已不存在的题目会被排除"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT question_id FROM questions')
+        known = {row[0] for row in cursor.fetchall()}
+        conn.close()
         
-        for row in rows:
-            question_ids.append(row[0])
-            
-            if row[1] and np is not None:
-                text_emb = np.frombuffer(row[1], dtype=np.float32)
-                text_embeddings.append(text_emb)
-            else:
-                text_embeddings.append(None)
-            
-            if row[2] and np is not None:
-                img_emb = np.frombuffer(row[2], dtype=np.float32)
-                image_embeddings.append(img_emb)
-            else:
-                image_embeddings.append(None)
+        store = self._embedding_file(kind).load_store()
+        for question_id in [q for q in store.question_ids if q not in known]:
+            store.remove(question_id)
+        return store
+    
+    def get_embedding_meta(self, kind: str) -> Dict:
+        """嵌入文件的元数据（维度、投影版本等）"""
+        if not EMBEDDING_FILES_AVAILABLE:
+            return {}
+        return self._embedding_file(kind).meta
+    
+    def check_image_projection(self, version: Optional[str]) -> bool:
+        """
+        题库图像嵌入是否由 version 投影得到（没有图像嵌入时视为一致）
+
+        不一致时查询向量与题库向量不在同一空间，调用方应停用图像嵌入检索
+        """
+        meta = self.get_embedding_meta('image')
+        if not meta.get('dim') or meta.get('projection') == version:
+            return True
+        print(f"[Warning] Image embeddings were stored with projection {meta.get('projection')}, "
+              f"current is {version}; image embedding search disabled, "
+              f"run scripts/fit_projection.py --reproject")
+        return False
+    
+    def set_embedding_meta(self, kind: str, **fields):
+        self._embedding_file(kind).update_meta(**fields)
+    
+    def replace_embeddings(self, kind: str, items, **meta_fields) -> int:
+        """用 [(question_id, 嵌入), ...] 整体替换某一种类的嵌入，返回写入的数量"""
+        return self._embedding_file(kind).rewrite(items, **meta_fields)
+    
+    def get_embeddings(self) -> Tuple[List[str], list, list]:
+        """获取所有题目的嵌入向量（与题号列表一一对应，缺少的为 None）"""
+        if not EMBEDDING_FILES_AVAILABLE:
+            return [], [], []
         
+        question_ids, text_store, image_store = self.get_embedding_stores()
+        text_embeddings = [text_store.vector(q, normalized=False) for q in question_ids]
+        image_embeddings = [image_store.vector(q, normalized=False) for q in question_ids]
         return question_ids, text_embeddings, image_embeddings
     
     def _row_to_dict(self, row: tuple) -> Dict:
@@ -194,7 +392,8 @@ class QuestionDatabase:
         columns = [
             'id', 'question_id', 'image_path', 'answer_path', 'ocr_text',
             'latex_formula', 'text_embedding', 'image_embedding', 
-            'category', 'difficulty', 'tags', 'created_at', 'updated_at'
+            'category', 'difficulty', 'tags', 'created_at', 'updated_at',
+            'answer_text', 'minhash'
         ]
         
         data = dict(zip(columns, row))
@@ -213,6 +412,70 @@ class QuestionDatabase:
         
         return data
     
+    def get_minhash_signatures(self) -> Dict:
+        """
+        所有题目 OCR 文本的 MinHash 签名 {question_id: 签名}
+        缺少签名或签名参数已变化的题目在这里补算并写回
+        """
+        if not MINHASH_AVAILABLE:
+            return {}
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, question_id, ocr_text, minhash FROM questions')
+        
+        signatures = {}
+        updates = []
+        for row_id, question_id, ocr_text, blob in cursor.fetchall():
+            signature = signature_from_bytes(blob)
+            if signature is None:
+                signature = compute_signature(ocr_text or '')
+                updates.append((signature.tobytes() if signature is not None else None, row_id))
+            if signature is not None:
+                signatures[question_id] = signature
+        
+        if updates:
+            cursor.executemany('UPDATE questions SET minhash = ? WHERE id = ?', updates)
+            conn.commit()
+        conn.close()
+        return signatures
+    
+    def search_text(self, text: str, limit: int = 10, category: Optional[str] = None) -> List[Dict]:
+        """
+        全文检索题目（OCR 文本、LaTeX 公式和答案文本）
+        
+        Returns:
+            [{'question_id', 'category', 'snippet', 'score'}, ...]，按相关度降序；
+            score 为 FTS5 bm25 分数（越小越相关）
+        """
+        query = build_fts_query(text)
+        if not query or not self.fts_available:
+            return []
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        weights = ', '.join(str(w) for w in FTS_COLUMN_WEIGHTS)
+        sql = f'''
+            SELECT q.question_id, q.category,
+                   snippet(questions_fts, -1, '[', ']', '…', 16),
+                   bm25(questions_fts, {weights}) AS score
+            FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid
+            WHERE questions_fts MATCH ?
+        '''
+        params = [query]
+        if category:
+            sql += ' AND q.category = ?'
+            params.append(category)
+        sql += ' ORDER BY score LIMIT ?'
+        params.append(limit)
+        
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [{'question_id': r[0], 'category': r[1], 'snippet': r[2], 'score': r[3]} for r in rows]
+    
     def delete_question(self, question_id: str) -> bool:
         """删除题目"""
         conn = sqlite3.connect(self.db_path)
@@ -224,6 +487,10 @@ class QuestionDatabase:
         conn.commit()
         conn.close()
         
+        if deleted and EMBEDDING_FILES_AVAILABLE:
+            for kind in EMBEDDING_FILE_KINDS:
+                self._embedding_file(kind).put(question_id, None)
+        
         return deleted
     
     def count_questions(self) -> int:
@@ -0,0 +1,472 @@
+"""
+嵌入向量存储
+题库嵌入预先 L2 归一化后存放在一块 C 连续的 float32 矩阵中，
+余弦相似度检索只需一次矩阵-向量乘法，Top-K 用 argpartition 选出后再排序，
+阈值过滤也在数组上完成，不再逐次对整个题库矩阵重新归一化
+
+持久化使用追加写入的原始 float32 文件（EmbeddingFile），以 np.memmap 只读映射打开，
+多个进程共享操作系统页缓存中的同一份数据，启动时不需要复制整个矩阵
+"""
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+    """L2 归一化的 float32 向量（零向量返回 None）"""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0 or not np.isfinite(norm):
+        return None
+    return vector / norm
+
+
+def top_k_indices(scores: np.ndarray, top_k: Optional[int], threshold: Optional[float] = None) -> np.ndarray:
+    """
+    分数最高的 top_k 个下标（按分数降序，同分按下标升序），可先按阈值过滤
+
+    只对通过阈值的元素做 argpartition，再对选出的 top_k 个排序
+    """
+    if threshold is None:
+        indices = np.arange(len(scores))
+    else:
+        indices = np.flatnonzero(scores >= threshold)
+    if top_k is not None and len(indices) > top_k:
+        if top_k <= 0:
+            return indices[:0]
+        part = np.argpartition(-scores[indices], top_k - 1)[:top_k]
+        indices = np.sort(indices[part])
+    return indices[np.argsort(-scores[indices], kind='stable')]
+
+
+class EmbeddingStore:
+    """
+    L2 归一化嵌入矩阵（question_id -> 行号）
+
+    矩阵按容量成倍预留，追加时不必每次复制整个矩阵；删除时用最后一行填补空位
+    """
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = dim
+        self._matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+    @classmethod
+    def build(cls, question_ids: Sequence[str], embeddings: Iterable[Optional[np.ndarray]]) -> 'EmbeddingStore':
+        """由题号和嵌入列表建立存储（嵌入为 None 或零向量的题目跳过）"""
+        pairs = [(qid, np.asarray(e, dtype=np.float32).ravel())
+                 for qid, e in zip(question_ids, embeddings) if e is not None]
+        pairs = [(qid, e) for qid, e in pairs if e.size]
+        store = cls(pairs[0][1].size if pairs else None)
+        if not pairs:
+            return store
+
+        matrix = np.ascontiguousarray(np.vstack([e for _, e in pairs]), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        keep = norms > 0
+        matrix = matrix[keep]
+        norms = norms[keep]
+        matrix /= norms[:, None]
+
+        store._matrix = np.ascontiguousarray(matrix)
+        store._norms = norms.astype(np.float32)
+        store._ids = [qid for (qid, _), k in zip(pairs, keep) if k]
+        store._rows = {qid: row for row, qid in enumerate(store._ids)}
+        return store
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, question_id) -> bool:
+        return question_id in self._rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """归一化嵌入矩阵（只读视图，行与 question_ids 对应）"""
+        view = self._matrix[:len(self._ids)]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def question_ids(self) -> List[str]:
+        return list(self._ids)
+
+    def ids_at(self, rows: Iterable[int]) -> List[str]:
+        """行号对应的题号"""
+        return [self._ids[row] for row in rows]
+
+    def vector(self, question_id: str, normalized: bool = True) -> Optional[np.ndarray]:
+        """题目的嵌入（normalized=False 时还原为原始长度）"""
+        row = self._rows.get(question_id)
+        if row is None:
+            return None
+        vector = self._matrix[row].copy()
+        return vector if normalized else vector * self._norms[row]
+
+    def add(self, question_id: str, embedding: Optional[np.ndarray]) -> Optional[int]:
+        """登记或更新题目的嵌入（None 或零向量时删除），返回所在行号"""
+        vector = normalize(embedding) if embedding is not None else None
+        if vector is None:
+            self.remove(question_id)
+            return None
+        if self.dim is None:
+            self.dim = vector.size
+            self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        if vector.size != self.dim:
+            raise ValueError(f"embedding dimension {vector.size} != store dimension {self.dim}")
+
+        norm = float(np.linalg.norm(np.asarray(embedding, dtype=np.float32)))
+        row = self._rows.get(question_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._matrix):
+                capacity = max(16, 2 * len(self._matrix))
+                matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+                matrix[:row] = self._matrix[:row]
+                norms = np.zeros(capacity, dtype=np.float32)
+                norms[:row] = self._norms[:row]
+                self._matrix, self._norms = matrix, norms
+            self._ids.append(question_id)
+            self._rows[question_id] = row
+        self._matrix[row] = vector
+        self._norms[row] = norm
+        return row
+
+    def remove(self, question_id: str) -> Optional[Tuple[int, int]]:
+        """
+        删除题目的嵌入
+
+        Returns:
+            (被删除的行号, 移入该行的原最后一行行号)；两者相等表示没有行移动，题目不存在时返回 None
+        """
+        row = self._rows.pop(question_id, None)
+        if row is None:
+            return None
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._norms[row] = self._norms[last]
+            self._ids[row] = moved
+            self._rows[moved] = row
+        self._ids.pop()
+        return row, last
+
+    def rows_of(self, question_ids: Iterable[str]) -> np.ndarray:
+        """题号对应的行号数组（不在存储中的题目为 -1）"""
+        return np.fromiter((self._rows.get(qid, -1) for qid in question_ids), dtype=np.int64)
+
+    def similarities(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        查询向量与题库的余弦相似度
+
+        Args:
+            query: 查询嵌入（无需预先归一化）
+            rows: 只计算这些行（rows_of 的结果，-1 的位置为 0）；None 表示全部行
+        """
+        query = normalize(query)
+        if rows is None:
+            if query is None:
+                return np.zeros(len(self._ids), dtype=np.float32)
+            return self.matrix @ query
+
+        similarities = np.zeros(len(rows), dtype=np.float32)
+        present = rows >= 0
+        count = int(np.count_nonzero(present))
+        if query is None or count == 0:
+            return similarities
+        if count * 4 >= len(self._ids):
+            # 行数接近整个题库时，整块乘法再取值比先复制这些行更快
+            similarities[present] = (self.matrix @ query)[rows[present]]
+        else:
+            similarities[present] = self._matrix[rows[present]] @ query
+        return similarities
+
+    def search(self, query: np.ndarray, top_k: Optional[int] = None,
+               threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """最相似的题目 [(question_id, 余弦相似度), ...]，按相似度降序"""
+        if not self._ids:
+            return []
+        scores = self.similarities(query)
+        return [(self._ids[i], float(scores[i])) for i in top_k_indices(scores, top_k, threshold)]
+
+
+# 同一路径的嵌入文件共用一把写锁（同一进程中每个 QuestionDatabase 都有自己的 EmbeddingFile 实例）
+_file_locks: Dict[str, threading.Lock] = {}
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(path: str) -> threading.Lock:
+    with _file_locks_guard:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class EmbeddingFile:
+    """
+    追加写入的嵌入文件
+
+    - {path}.f32: 归一化后的 float32 行
+    - {path}.norms.f32: 每行的原始长度（删除标记行为 0）
+    - {path}.ids: 每行对应的题号，一行一个（UTF-8）
+    - {path}.json: 维度等元数据（还可记录如投影版本等附加字段）
+
+    更新题目时追加新行，删除时追加长度为 0 的删除标记行，同一题号以最后一行为准；
+    题号行最后写入，读取时以三个文件中最短的行数为准，写入中断不会读到半行。
+    只支持单个写入进程，读取进程数不限；同一进程内可以有多个实例写入同一文件，
+    写入前先读取其他实例追加的行；compact() 重写文件去掉失效行
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_path = path + '.f32'
+        self.norms_path = path + '.norms.f32'
+        self.ids_path = path + '.ids'
+        self.meta_path = path + '.json'
+        self._lock = _file_lock(path)
+        self._live: Optional[Dict[str, int]] = None  # 写入进程缓存的 {题号: 行号}
+        self._next_row = 0
+        self._ids_state: Optional[Tuple[int, int]] = None  # 已读到的题号文件 (inode, 字节数)
+        self._pending_meta: Dict = {}  # 文件创建前设置的附加元数据
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    @property
+    def meta(self) -> Dict:
+        if not self.exists():
+            return dict(self._pending_meta)
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.meta.get('dim')
+
+    def update_meta(self, **fields):
+        """更新附加元数据（文件尚未创建时在写入第一行时一并写入）"""
+        with self._lock:
+            if not self.exists():
+                self._pending_meta.update(fields)
+                return
+            self._write_meta(dict(self.meta, **fields))
+
+    def _write_meta(self, meta: Dict):
+        with open(self.meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def _read_rows(self) -> Tuple[List[str], int]:
+        """(题号列表, 完整写入的行数)"""
+        dim = self.dim
+        if dim is None:
+            return [], 0
+        with open(self.ids_path, 'r', encoding='utf-8') as f:
+            ids = f.read().split('\n')[:-1]
+        rows = min(len(ids),
+                   os.path.getsize(self.data_path) // (4 * dim),
+                   os.path.getsize(self.norms_path) // 4)
+        return ids[:rows], rows
+
+    def _live_rows(self, ids: List[str], norms: np.ndarray) -> Dict[str, int]:
+        live = {}
+        for row, question_id in enumerate(ids):
+            if norms[row] > 0:
+                live[question_id] = row
+            else:
+                live.pop(question_id, None)
+        return live
+
+    def _map(self, rows: int, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+        """以写时复制模式映射（进程内修改不写回文件，也不影响其他进程）"""
+        if rows == 0:
+            return np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=np.float32)
+        matrix = np.memmap(self.data_path, dtype=np.float32, mode='c', shape=(rows, dim))
+        norms = np.memmap(self.norms_path, dtype=np.float32, mode='c', shape=(rows,))
+        return matrix, norms
+
+    def append(self, items: Iterable[Tuple[str, Optional[np.ndarray]]]):
+        """
+        追加 [(题号, 嵌入), ...]；嵌入为 None 或零向量表示删除（题号不存在时忽略）
+        """
+        with self._lock:
+            self._sync_live()
+
+            dim = self.dim
+            rows_data, rows_norms, rows_ids = [], [], []
+            for question_id, embedding in items:
+                vector = normalize(embedding) if embedding is not None else None
+                if vector is None:
+                    if question_id not in self._live:
+                        continue
+                    norm = 0.0
+                    vector = None
+                else:
+                    norm = float(np.linalg.norm(np.asarray(embedding, dtype=np.float32)))
+                    if dim is None:
+                        dim = vector.size
+                        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                        for path in (self.data_path, self.norms_path, self.ids_path):
+                            open(path, 'wb').close()
+                        self._write_meta(dict(self._pending_meta, dim=dim, dtype='float32'))
+                        self._pending_meta = {}
+                    if vector.size != dim:
+                        raise ValueError(f"embedding dimension {vector.size} != file dimension {dim}")
+                rows_data.append(vector if vector is not None else np.zeros(dim, dtype=np.float32))
+                rows_norms.append(norm)
+                rows_ids.append(question_id)
+            if not rows_ids:
+                return
+
+            next_row = self._next_row
+            with open(self.data_path, 'ab') as f:
+                f.write(np.vstack(rows_data).astype(np.float32).tobytes())
+            with open(self.norms_path, 'ab') as f:
+                f.write(np.array(rows_norms, dtype=np.float32).tobytes())
+            ids_data = ''.join(question_id + '\n' for question_id in rows_ids).encode('utf-8')
+            with open(self.ids_path, 'ab') as f:
+                f.write(ids_data)
+            ids_offset = self._ids_state[1] if self._ids_state else 0
+            self._ids_state = (os.stat(self.ids_path).st_ino, ids_offset + len(ids_data))
+
+            for offset, (question_id, norm) in enumerate(zip(rows_ids, rows_norms)):
+                if norm > 0:
+                    self._live[question_id] = next_row + offset
+                else:
+                    self._live.pop(question_id, None)
+            self._next_row += len(rows_ids)
+
+    def _sync_live(self):
+        """
+        让缓存的 {题号: 行号} 跟上文件内容
+
+        只读取上次之后（其他实例）追加的行；文件被整体替换（compact / rewrite）或首次写入时重新读取全部行
+        """
+        if not self.exists():
+            self._live, self._next_row, self._ids_state = {}, 0, None
+            return
+        st = os.stat(self.ids_path)
+        if (self._live is not None and self._ids_state is not None
+                and self._ids_state[0] == st.st_ino and st.st_size >= self._ids_state[1]):
+            if st.st_size > self._ids_state[1]:
+                self._read_tail()
+            return
+
+        ids, rows = self._read_rows()
+        norms = np.fromfile(self.norms_path, dtype=np.float32, count=rows) if rows else np.zeros(0)
+        self._live = self._live_rows(ids, norms)
+        self._next_row = rows
+        # 去掉上次写入中断留下的不完整行
+        dim = self.dim
+        ids_size = sum(len(question_id.encode('utf-8')) + 1 for question_id in ids)
+        for path, size in ((self.data_path, rows * 4 * dim), (self.norms_path, rows * 4),
+                           (self.ids_path, ids_size)):
+            if os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        self._ids_state = (os.stat(self.ids_path).st_ino, ids_size)
+
+    def _read_tail(self):
+        """读取其他实例在 _next_row 之后追加的完整行"""
+        inode, offset = self._ids_state
+        with open(self.ids_path, 'rb') as f:
+            f.seek(offset)
+            lines = f.read().split(b'\n')[:-1]
+        rows = min(len(lines),
+                   os.path.getsize(self.data_path) // (4 * self.dim) - self._next_row,
+                   os.path.getsize(self.norms_path) // 4 - self._next_row)
+        if rows <= 0:
+            return
+        norms = np.fromfile(self.norms_path, dtype=np.float32, count=rows, offset=4 * self._next_row)
+        for line, norm in zip(lines[:rows], norms.tolist()):
+            question_id = line.decode('utf-8')
+            if norm > 0:
+                self._live[question_id] = self._next_row
+            else:
+                self._live.pop(question_id, None)
+            self._next_row += 1
+        self._ids_state = (inode, offset + sum(len(line) + 1 for line in lines[:rows]))
+
+    def put(self, question_id: str, embedding: Optional[np.ndarray]):
+        self.append([(question_id, embedding)])
+
+    def load_store(self) -> EmbeddingStore:
+        """
+        以内存映射打开为 EmbeddingStore
+
+        文件中没有失效行时矩阵直接使用映射（不复制）；有失效行时只复制有效行，建议运行 compact()
+        """
+        ids, rows = self._read_rows()
+        dim = self.dim
+        store = EmbeddingStore(dim)
+        if rows == 0:
+            return store
+
+        matrix, norms = self._map(rows, dim)
+        live = self._live_rows(ids, norms)
+        store._ids = list(live)
+        store._rows = {question_id: row for row, question_id in enumerate(store._ids)}
+        if len(live) == rows:
+            # 无失效行：有效行就是第 0..rows-1 行，且顺序一致
+            store._matrix, store._norms = matrix, norms
+        else:
+            selected = np.fromiter(live.values(), dtype=np.int64, count=len(live))
+            store._matrix = np.ascontiguousarray(matrix[selected])
+            store._norms = np.ascontiguousarray(norms[selected])
+            print(f"[Info] {self.path}: {rows - len(live)} stale embedding rows, run compact() to reclaim")
+        return store
+
+    def compact(self) -> int:
+        """重写文件，只保留每个题号的最新有效行，返回保留的行数"""
+        with self._lock:
+            ids, rows = self._read_rows()
+            if rows == 0:
+                return 0
+            dim = self.dim
+            matrix, norms = self._map(rows, dim)
+            live = self._live_rows(ids, norms)
+            selected = np.fromiter(live.values(), dtype=np.int64, count=len(live))
+            self._replace_files(list(live), matrix[selected], norms[selected], self.meta)
+            return len(live)
+
+    def rewrite(self, items: Iterable[Tuple[str, np.ndarray]], **meta_fields) -> int:
+        """
+        用 [(题号, 嵌入), ...] 整体替换文件内容（可改变维度），并更新附加元数据，返回写入的行数
+        """
+        store = EmbeddingStore()
+        for question_id, embedding in items:
+            store.add(question_id, embedding)
+        with self._lock:
+            meta = dict(self.meta, **meta_fields)
+            if store.dim is None:
+                meta.pop('dim', None)
+            else:
+                meta.update(dim=store.dim, dtype='float32')
+            self._replace_files(store.question_ids, store.matrix, store._norms[:len(store)], meta)
+            return len(store)
+
+    def _replace_files(self, ids: List[str], matrix: np.ndarray, norms: np.ndarray, meta: Dict):
+        """先写临时文件再替换，已映射旧文件的进程不受影响"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        for path, data in ((self.data_path, matrix), (self.norms_path, norms)):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(np.ascontiguousarray(data, dtype=np.float32).tobytes())
+        with open(self.ids_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(''.join(question_id + '\n' for question_id in ids))
+        for path in (self.data_path, self.norms_path, self.ids_path):
+            os.replace(path + '.tmp', path)
+        if 'dim' in meta:
+            self._write_meta(meta)
+        else:
+            # 没有任何向量：删除元数据，文件视为不存在，附加元数据留到写入第一行时
+            if self.exists():
+                os.remove(self.meta_path)
+            self._pending_meta = meta
+
+        self._live = {question_id: row for row, question_id in enumerate(ids)}
+        self._next_row = len(ids)
+        self._ids_state = (os.stat(self.ids_path).st_ino, os.path.getsize(self.ids_path)) if ids else None
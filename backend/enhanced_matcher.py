@@ -4,9 +4,12 @@
 """
 import numpy as np
 from typing import List, Dict, Optional, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
 
-from config import MATCHING_CONFIG, CLIP_CONFIG, OLLAMA_CONFIG
+from config import MATCHING_CONFIG, CLIP_CONFIG, OLLAMA_CONFIG, RETRIEVAL_CONFIG
+from retrieval import RetrievalPipeline, fuse_results
+from ann_index import load_or_build_index
+from embedding_store import EmbeddingStore
+from projection import get_image_projection
 
 
 class EnhancedMatcher:
@@ -33,6 +36,7 @@ class EnhancedMatcher:
         
         self._init_services()
         self._load_embeddings()
+        self.retrieval = RetrievalPipeline(db)
     
     def _init_services(self):
         """初始化各种服务"""
@@ -71,35 +75,23 @@ class EnhancedMatcher:
     
     def _load_embeddings(self):
         """从数据库加载所有嵌入向量"""
-        question_ids, text_embeddings, image_embeddings = self.db.get_embeddings()
-        
+        # 嵌入文件以内存映射打开（已归一化的连续矩阵），用于批量计算
+        question_ids, self.text_store, self.image_store = self.db.get_embedding_stores()
         self.question_ids = question_ids
-        self.text_embeddings = text_embeddings
-        self.image_embeddings = image_embeddings
-        
-        # 构建矩阵用于批量计算
-        valid_text = [(i, e) for i, e in enumerate(text_embeddings) if e is not None]
-        valid_image = [(i, e) for i, e in enumerate(image_embeddings) if e is not None]
-        
-        if valid_text:
-            self.text_indices = [i for i, _ in valid_text]
-            self.text_matrix = np.vstack([e for _, e in valid_text])
-        else:
-            self.text_indices = []
-            self.text_matrix = None
         
-        if valid_image:
-            self.image_indices = [i for i, _ in valid_image]
-            self.image_matrix = np.vstack([e for _, e in valid_image])
-        else:
-            self.image_indices = []
-            self.image_matrix = None
+        # 题库图像嵌入必须与查询使用同一个投影版本
+        projection = get_image_projection()
+        if not self.db.check_image_projection(projection.version if projection else None):
+            self.image_store = EmbeddingStore()
+        self.text_index = load_or_build_index(self.text_store, 'text')
+        self.image_index = load_or_build_index(self.image_store, 'image')
         
-        print(f"已加载 {len(question_ids)} 道题目，{len(valid_text)} 个文本嵌入，{len(valid_image)} 个图像嵌入")
+        print(f"已加载 {len(question_ids)} 道题目，{len(self.text_store)} 个文本嵌入，{len(self.image_store)} 个图像嵌入")
     
     def reload_embeddings(self):
-        """重新加载嵌入"""
+        """重新加载嵌入和候选索引"""
         self._load_embeddings()
+        self.retrieval.reload()
     
     def match_question(
         self, 
@@ -142,19 +134,35 @@ class EnhancedMatcher:
         if use_clip and self.clip_service and self.clip_service.is_available():
             result['image_type'] = self.clip_service.classify_image_type(image_path)
         
-        # 3. 多策略匹配
+        # 3. 第一阶段：由廉价索引收集候选，后续打分只针对候选
+        image_bytes = None
+        try:
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        except Exception as e:
+            print(f"读取查询图片失败: {e}")
+        candidates = self.retrieval.gather(ocr_text or '', image_bytes=image_bytes)
+        rerank_limit = RETRIEVAL_CONFIG['rerank_limit']
+        candidate_ids = candidates.question_ids(rerank_limit) if len(candidates) else None
+        full_scan = candidate_ids is None and RETRIEVAL_CONFIG['fallback_full_scan']
+        
+        # 4. 第二阶段：多策略匹配
         all_scores = {}  # question_id -> {'text': score, 'image': score, 'clip': score}
         
         # 策略1: 文本嵌入匹配
-        if self.text_model and ocr_text and self.text_matrix is not None:
+        if self.text_model and ocr_text and len(self.text_store) and (candidate_ids or full_scan):
             text_embedding = self.text_model.encode(ocr_text, convert_to_numpy=True)
-            text_sims = cosine_similarity(
-                text_embedding.reshape(1, -1), 
-                self.text_matrix
-            )[0]
+            if full_scan:
+                # 没有候选时由向量索引取整个题库中文本最相似的 rerank_limit 道题
+                text_matches = self.text_index.search(text_embedding, rerank_limit)
+            else:
+                candidate_ids = [qid for qid in candidate_ids if qid in self.text_store]
+                text_sims = self.text_store.similarities(
+                    text_embedding, self.text_store.rows_of(candidate_ids)
+                )
+                text_matches = zip(candidate_ids, text_sims.tolist())
             
-            for i, sim in enumerate(text_sims):
-                qid = self.question_ids[self.text_indices[i]]
+            for qid, sim in text_matches:
                 if qid not in all_scores:
                     all_scores[qid] = {}
                 all_scores[qid]['text'] = float(sim)
@@ -170,40 +178,27 @@ class EnhancedMatcher:
                 # 这里简化处理，实际可以存储CLIP特征
                 result['match_strategies'].append('clip_image')
         
-        # 策略3: 传统图像特征匹配（ResNet）
-        if self.image_matrix is not None:
-            from matcher import QuestionMatcher
-            # 复用原有的图像特征提取
-            try:
-                temp_matcher = QuestionMatcher.__new__(QuestionMatcher)
-                temp_matcher.db = self.db
-                temp_matcher._load_image_model = lambda: None
-                
-                # 直接使用已有的图像嵌入进行比较
-                result['match_strategies'].append('resnet_image')
-            except:
-                pass
-        
-        # 4. 综合评分
+        # 5. 综合评分，再与第一阶段各来源做倒数名次融合
         final_results = self._compute_final_scores(all_scores, result.get('image_type'))
+        final_results = fuse_results(candidates, final_results)
         
-        # 5. Ollama增强排序（可选）
+        # 6. Ollama增强排序（可选，只重排前 ollama_limit 个结果）
         if use_ollama and self.ollama_service and self.ollama_service.is_available():
             if ocr_text and final_results:
                 try:
                     # 获取候选题目的文本
-                    candidates = []
-                    for r in final_results[:5]:
+                    ollama_candidates = []
+                    for r in final_results[:RETRIEVAL_CONFIG['ollama_limit']]:
                         q = self.db.get_question_by_id(r['question_id'])
                         if q:
-                            candidates.append({
+                            ollama_candidates.append({
                                 'question_id': r['question_id'],
                                 'ocr_text': q.get('ocr_text', ''),
                                 'category': q.get('category'),
                             })
                     
                     # LLM重排
-                    reranked = self.ollama_service.enhance_matching(ocr_text, candidates)
+                    reranked = self.ollama_service.enhance_matching(ocr_text, ollama_candidates)
                     
                     # 更新排序
                     if reranked:
@@ -305,8 +300,13 @@ class EnhancedMatcher:
             # 插入数据库
             self.db.insert_question(question_data)
             
-            # 重新加载嵌入
-            self._load_embeddings()
+            # 增量更新向量索引和候选索引
+            question_id = question_data['question_id']
+            self.text_index.add(question_id, question_data.get('text_embedding'))
+            self.image_index.add(question_id, question_data.get('image_embedding'))
+            if question_id not in self.question_ids:
+                self.question_ids.append(question_id)
+            self.retrieval.add_question(question_data)
             
             return True
             
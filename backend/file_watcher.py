@@ -0,0 +1,220 @@
+"""
+目录监视服务
+监视题目图片和答案目录的新增、修改、删除，增量推送给各索引
+优先使用 watchdog（Linux 下基于 inotify），不可用时退化为定时轮询
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+# 事件类型
+ADDED = 'added'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+
+
+def _snapshot(folder: str, extensions: Optional[set]) -> Dict[str, Tuple[int, int]]:
+    """扫描目录，返回 {文件名: (大小, 修改时间ns)}"""
+    entries = {}
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if extensions and os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries[entry.name] = (st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+class DirectoryWatcher:
+    """
+    单个目录的监视器
+
+    回调签名为 callback(event, filename)，event 为 'added'/'modified'/'deleted'。
+    watchdog 事件只用来唤醒检查线程，真正的变化由文件状态对比得出，
+    因此两种模式下的事件语义完全一致，且写入中的文件会等待 settle 秒后再处理。
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        callback: Callable[[str, str], None],
+        extensions: Optional[Iterable[str]] = None,
+        interval: float = 2.0,
+        settle: float = 0.5,
+        full_rescan_interval: float = 60.0
+    ):
+        """
+        Args:
+            folder: 监视的目录
+            callback: 事件回调
+            extensions: 只关注的扩展名（小写，含点），None 表示全部文件
+            interval: 轮询间隔（秒，仅轮询模式）
+            settle: 收到事件后等待文件写完的时间（秒）
+            full_rescan_interval: watchdog 模式下兜底全量扫描的间隔（秒）
+        """
+        self.folder = folder
+        self.callback = callback
+        self.extensions = {e.lower() for e in extensions} if extensions else None
+        self.interval = interval
+        self.settle = settle
+        self.full_rescan_interval = full_rescan_interval
+
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._observer is not None else 'polling'
+
+    def start(self, initial_snapshot: bool = True):
+        """
+        启动监视
+
+        Args:
+            initial_snapshot: 是否以当前目录内容为基线（已有文件不产生事件）
+        """
+        if initial_snapshot:
+            self._snapshot = _snapshot(self.folder, self.extensions)
+
+        if WATCHDOG_AVAILABLE:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_WakeHandler(self), self.folder, recursive=False)
+                self._observer.daemon = True
+                self._observer.start()
+            except Exception as e:
+                print(f"[Warning] watchdog unavailable for {self.folder}, falling back to polling: {e}")
+                self._observer = None
+
+        self._thread = threading.Thread(target=self._run, name=f"watcher:{self.folder}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def notify(self, path: str):
+        """标记某个文件可能发生了变化"""
+        name = os.path.basename(path)
+        if self.extensions and os.path.splitext(name)[1].lower() not in self.extensions:
+            return
+        with self._lock:
+            self._dirty.add(name)
+        self._wake.set()
+
+    def rescan(self):
+        """全量对比目录内容并推送所有变化"""
+        current = _snapshot(self.folder, self.extensions)
+        with self._lock:
+            previous = self._snapshot
+            self._snapshot = current
+            self._dirty.clear()
+
+        for name in previous.keys() - current.keys():
+            self._emit(DELETED, name)
+        for name, signature in current.items():
+            if name not in previous:
+                self._emit(ADDED, name)
+            elif previous[name] != signature:
+                self._emit(MODIFIED, name)
+
+    def _check(self, names):
+        """只检查指定文件的变化"""
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+                signature = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                signature = None
+
+            with self._lock:
+                previous = self._snapshot.get(name)
+                if signature is None:
+                    self._snapshot.pop(name, None)
+                else:
+                    self._snapshot[name] = signature
+
+            if signature is None and previous is not None:
+                self._emit(DELETED, name)
+            elif signature is not None and previous is None:
+                self._emit(ADDED, name)
+            elif signature is not None and signature != previous:
+                self._emit(MODIFIED, name)
+
+    def _emit(self, event: str, name: str):
+        try:
+            self.callback(event, name)
+        except Exception as e:
+            print(f"[Warning] Watcher callback failed for {event} {name}: {e}")
+
+    def _run(self):
+        last_full_scan = time.monotonic()
+        while not self._stopped.is_set():
+            timeout = self.full_rescan_interval if self._observer is not None else self.interval
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+
+            if dirty:
+                # 等待文件写入完成
+                time.sleep(self.settle)
+                with self._lock:
+                    dirty |= self._dirty
+                    self._dirty = set()
+                self._check(dirty)
+            elif self._observer is None or time.monotonic() - last_full_scan >= self.full_rescan_interval:
+                self.rescan()
+                last_full_scan = time.monotonic()
+
+
+if WATCHDOG_AVAILABLE:
+    class _WakeHandler(FileSystemEventHandler):
+        """把 watchdog 事件转为对监视器的唤醒"""
+
+        def __init__(self, watcher: DirectoryWatcher):
+            self.watcher = watcher
+
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            self.watcher.notify(event.src_path)
+            dest = getattr(event, 'dest_path', None)
+            if dest:
+                self.watcher.notify(dest)
+
+
+def watch_directory(folder: str, callback: Callable[[str, str], None], extensions=None, **kwargs) -> DirectoryWatcher:
+    """创建并启动目录监视器"""
+    watcher = DirectoryWatcher(folder, callback, extensions=extensions, **kwargs)
+    return watcher.start()
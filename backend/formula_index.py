@@ -0,0 +1,313 @@
+"""
+LaTeX 公式规范化与精确匹配索引
+同一个公式常常只是书写格式不同（空白、\\left/\\right、多余的花括号、x^2 与 x²、z_0 / z₀ / z0），
+先把公式转换成规范形式，再以规范形式的哈希为键建立 公式 -> 题目 的索引，
+查询公式完全一致时 O(1) 命中，不需要做向量检索或调用大模型
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 规范形式短于该长度的公式（如 "x=0"）太常见，不参与索引和查询
+FORMULA_MIN_LENGTH = 6
+
+# 上标/下标字符
+_SUPERSCRIPTS = dict(zip('⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻⁼⁽⁾ⁿⁱ', '0123456789+-=()ni'))
+_SUBSCRIPTS = dict(zip('₀₁₂₃₄₅₆₇₈₉₊₋₌₍₎ₐₑₒₓ', '0123456789+-=()aeox'))
+
+# Unicode 数学符号 -> LaTeX 命令
+_UNICODE_SYMBOLS = {
+    '∫': r'\int', '∑': r'\sum', '∏': r'\prod', '∞': r'\infty', '√': r'\sqrt',
+    '≤': r'\leq', '≥': r'\geq', '≠': r'\neq', '≈': r'\approx', '±': r'\pm',
+    '×': r'\times', '·': r'\cdot', '÷': r'\div', '→': r'\rightarrow', '∂': r'\partial',
+    '∈': r'\in', '∇': r'\nabla', '°': r'^{\circ}',
+    'α': r'\alpha', 'β': r'\beta', 'γ': r'\gamma', 'δ': r'\delta', 'ε': r'\varepsilon',
+    'θ': r'\theta', 'λ': r'\lambda', 'μ': r'\mu', 'π': r'\pi', 'σ': r'\sigma',
+    'φ': r'\varphi', 'ω': r'\omega', 'Δ': r'\Delta', 'Ω': r'\Omega',
+    '（': '(', '）': ')', '，': ',', '＝': '=', '－': '-', '＋': '+',
+}
+
+# 同义命令 -> 规范命令
+_COMMAND_ALIASES = {
+    r'\dfrac': r'\frac', r'\tfrac': r'\frac', r'\le': r'\leq', r'\ge': r'\geq',
+    r'\ne': r'\neq', r'\to': r'\rightarrow', r'\epsilon': r'\varepsilon',
+    r'\phi': r'\varphi', r'\lt': '<', r'\gt': '>', r'\mathrm': '', r'\rm': '',
+    r'\operatorname': '',
+}
+
+# 只影响排版、不影响内容的命令
+_LAYOUT_COMMANDS = {
+    r'\left', r'\right', r'\displaystyle', r'\textstyle', r'\big', r'\Big',
+    r'\bigl', r'\bigr', r'\Bigl', r'\Bigr', r'\,', r'\;', r'\:', r'\!',
+    r'\quad', r'\qquad', r'\ ', r'\limits', r'\nolimits',
+}
+
+# 固定参数个数的命令（参数没有加花括号时补上）
+_COMMAND_ARITY = {r'\frac': 2, r'\sqrt': 1, r'\binom': 2, r'\overline': 1, r'\vec': 1, r'\hat': 1}
+
+# 带花括号参数的命令（其后的花括号不是单纯的分组）
+_ARGUMENT_COMMANDS = set(_COMMAND_ARITY) | {
+    r'\text', r'\textbf', r'\mathbf', r'\mathbb', r'\mathcal', r'\boldsymbol',
+    r'\bar', r'\dot', r'\ddot', r'\tilde', r'\underline', r'\widehat', r'\begin', r'\end',
+}
+
+_TOKEN_PATTERN = re.compile(r'\\[a-zA-Z]+|\\.|\S')
+
+# OCR 结果里常省略反斜杠的函数名（sin x -> \sin x），长的写在前面
+_FUNCTION_NAMES = re.compile(
+    r'(?<![\\a-zA-Z])(arcsin|arccos|arctan|sinh|cosh|tanh|sin|cos|tan|cot|sec|csc|ln|log|lim|exp|max|min)'
+)
+
+# 文本中的公式定界符：$$...$$、\[...\]、\(...\)、$...$
+_FORMULA_PATTERN = re.compile(
+    r'\$\$(.+?)\$\$|\\\[(.+?)\\\]|\\\((.+?)\\\)|\$(.+?)\$', re.DOTALL
+)
+
+
+def _replace_scripts(text: str) -> str:
+    """把连续的 Unicode 上标/下标字符改写成 ^{...} / _{...}"""
+    out = []
+    i = 0
+    while i < len(text):
+        for table, marker in ((_SUPERSCRIPTS, '^'), (_SUBSCRIPTS, '_')):
+            j = i
+            while j < len(text) and text[j] in table:
+                j += 1
+            if j > i:
+                out.append(marker + '{' + ''.join(table[c] for c in text[i:j]) + '}')
+                i = j
+                break
+        else:
+            symbol = _UNICODE_SYMBOLS.get(text[i])
+            if symbol is None:
+                out.append(text[i])
+            else:
+                # 替换成的命令后加空格，避免与后面的字母连成一个命令
+                out.append(symbol + ' ' if symbol.startswith('\\') else symbol)
+            i += 1
+    return ''.join(out)
+
+
+def _parse(tokens: List[str], pos: int = 0) -> Tuple[list, int]:
+    """把记号序列按花括号解析成嵌套列表（花括号组为 list）"""
+    items = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token == '{':
+            group, pos = _parse(tokens, pos)
+            items.append(group)
+        elif token == '}':
+            return items, pos
+        else:
+            items.append(token)
+    return items, pos
+
+
+def _is_command(item) -> bool:
+    return isinstance(item, str) and item.startswith('\\')
+
+
+def _normalize(items: list) -> list:
+    """规范化一层记号（递归处理花括号组）"""
+    out = []
+    i = 0
+    while i < len(items):
+        item = items[i]
+        i += 1
+        if isinstance(item, list):
+            item = _normalize(item)
+            prev = out[-1] if out and isinstance(out[-1], str) else None
+            braced = prev in ('^', '_') or prev in _ARGUMENT_COMMANDS
+            # {x+1}^2 的花括号决定上标作用范围，{x}^2 则与 x^2 相同
+            followed_by_script = (i < len(items) and items[i] in ('^', '_')
+                                  and not (len(item) == 1 and isinstance(item[0], str)))
+            if braced or followed_by_script:
+                out.append(item)
+            else:
+                # 纯分组用的花括号不影响内容
+                out.extend(item)
+            continue
+
+        if item in ('^', '_'):
+            out.append(item)
+            if i < len(items):
+                arg = items[i]
+                i += 1
+                arg = _normalize(arg) if isinstance(arg, list) else [arg]
+                # x^{{2}} 与 x^{2} 相同
+                while len(arg) == 1 and isinstance(arg[0], list):
+                    arg = arg[0]
+                out.append(arg)
+            continue
+
+        if item in _COMMAND_ARITY:
+            out.append(item)
+            # \sqrt[3]{x} 的可选参数原样保留
+            if i < len(items) and items[i] == '[' and ']' in items[i:]:
+                j = items.index(']', i)
+                out.extend(items[i:j + 1])
+                i = j + 1
+            for _ in range(_COMMAND_ARITY[item]):
+                if i >= len(items):
+                    break
+                arg = items[i]
+                i += 1
+                out.append(_normalize(arg) if isinstance(arg, list) else [arg])
+            continue
+
+        # 单个字母后直接跟数字视为下标（z0 -> z_{0}），字母前不能是字母、数字或命令
+        if (len(item) == 1 and item.isascii() and item.isalpha() and i < len(items)
+                and isinstance(items[i], str) and items[i].isdigit()
+                and not (out and isinstance(out[-1], str)
+                         and (out[-1].isalnum() or _is_command(out[-1])))):
+            j = i
+            while j < len(items) and isinstance(items[j], str) and items[j].isdigit():
+                j += 1
+            out.extend([item, '_', items[i:j]])
+            i = j
+            continue
+
+        out.append(item)
+    return out
+
+
+def _serialize(items: list) -> str:
+    parts = []
+    for item in items:
+        text = '{' + _serialize(item) + '}' if isinstance(item, list) else item
+        # 字母命令后紧跟字母时需要分隔（\sin x）
+        if parts and re.fullmatch(r'\\[a-zA-Z]+', parts[-1]) and text[:1].isalpha():
+            parts.append(' ')
+        parts.append(text)
+    return ''.join(parts)
+
+
+def canonicalize_latex(formula: str) -> str:
+    """
+    把 LaTeX 公式转换成规范形式：
+    去掉定界符和空白、去掉 \\left/\\right 等排版命令、统一同义命令和 Unicode 符号、
+    上下标统一加花括号、去掉多余的分组花括号、单字母后的数字视为下标
+    """
+    text = (formula or '').strip()
+    for left, right in (('$$', '$$'), ('$', '$'), (r'\[', r'\]'), (r'\(', r'\)')):
+        if text.startswith(left) and text.endswith(right) and len(text) >= len(left) + len(right):
+            text = text[len(left):len(text) - len(right)]
+            break
+    text = _FUNCTION_NAMES.sub(r'\\\1 ', _replace_scripts(text))
+
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text):
+        if token in _LAYOUT_COMMANDS:
+            continue
+        token = _COMMAND_ALIASES.get(token, token)
+        if token:
+            tokens.append(token)
+
+    items, _ = _parse(tokens)
+    return _serialize(_normalize(items))
+
+
+def extract_formulas(text: str) -> List[str]:
+    """提取文本中用 $...$、$$...$$、\\(...\\)、\\[...\\] 包围的公式"""
+    return [next(g for g in match.groups() if g is not None)
+            for match in _FORMULA_PATTERN.finditer(text or '')]
+
+
+def formula_key(formula: str) -> Optional[str]:
+    """公式规范形式的哈希，规范形式过短时返回 None"""
+    canonical = canonicalize_latex(formula)
+    if len(canonical) < FORMULA_MIN_LENGTH:
+        return None
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class FormulaIndex:
+    """规范公式 -> 题目 的精确匹配索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._questions_by_key: Dict[str, Set[str]] = {}
+        self._keys_by_question: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys_by_question)
+
+    def add(self, question_id: str, formulas: Iterable[str]):
+        """登记题目的公式（覆盖该题之前登记的公式）"""
+        keys = {key for key in map(formula_key, formulas) if key}
+        with self._lock:
+            self._remove(question_id)
+            if not keys:
+                return
+            self._keys_by_question[question_id] = keys
+            for key in keys:
+                self._questions_by_key.setdefault(key, set()).add(question_id)
+
+    def remove(self, question_id: str):
+        with self._lock:
+            self._remove(question_id)
+
+    def _remove(self, question_id: str):
+        for key in self._keys_by_question.pop(question_id, ()):
+            questions = self._questions_by_key[key]
+            questions.discard(question_id)
+            if not questions:
+                del self._questions_by_key[key]
+
+    def clear(self):
+        with self._lock:
+            self._questions_by_key.clear()
+            self._keys_by_question.clear()
+
+    def lookup(self, formulas: Iterable[str]) -> List[Tuple[str, float]]:
+        """
+        查询公式命中的题目
+
+        Returns:
+            [(question_id, 命中比例), ...]，命中比例 = 该题命中的查询公式数 / 有效查询公式数，
+            按比例降序，相同比例按题号升序
+        """
+        keys = {key for key in map(formula_key, formulas) if key}
+        if not keys:
+            return []
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for key in keys:
+                for question_id in self._questions_by_key.get(key, ()):
+                    counts[question_id] = counts.get(question_id, 0) + 1
+        return sorted(((q, n / len(keys)) for q, n in counts.items()), key=lambda m: (-m[1], m[0]))
+
+    def lookup_text(self, text: str, formulas: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """查询 OCR 文本中的公式（加上 OCR 单独识别出的公式）"""
+        return self.lookup(list(formulas) + extract_formulas(text))
+
+    def load_from_database(self, db_path: str) -> int:
+        """从题库的 latex_formula 和 OCR 文本中的公式建立索引，返回有公式的题目数"""
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT question_id, latex_formula, ocr_text FROM questions')
+        rows = cursor.fetchall()
+        conn.close()
+
+        for question_id, latex_formula, ocr_text in rows:
+            formulas = extract_formulas(ocr_text)
+            if latex_formula:
+                formulas.append(latex_formula)
+            self.add(question_id, formulas)
+        print(f"[Info] Formula index: {len(self)} questions with formulas")
+        return len(self)
+
+
+# 全局实例
+_formula_index = None
+
+
+def get_formula_index() -> FormulaIndex:
+    """获取公式索引实例"""
+    global _formula_index
+    if _formula_index is None:
+        _formula_index = FormulaIndex()
+    return _formula_index
@@ -0,0 +1,276 @@
+"""
+汉明空间索引
+使用多索引哈希(Multi-Index Hashing)加速感知哈希的近邻查询：
+把 64 位哈希切成 m 段子串，每段建一张 {子串值: 键集合} 的倒排表。
+由抽屉原理，汉明距离 <= m*r + m - 1 的哈希至少有一段子串的距离 <= r，
+因此只需在每张表里枚举距离 <= r 的子串即可找全候选，无需遍历全部条目。
+
+查询半径过大时退化为 PackedHashMatrix 的向量化暴力扫描：
+所有哈希存放在一个连续的 uint64 数组中，异或后按字节查表统计位数。
+
+亚线性的范围：默认 4 段 × 16 位、子串半径最多 3 时，半径查询只在汉明距离 <= 15
+（64 位哈希的相似度 >= 0.77）且题库条目数超过探测桶数（半径 3 时 2788 个）时走倒排表。
+更大的半径（如相似度阈值 0.6 对应的距离 25）无论怎样分段，枚举到的桶中的条目都多于题库本身
+（8 段 × 8 位需要子串半径 3，约 2.9n；16 段 × 4 位约 5n），因此直接线性扫描。
+Top-K 查询在距离 15 以内能找满 k 个时同样是亚线性的。
+"""
+from itertools import combinations
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+# int.bit_count 需要 Python 3.10+
+if hasattr(int, 'bit_count'):
+    def popcount(x: int) -> int:
+        return x.bit_count()
+else:
+    def popcount(x: int) -> int:
+        return bin(x).count('1')
+
+
+# 0-255 每个字节的置位数
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount_array(values: np.ndarray) -> np.ndarray:
+    """对 uint64 数组逐元素统计置位数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class PackedHashMatrix:
+    """
+    连续存储的 64 位哈希矩阵
+    hashes[i] 与 keys[i] 一一对应，删除时用末尾元素填补空位
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._keys: List[Hashable] = []
+        self._rows: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self._hashes[:len(self._keys)]
+
+    @property
+    def keys(self) -> List[Hashable]:
+        return self._keys
+
+    def add(self, key, hash_value: int):
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            if row == len(self._hashes):
+                grown = np.zeros(max(1024, row * 2), dtype=np.uint64)
+                grown[:row] = self._hashes[:row]
+                self._hashes = grown
+            self._keys.append(key)
+            self._rows[key] = row
+        self._hashes[row] = hash_value
+
+    def remove(self, key) -> bool:
+        row = self._rows.pop(key, None)
+        if row is None:
+            return False
+        last = len(self._keys) - 1
+        if row != last:
+            last_key = self._keys[last]
+            self._keys[row] = last_key
+            self._hashes[row] = self._hashes[last]
+            self._rows[last_key] = row
+        self._keys.pop()
+        return True
+
+    def clear(self):
+        self._keys.clear()
+        self._rows.clear()
+
+    def distances(self, query: int) -> np.ndarray:
+        """查询哈希与所有条目的汉明距离"""
+        return popcount_array(self.hashes ^ np.uint64(query))
+
+    def radius_search(self, query: int, max_distance: int) -> List[Tuple[Hashable, int]]:
+        """所有距离 <= max_distance 的条目，按距离升序"""
+        distances = self.distances(query)
+        rows = np.flatnonzero(distances <= max_distance)
+        rows = rows[np.argsort(distances[rows], kind='stable')]
+        return [(self._keys[r], int(distances[r])) for r in rows]
+
+    def nearest(self, query: int, k: int, max_distance: Optional[int] = None) -> List[Tuple[Hashable, int]]:
+        """距离最近的 k 个条目（用 argpartition 选出 Top-K 再排序）"""
+        n = len(self._keys)
+        if n == 0 or k <= 0:
+            return []
+        distances = self.distances(query)
+        if k < n:
+            rows = np.argpartition(distances, k - 1)[:k]
+        else:
+            rows = np.arange(n)
+        rows = rows[np.argsort(distances[rows], kind='stable')]
+        if max_distance is not None:
+            rows = rows[distances[rows] <= max_distance]
+        return [(self._keys[r], int(distances[r])) for r in rows]
+
+
+class MultiIndexHash:
+    """多索引哈希表，支持半径查询、Top-K 查询和增删"""
+
+    def __init__(self, bits: int = 64, num_chunks: int = 4, max_chunk_radius: int = 3):
+        """
+        Args:
+            bits: 哈希位数
+            num_chunks: 子串段数（需整除 bits）
+            max_chunk_radius: 子串最大枚举半径，超过后退化为线性扫描
+        """
+        if bits % num_chunks:
+            raise ValueError("bits must be divisible by num_chunks")
+
+        self.bits = bits
+        self.num_chunks = num_chunks
+        self.chunk_bits = bits // num_chunks
+        self.max_chunk_radius = max_chunk_radius
+
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._hashes: Dict[Hashable, int] = {}
+        self._tables: List[Dict[int, set]] = [{} for _ in range(num_chunks)]
+        self._flip_masks: Dict[int, List[int]] = {}
+        self._matrix = PackedHashMatrix()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @property
+    def sublinear_radius(self) -> int:
+        """倒排表能找全的最大查询半径，超过时半径查询退化为线性扫描"""
+        return self.num_chunks * (self.max_chunk_radius + 1) - 1
+
+    def __contains__(self, key) -> bool:
+        return key in self._hashes
+
+    def get(self, key) -> Optional[int]:
+        return self._hashes.get(key)
+
+    def items(self):
+        return self._hashes.items()
+
+    def _chunks(self, hash_value: int):
+        for i in range(self.num_chunks):
+            yield i, (hash_value >> (i * self.chunk_bits)) & self._chunk_mask
+
+    def _masks(self, radius: int) -> List[int]:
+        """子串内恰好翻转 radius 位的所有掩码"""
+        masks = self._flip_masks.get(radius)
+        if masks is None:
+            masks = []
+            for positions in combinations(range(self.chunk_bits), radius):
+                mask = 0
+                for p in positions:
+                    mask |= 1 << p
+                masks.append(mask)
+            self._flip_masks[radius] = masks
+        return masks
+
+    def add(self, key, hash_value: int):
+        """添加或更新一个条目"""
+        if key in self._hashes:
+            self.remove(key)
+        self._hashes[key] = hash_value
+        self._matrix.add(key, hash_value)
+        for i, chunk in self._chunks(hash_value):
+            self._tables[i].setdefault(chunk, set()).add(key)
+
+    def remove(self, key) -> bool:
+        """删除一个条目"""
+        hash_value = self._hashes.pop(key, None)
+        if hash_value is None:
+            return False
+        self._matrix.remove(key)
+        for i, chunk in self._chunks(hash_value):
+            bucket = self._tables[i].get(chunk)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._tables[i][chunk]
+        return True
+
+    def clear(self):
+        self._hashes.clear()
+        self._matrix.clear()
+        for table in self._tables:
+            table.clear()
+
+    def _probe(self, query: int, chunk_radius: int, seen: set) -> List[Tuple[Hashable, int]]:
+        """枚举每段子串距离恰好为 chunk_radius 的桶，返回新发现的 (键, 距离)"""
+        found = []
+        masks = self._masks(chunk_radius)
+        for i, chunk in self._chunks(query):
+            table = self._tables[i]
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if not bucket:
+                    continue
+                for key in bucket:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    found.append((key, popcount(query ^ self._hashes[key])))
+        return found
+
+    def _probe_cost(self, chunk_radius: int) -> int:
+        return self.num_chunks * sum(len(self._masks(r)) for r in range(chunk_radius + 1))
+
+    def radius_search(self, query: int, max_distance: int) -> List[Tuple[Hashable, int]]:
+        """
+        查找所有汉明距离 <= max_distance 的条目
+
+        max_distance 超过 sublinear_radius 时为线性扫描（结果相同）
+
+        Returns:
+            [(键, 距离), ...]，按距离升序
+        """
+        if max_distance > self.sublinear_radius:
+            return self._matrix.radius_search(query, max_distance)
+        chunk_radius = max_distance // self.num_chunks
+        if self._probe_cost(chunk_radius) >= len(self._hashes):
+            return self._matrix.radius_search(query, max_distance)
+
+        seen = set()
+        candidates = []
+        for r in range(chunk_radius + 1):
+            candidates.extend(self._probe(query, r, seen))
+
+        results = [(key, d) for key, d in candidates if d <= max_distance]
+        results.sort(key=lambda x: x[1])
+        return results
+
+    def nearest(self, query: int, k: int, max_distance: Optional[int] = None) -> List[Tuple[Hashable, int]]:
+        """
+        查找距离最近的 k 个条目
+
+        逐级扩大子串半径，当已确认范围内的结果达到 k 个即停止
+
+        Returns:
+            [(键, 距离), ...]，按距离升序
+        """
+        if max_distance is None:
+            max_distance = self.bits
+
+        if self._probe_cost(0) < len(self._hashes):
+            seen = set()
+            found = []
+            for r in range(self.max_chunk_radius + 1):
+                found.extend(self._probe(query, r, seen))
+                # 距离 <= covered 的条目已全部找到
+                covered = self.num_chunks * (r + 1) - 1
+                confirmed = [item for item in found if item[1] <= min(covered, max_distance)]
+                if len(confirmed) >= k or covered >= max_distance:
+                    confirmed.sort(key=lambda x: x[1])
+                    return confirmed[:k]
+
+        # 探测代价过高，退化为向量化暴力扫描
+        return self._matrix.nearest(query, k, max_distance)
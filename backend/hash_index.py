@@ -0,0 +1,219 @@
+"""
+图像指纹持久化索引
+以 (目录, 文件名) 为主键，记录文件大小和修改时间以及完整指纹
+（pHash / dHash / aHash / 颜色直方图 / 分块哈希），
+启动时只对新增或变化的图片重新计算指纹，并清理已删除的图片
+"""
+import os
+import sqlite3
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# 默认索引文件路径（与 database.db 同目录）
+HASH_INDEX_PATH = os.path.join(os.path.dirname(__file__), '../data/image_hash_index.db')
+
+# 指纹格式版本：指纹算法或解码方式变化时递增，旧索引会被清空重建
+FINGERPRINT_VERSION = 3
+
+# 支持的图片格式
+VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+
+
+def scan_image_folder(image_folder: str) -> Dict[str, os.stat_result]:
+    """扫描目录中的图片文件，返回 {文件名: stat}"""
+    entries = {}
+    with os.scandir(image_folder) as it:
+        for entry in it:
+            ext = os.path.splitext(entry.name)[1].lower()
+            if ext not in VALID_EXTENSIONS or not entry.is_file():
+                continue
+            entries[entry.name] = entry.stat()
+    return entries
+
+
+def _fingerprint_row(folder: str, filename: str, st: os.stat_result, fingerprint: Dict) -> tuple:
+    return (
+        folder, filename, st.st_size, st.st_mtime_ns,
+        format(fingerprint['phash'], 'x'),
+        format(fingerprint['dhash'], 'x'),
+        format(fingerprint['ahash'], 'x'),
+        np.asarray(fingerprint['histogram'], dtype=np.float32).tobytes(),
+        np.asarray(fingerprint['tiles'], dtype=np.uint64).tobytes(),
+    )
+
+
+class ImageHashIndex:
+    """图像指纹持久化索引（SQLite）"""
+
+    def __init__(self, db_path: str = HASH_INDEX_PATH):
+        self.db_path = db_path
+        self.init_database()
+
+    def init_database(self):
+        """初始化索引表结构"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # 旧版按算法分别存储的哈希表，已由指纹表取代
+        cursor.execute('DROP TABLE IF EXISTS image_hashes')
+
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] != FINGERPRINT_VERSION:
+            cursor.execute('DROP TABLE IF EXISTS image_fingerprints')
+            cursor.execute(f'PRAGMA user_version = {FINGERPRINT_VERSION}')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_fingerprints (
+                folder TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                phash TEXT NOT NULL,
+                dhash TEXT NOT NULL,
+                ahash TEXT NOT NULL,
+                histogram BLOB NOT NULL,
+                tiles BLOB NOT NULL,
+                PRIMARY KEY (folder, filename)
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def load(self, image_folder: str) -> Dict[str, Dict]:
+        """读取目录下已索引的记录 {文件名: {'size', 'mtime_ns', 'fingerprint'}}"""
+        folder = os.path.abspath(image_folder)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT filename, size, mtime_ns, phash, dhash, ahash, histogram, tiles
+            FROM image_fingerprints WHERE folder = ?
+        ''', (folder,))
+        rows = cursor.fetchall()
+        conn.close()
+
+        return {
+            row[0]: {
+                'size': row[1],
+                'mtime_ns': row[2],
+                'fingerprint': {
+                    'phash': int(row[3], 16),
+                    'dhash': int(row[4], 16),
+                    'ahash': int(row[5], 16),
+                    'histogram': np.frombuffer(row[6], dtype=np.float32),
+                    'tiles': np.frombuffer(row[7], dtype=np.uint64),
+                },
+            }
+            for row in rows
+        }
+
+    def refresh(
+        self,
+        image_folder: str,
+        fingerprint_batch: Callable[[List[str]], Dict[str, Optional[Dict]]]
+    ) -> Dict:
+        """
+        增量刷新目录索引
+
+        Args:
+            image_folder: 图片目录
+            fingerprint_batch: 批量计算指纹的函数，参数为图片路径列表，
+                               返回 {图片路径: 指纹或None}
+
+        Returns:
+            {'fingerprints': {文件名: 指纹}, 'added': n, 'updated': n,
+             'removed': n, 'unchanged': n}
+        """
+        folder = os.path.abspath(image_folder)
+        stored = self.load(image_folder)
+        current = scan_image_folder(image_folder)
+
+        fingerprints = {}
+        upserts = []
+        pending = []
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
+        for filename, st in current.items():
+            record = stored.get(filename)
+            if record and record['size'] == st.st_size and record['mtime_ns'] == st.st_mtime_ns:
+                fingerprints[filename] = record['fingerprint']
+                stats['unchanged'] += 1
+            else:
+                pending.append(filename)
+
+        computed = fingerprint_batch([os.path.join(image_folder, f) for f in pending]) if pending else {}
+
+        for filename in pending:
+            fingerprint = computed.get(os.path.join(image_folder, filename))
+            if fingerprint is None:
+                continue
+
+            fingerprints[filename] = fingerprint
+            upserts.append(_fingerprint_row(folder, filename, current[filename], fingerprint))
+            stats['updated' if filename in stored else 'added'] += 1
+
+        removed = [(folder, filename) for filename in stored if filename not in current]
+        stats['removed'] = len(removed)
+
+        if upserts or removed:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO image_fingerprints
+                    (folder, filename, size, mtime_ns, phash, dhash, ahash, histogram, tiles)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', upserts)
+                conn.executemany('''
+                    DELETE FROM image_fingerprints WHERE folder = ? AND filename = ?
+                ''', removed)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            finally:
+                conn.close()
+
+        stats['fingerprints'] = fingerprints
+        return stats
+
+    def upsert(self, image_folder: str, filename: str, st: os.stat_result, fingerprint: Dict):
+        """写入单张图片的指纹（文件监视器增量更新用）"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT OR REPLACE INTO image_fingerprints
+            (folder, filename, size, mtime_ns, phash, dhash, ahash, histogram, tiles)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _fingerprint_row(os.path.abspath(image_folder), filename, st, fingerprint))
+        conn.commit()
+        conn.close()
+
+    def delete(self, image_folder: str, filename: str):
+        """删除单张图片的指纹"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            DELETE FROM image_fingerprints WHERE folder = ? AND filename = ?
+        ''', (os.path.abspath(image_folder), filename))
+        conn.commit()
+        conn.close()
+
+    def clear(self):
+        """清空索引"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM image_fingerprints')
+        conn.commit()
+        conn.close()
+
+
+# 全局实例
+_hash_index = None
+
+
+def get_hash_index() -> ImageHashIndex:
+    """获取图像指纹索引实例"""
+    global _hash_index
+    if _hash_index is None:
+        _hash_index = ImageHashIndex()
+    return _hash_index
@@ -1,14 +1,139 @@
 """
 图像相似度匹配服务
 使用感知哈希(pHash)和直方图比较算法
+
+哈希规格（64位，hash_size=8）：
+- 先以降分辨率方式解码（见 open_reduced，短边不小于 DECODE_SIZE）
+- 所有算法先将图像转为灰度(L)，再用 LANCZOS 缩放
+- aHash: 缩放到 8x8，像素值 > 均值 记为 1
+- dHash: 缩放到 9x8（宽x高），左像素 > 右像素 记为 1
+- pHash: 缩放到 32x32，做二维 DCT-II，取左上角 8x8 低频系数，
+  系数 > 这 64 个系数的中位数 记为 1（与 imagehash.phash 一致）
+- 打包顺序：按行优先展开，第一个比特为最高位，结果为 Python int
+
+图像指纹：一次解码同时计算 pHash、dHash、aHash 和 4x4x4 RGB 颜色直方图，
+题库按图片路径缓存完整指纹，融合匹配时在多种哈希之间投票
+
+分块指纹：图像缩放到短边 TILE_IMAGE_SIZE 后检测 Harris 角点，
+以角点为中心切正方形小块并计算 pHash。分块锚定在内容上而不是固定网格上，
+局部拍摄时同一位置的分块仍能对齐。题库每个角点只存一个尺寸、原方向的分块；
+查询图按 0/90/180/270 度旋转，并在一组放大尺寸上切块（局部拍摄的内容被放大），
+通过分块倒排索引为题库图片投票，用于只拍了题目一部分或拍歪了的照片
 """
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
+import numpy as np
 import hashlib
 import io
 
-# 图像缓存
-_image_hash_cache = {}
+from bounded_cache import BoundedCache
+from hamming_index import MultiIndexHash, popcount
+
+# 题库图片指纹缓存容量（单条指纹约 1.5KB）
+FINGERPRINT_CACHE_MAX_ENTRIES = 20000
+FINGERPRINT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 上传图片降分辨率解码结果的缓存容量（同一张图会被整图匹配和分块匹配各解码一次）
+DECODED_CACHE_MAX_ENTRIES = 64
+DECODED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# 图像指纹缓存 {图片路径: 指纹}
+_image_hash_cache = BoundedCache(
+    max_entries=FINGERPRINT_CACHE_MAX_ENTRIES,
+    max_bytes=FINGERPRINT_CACHE_MAX_BYTES,
+    name='image_fingerprints'
+)
+
+# 上传图片解码缓存 {内容SHA-1: 降分辨率解码后的图像}
+_decoded_cache = BoundedCache(
+    max_entries=DECODED_CACHE_MAX_ENTRIES,
+    max_bytes=DECODED_CACHE_MAX_BYTES,
+    name='decoded_images'
+)
+
+# 题库索引 {目录绝对路径: {'indexes', 'histograms', 'tile_index', 'tile_counts', 'file_ids', 'file_names', 'files', 'synced', 'watched'}}
+_bank_indexes = {}
+_bank_lock = threading.RLock()
+
+HASH_BITS = 64
+HASH_ALGORITHMS = ('phash', 'dhash', 'ahash')
+
+# 颜色直方图每通道分箱数
+HISTOGRAM_BINS = 4
+HISTOGRAM_SIZE = 64
+
+# 降分辨率解码的目标短边长度（哈希和缩略图只需要小图）
+DECODE_SIZE = 256
+
+# 分块指纹：归一化短边、分块边长、每张图的角点数
+TILE_IMAGE_SIZE = 256
+TILE_SIZE = 40
+TILE_KEYPOINTS = 48
+# 查询分块相对 TILE_SIZE 的放大倍数（覆盖拍到题目 1/2 到全部的情况）
+TILE_QUERY_SCALES = (1.0, 1.19, 1.41, 1.68, 2.0)
+# 分块匹配的最大汉明距离
+TILE_MATCH_DISTANCE = 10
+# 分块键 = 文件序号 * MAX_TILES + 分块序号
+MAX_TILES = 256
+# 某个旋转方向的得分达到此值即视为命中，不再尝试其余方向
+TILE_CONFIDENT_SCORE = 0.5
+
+# 融合匹配默认权重
+FUSION_WEIGHTS = {'phash': 0.4, 'dhash': 0.25, 'ahash': 0.15, 'histogram': 0.2}
+
+# DCT-II 基矩阵缓存 {(N, K): K x N 矩阵}
+_dct_matrix_cache = {}
+
+
+def open_reduced(image, size=DECODE_SIZE):
+    """
+    以降低分辨率的方式解码图像（必须在 load() 之前调用）
+    
+    JPEG 使用 draft 模式在 DCT 域直接按 1/2、1/4、1/8 缩小解码，
+    手机拍摄的大图不会以原始分辨率解码；
+    其他格式解码后按整数倍 reduce，保证短边不小于 size
+    """
+    if image.format == 'JPEG':
+        image.draft(None, (size, size))
+    image.load()
+    
+    factor = min(image.size) // size
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def _to_grayscale(image):
+    """转为灰度图（已经是灰度图时直接返回，避免重复转换）"""
+    return image if image.mode == 'L' else image.convert('L')
+
+
+def _resized_pixels(gray, width, height):
+    """将灰度图缩放后返回 float64 像素矩阵 (height, width)"""
+    resized = gray.resize((width, height), Image.Resampling.LANCZOS)
+    return np.asarray(resized, dtype=np.float64)
+
+
+def _dct_matrix(n, k):
+    """
+    DCT-II 基矩阵的前 k 行（未归一化，与 scipy.fftpack.dct 相同）
+    C[u, x] = 2 * cos(pi * u * (2x + 1) / (2n))
+    """
+    key = (n, k)
+    matrix = _dct_matrix_cache.get(key)
+    if matrix is None:
+        u = np.arange(k, dtype=np.float64)[:, None]
+        x = np.arange(n, dtype=np.float64)[None, :]
+        matrix = 2.0 * np.cos(np.pi * u * (2 * x + 1) / (2 * n))
+        _dct_matrix_cache[key] = matrix
+    return matrix
+
+
+def pack_bits(bits):
+    """将布尔矩阵按行优先打包为整数哈希（第一个比特为最高位）"""
+    packed = np.packbits(np.asarray(bits, dtype=bool).ravel())
+    return int.from_bytes(packed.tobytes(), 'big') >> (packed.size * 8 - bits.size)
 
 
 def dhash(image, hash_size=8):
@@ -16,23 +141,8 @@ def dhash(image, hash_size=8):
     差值哈希算法(dHash)
     比较相邻像素的亮度差异，生成哈希值
     """
-    # 转为灰度图并缩放
-    image = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
-    pixels = list(image.getdata())
-    
-    # 计算差值
-    diff = []
-    for row in range(hash_size):
-        for col in range(hash_size):
-            left = pixels[row * (hash_size + 1) + col]
-            right = pixels[row * (hash_size + 1) + col + 1]
-            diff.append(1 if left > right else 0)
-    
-    # 转为16进制哈希
-    hash_value = 0
-    for bit in diff:
-        hash_value = (hash_value << 1) | bit
-    return hash_value
+    pixels = _resized_pixels(_to_grayscale(image), hash_size + 1, hash_size)
+    return pack_bits(pixels[:, :-1] > pixels[:, 1:])
 
 
 def phash(image, hash_size=8, highfreq_factor=4):
@@ -41,32 +151,13 @@ def phash(image, hash_size=8, highfreq_factor=4):
     使用DCT变换，对图像内容变化更鲁棒
     """
     import_size = hash_size * highfreq_factor
-    image = image.convert('L').resize((import_size, import_size), Image.Resampling.LANCZOS)
-    pixels = list(image.getdata())
-    
-    # 简化版：使用均值代替DCT
-    # 将图像分块，计算每块均值
-    block_size = highfreq_factor
-    blocks = []
-    
-    for by in range(hash_size):
-        for bx in range(hash_size):
-            block_sum = 0
-            for y in range(block_size):
-                for x in range(block_size):
-                    idx = (by * block_size + y) * import_size + (bx * block_size + x)
-                    block_sum += pixels[idx]
-            blocks.append(block_sum / (block_size * block_size))
+    pixels = _resized_pixels(_to_grayscale(image), import_size, import_size)
     
-    # 计算均值
-    avg = sum(blocks) / len(blocks)
+    # 只计算需要的低频部分：C[:k] @ X @ C[:k].T
+    basis = _dct_matrix(import_size, hash_size)
+    dct_lowfreq = basis @ pixels @ basis.T
     
-    # 生成哈希
-    hash_value = 0
-    for block in blocks:
-        hash_value = (hash_value << 1) | (1 if block > avg else 0)
-    
-    return hash_value
+    return pack_bits(dct_lowfreq > np.median(dct_lowfreq))
 
 
 def average_hash(image, hash_size=8):
@@ -74,15 +165,146 @@ def average_hash(image, hash_size=8):
     均值哈希算法(aHash)
     最简单快速的哈希算法
     """
-    image = image.convert('L').resize((hash_size, hash_size), Image.Resampling.LANCZOS)
-    pixels = list(image.getdata())
-    avg = sum(pixels) / len(pixels)
+    pixels = _resized_pixels(_to_grayscale(image), hash_size, hash_size)
+    return pack_bits(pixels > pixels.mean())
+
+
+def compute_hash(image, algorithm='phash'):
+    """按算法名计算哈希值（降分辨率解码，只转换一次灰度）"""
+    gray = _to_grayscale(open_reduced(image))
+    if algorithm == 'phash':
+        return phash(gray)
+    elif algorithm == 'dhash':
+        return dhash(gray)
+    else:
+        return average_hash(gray)
+
+
+def color_histogram(image, bins=HISTOGRAM_BINS):
+    """
+    粗粒度 RGB 颜色直方图（bins^3 个分箱，归一化为和为1的 float32 数组）
+    在 64x64 缩略图上统计
+    """
+    rgb = image if image.mode == 'RGB' else image.convert('RGB')
+    thumb = rgb.resize((HISTOGRAM_SIZE, HISTOGRAM_SIZE), Image.Resampling.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.uint16).reshape(-1, 3) * bins // 256
+    bin_index = (pixels[:, 0] * bins + pixels[:, 1]) * bins + pixels[:, 2]
+    hist = np.bincount(bin_index, minlength=bins ** 3).astype(np.float32)
+    return hist / hist.sum()
+
+
+def histogram_similarity(hist1, hist2):
+    """直方图交集相似度 (0-1之间)"""
+    return float(np.minimum(hist1, hist2).sum())
+
+
+def _box_blur(values, radius):
+    """积分图实现的均值滤波（边缘复制填充）"""
+    width = 2 * radius + 1
+    padded = np.pad(values, radius, mode='edge')
+    integral = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    return (integral[width:, width:] - integral[:-width, width:]
+            - integral[width:, :-width] + integral[:-width, :-width]) / (width * width)
+
+
+def _tile_image(gray):
+    """把灰度图缩放到短边 TILE_IMAGE_SIZE，消除拍摄分辨率的差异"""
+    scale = TILE_IMAGE_SIZE / min(gray.size)
+    size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+    return gray.resize(size, Image.Resampling.LANCZOS)
+
+
+def detect_keypoints(gray, max_points=TILE_KEYPOINTS, k=0.05, suppress_radius=4):
+    """
+    Harris 角点检测
+    
+    Returns:
+        [(x, y), ...]，按角点响应降序
+    """
+    pixels = np.asarray(gray, dtype=np.float32)
+    gy, gx = np.gradient(pixels)
+    xx = _box_blur(gx * gx, 3)
+    yy = _box_blur(gy * gy, 3)
+    xy = _box_blur(gx * gy, 3)
+    response = xx * yy - xy * xy - k * (xx + yy) ** 2
+    
+    # 非极大值抑制（可分离的最大值滤波）
+    window = 2 * suppress_radius + 1
+    padded = np.pad(response, suppress_radius, mode='constant', constant_values=-np.inf)
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0).max(axis=-1)
+    local_max = np.lib.stride_tricks.sliding_window_view(local_max, window, axis=1).max(axis=-1)
+    ys, xs = np.nonzero((response == local_max) & (response > response.max() * 0.01))
+    
+    order = np.argsort(-response[ys, xs], kind='stable')[:max_points]
+    return [(int(xs[i]), int(ys[i])) for i in order]
+
+
+def _phash_batch(pixels, hash_size=8):
+    """对一组已缩放的 (N, 32, 32) 像素矩阵批量计算 pHash，返回 uint64 数组"""
+    basis = _dct_matrix(pixels.shape[-1], hash_size)
+    dct_lowfreq = (basis @ pixels @ basis.T).reshape(len(pixels), -1)
+    bits = dct_lowfreq > np.median(dct_lowfreq, axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def _keypoint_tile_pixels(gray, sides, max_points, import_size=32):
+    """以角点为中心切块并缩放到 pHash 输入尺寸（越界的分块跳过）"""
+    tiles = []
+    anchors = []
+    for i, (x, y) in enumerate(detect_keypoints(gray, max_points)):
+        for side in sides:
+            half = side // 2
+            box = (x - half, y - half, x - half + side, y - half + side)
+            if box[0] < 0 or box[1] < 0 or box[2] > gray.width or box[3] > gray.height:
+                continue
+            tiles.append(_resized_pixels(gray.crop(box), import_size, import_size))
+            anchors.append(i)
+    if not tiles:
+        return np.empty((0, import_size, import_size)), np.empty(0, dtype=np.int64)
+    return np.stack(tiles), np.array(anchors, dtype=np.int64)
+
+
+def keypoint_tiles(gray, sides=(TILE_SIZE,), max_points=TILE_KEYPOINTS, rotations=(0,)):
+    """
+    以角点为中心切块并计算 pHash
     
-    hash_value = 0
-    for pixel in pixels:
-        hash_value = (hash_value << 1) | (1 if pixel > avg else 0)
+    Args:
+        gray: 已归一化尺寸的灰度图（见 _tile_image）
+        sides: 分块边长列表
+        rotations: 分块逆时针旋转 90 度的次数列表（角点检测与旋转无关，只做一次）
     
-    return hash_value
+    Returns:
+        [(分块哈希 uint64 数组, 每个分块所属角点序号的数组), ...]，与 rotations 一一对应
+    """
+    pixels, anchors = _keypoint_tile_pixels(gray, sides, max_points)
+    if len(pixels) == 0:
+        return [(np.empty(0, dtype=np.uint64), anchors) for _ in rotations]
+    return [(_phash_batch(np.rot90(pixels, k, axes=(1, 2))), anchors) for k in rotations]
+
+
+def compute_tile_hashes(gray):
+    """计算题库图片的分块指纹，返回 uint64 数组"""
+    [(hashes, _)] = keypoint_tiles(_tile_image(gray))
+    return hashes
+
+
+def compute_fingerprint(image):
+    """
+    计算图像指纹（单次解码）
+    
+    Returns:
+        {'phash': int, 'dhash': int, 'ahash': int, 'histogram': np.ndarray,
+         'tiles': np.ndarray(uint64)}
+    """
+    image = open_reduced(image)
+    gray = _to_grayscale(image)
+    return {
+        'phash': phash(gray),
+        'dhash': dhash(gray),
+        'ahash': average_hash(gray),
+        'histogram': color_histogram(image),
+        'tiles': compute_tile_hashes(gray),
+    }
 
 
 def hamming_distance(hash1, hash2):
@@ -90,12 +312,7 @@ def hamming_distance(hash1, hash2):
     计算汉明距离
     两个哈希值不同位的数量
     """
-    x = hash1 ^ hash2
-    count = 0
-    while x:
-        count += 1
-        x &= x - 1
-    return count
+    return popcount(hash1 ^ hash2)
 
 
 def calculate_similarity(hash1, hash2, hash_size=8):
@@ -107,6 +324,50 @@ def calculate_similarity(hash1, hash2, hash_size=8):
     return 1 - (distance / max_distance)
 
 
+def _fingerprint_file(image_path):
+    """直接读取图片并计算指纹（不经过缓存）"""
+    try:
+        with Image.open(image_path) as img:
+            return compute_fingerprint(img)
+    except Exception as e:
+        print(f"[Error] Failed to hash image {image_path}: {e}")
+        return None
+
+
+def get_fingerprint(image_path):
+    """获取图像指纹（带缓存）"""
+    fingerprint = _image_hash_cache.get(image_path)
+    if fingerprint is None:
+        fingerprint = _fingerprint_file(image_path)
+        if fingerprint is not None:
+            _image_hash_cache.put(image_path, fingerprint)
+    return fingerprint
+
+
+def decode_image_bytes(image_bytes):
+    """
+    降分辨率解码上传的图片（带缓存，返回的图像不可修改）
+    
+    Raises:
+        解码失败时抛出 PIL 的异常
+    """
+    key = hashlib.sha1(image_bytes).hexdigest()
+    image = _decoded_cache.get(key)
+    if image is None:
+        image = open_reduced(Image.open(io.BytesIO(image_bytes)))
+        _decoded_cache.put(key, image)
+    return image
+
+
+def get_fingerprint_from_bytes(image_bytes):
+    """从字节数据计算图像指纹"""
+    try:
+        return compute_fingerprint(decode_image_bytes(image_bytes))
+    except Exception as e:
+        print(f"[Error] Failed to hash image from bytes: {e}")
+        return None
+
+
 def get_image_hash(image_path, algorithm='phash'):
     """
     获取图像哈希值（带缓存）
@@ -118,25 +379,10 @@ def get_image_hash(image_path, algorithm='phash'):
     Returns:
         哈希值
     """
-    cache_key = f"{image_path}_{algorithm}"
-    
-    if cache_key in _image_hash_cache:
-        return _image_hash_cache[cache_key]
-    
-    try:
-        with Image.open(image_path) as img:
-            if algorithm == 'phash':
-                hash_value = phash(img)
-            elif algorithm == 'dhash':
-                hash_value = dhash(img)
-            else:
-                hash_value = average_hash(img)
-        
-        _image_hash_cache[cache_key] = hash_value
-        return hash_value
-    except Exception as e:
-        print(f"[Error] Failed to hash image {image_path}: {e}")
+    fingerprint = get_fingerprint(image_path)
+    if fingerprint is None:
         return None
+    return fingerprint[algorithm if algorithm in HASH_ALGORITHMS else 'ahash']
 
 
 def get_image_hash_from_bytes(image_bytes, algorithm='phash'):
@@ -144,13 +390,7 @@ def get_image_hash_from_bytes(image_bytes, algorithm='phash'):
     从字节数据获取图像哈希值
     """
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        if algorithm == 'phash':
-            return phash(img)
-        elif algorithm == 'dhash':
-            return dhash(img)
-        else:
-            return average_hash(img)
+        return compute_hash(decode_image_bytes(image_bytes), algorithm)
     except Exception as e:
         print(f"[Error] Failed to hash image from bytes: {e}")
         return None
@@ -172,7 +412,216 @@ def compare_images(image1_path, image2_path, algorithm='phash'):
     return calculate_similarity(hash1, hash2)
 
 
-def find_similar_images(query_image_path, image_folder, algorithm='phash', threshold=0.6):
+def _file_id(bank, filename):
+    """为文件分配稳定的整数序号（用作分块键）"""
+    file_id = bank['file_ids'].get(filename)
+    if file_id is None:
+        file_id = len(bank['file_names'])
+        bank['file_ids'][filename] = file_id
+        bank['file_names'].append(filename)
+    return file_id
+
+
+def _bank_add(bank, filename, fingerprint, signature):
+    if filename in bank['files']:
+        _bank_remove(bank, filename)
+    for algorithm in HASH_ALGORITHMS:
+        bank['indexes'][algorithm].add(filename, fingerprint[algorithm])
+    bank['histograms'][filename] = fingerprint['histogram']
+    
+    base = _file_id(bank, filename) * MAX_TILES
+    tiles = fingerprint.get('tiles')
+    if tiles is not None:
+        for i, tile_hash in enumerate(tiles):
+            bank['tile_index'].add(base + i, int(tile_hash))
+        bank['tile_counts'][filename] = len(tiles)
+    bank['files'][filename] = signature
+
+
+def _bank_remove(bank, filename):
+    for algorithm in HASH_ALGORITHMS:
+        bank['indexes'][algorithm].remove(filename)
+    bank['histograms'].pop(filename, None)
+    
+    tile_count = bank['tile_counts'].pop(filename, 0)
+    if tile_count:
+        base = bank['file_ids'][filename] * MAX_TILES
+        for i in range(tile_count):
+            bank['tile_index'].remove(base + i)
+    bank['files'].pop(filename, None)
+
+
+def _sync_bank(bank, image_folder):
+    """将题库索引与目录内容同步（新增、修改、删除）"""
+    from hash_index import scan_image_folder
+    
+    current = scan_image_folder(image_folder)
+    files = bank['files']
+    
+    for filename in list(files):
+        if filename not in current:
+            _bank_remove(bank, filename)
+            _image_hash_cache.pop(os.path.join(image_folder, filename), None)
+    
+    for filename, st in current.items():
+        signature = (st.st_size, st.st_mtime_ns)
+        if files.get(filename) == signature:
+            continue
+        image_path = os.path.join(image_folder, filename)
+        if filename in files:
+            # 文件被修改，丢弃旧指纹
+            _image_hash_cache.pop(image_path, None)
+        fingerprint = get_fingerprint(image_path)
+        if fingerprint is None:
+            _bank_remove(bank, filename)
+            continue
+        _bank_add(bank, filename, fingerprint, signature)
+
+
+def _new_bank():
+    return {
+        'indexes': {alg: MultiIndexHash(bits=HASH_BITS) for alg in HASH_ALGORITHMS},
+        'histograms': {},
+        'tile_index': MultiIndexHash(bits=HASH_BITS),
+        'tile_counts': {},
+        'file_ids': {},
+        'file_names': [],
+        'files': {},
+        'synced': False,
+        'watched': False,
+    }
+
+
+def _seed_bank(image_folder, fingerprints):
+    """
+    用已计算好的指纹建立题库索引，再同步剩余的变化
+    直接使用传入的指纹，题库大于指纹缓存容量时也不会重新解码图片
+    """
+    from hash_index import scan_image_folder
+    
+    key = os.path.abspath(image_folder)
+    with _bank_lock:
+        bank = _bank_indexes.setdefault(key, _new_bank())
+        for filename, st in scan_image_folder(image_folder).items():
+            fingerprint = fingerprints.get(filename)
+            signature = (st.st_size, st.st_mtime_ns)
+            if fingerprint is not None and bank['files'].get(filename) != signature:
+                _bank_add(bank, filename, fingerprint, signature)
+        get_bank(image_folder)
+
+
+def get_bank(image_folder):
+    """
+    获取目录对应的题库索引
+    首次调用时建立索引；之后由文件监视器推送变化，
+    未启用监视器时每次按各文件的大小和修改时间增量同步
+    （原地覆盖已有图片不会改变目录修改时间，只比较目录修改时间会漏掉）
+    """
+    key = os.path.abspath(image_folder)
+    
+    with _bank_lock:
+        bank = _bank_indexes.get(key)
+        if bank is None:
+            bank = _new_bank()
+            _bank_indexes[key] = bank
+        if bank['watched'] and bank['synced']:
+            return bank
+        _sync_bank(bank, image_folder)
+        bank['synced'] = True
+        return bank
+
+
+def get_bank_index(image_folder, algorithm='phash'):
+    """获取目录对应某种哈希算法的汉明索引"""
+    return get_bank(image_folder)['indexes'][algorithm]
+
+
+def add_image_to_index(image_folder, filename):
+    """新增或更新单张图片的索引条目"""
+    image_path = os.path.join(image_folder, filename)
+    with _bank_lock:
+        _image_hash_cache.pop(image_path, None)
+        bank = _bank_indexes.get(os.path.abspath(image_folder))
+        if bank is None:
+            return
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return
+        fingerprint = get_fingerprint(image_path)
+        if fingerprint is not None:
+            _bank_add(bank, filename, fingerprint, (st.st_size, st.st_mtime_ns))
+
+
+def remove_image_from_index(image_folder, filename):
+    """删除单张图片的索引条目"""
+    with _bank_lock:
+        _image_hash_cache.pop(os.path.join(image_folder, filename), None)
+        bank = _bank_indexes.get(os.path.abspath(image_folder))
+        if bank is not None:
+            _bank_remove(bank, filename)
+
+
+def watch_image_folder(image_folder, persist=True, on_change=None, **watcher_options):
+    """
+    监视图片目录，把新增、修改、删除增量同步到题库索引（及持久化指纹索引）
+    启用后搜索时不再检查目录修改时间
+    
+    Args:
+        image_folder: 图片目录
+        persist: 是否同步写入持久化指纹索引
+        on_change: 索引更新后额外调用的回调 on_change(event, filename)
+    
+    Returns:
+        DirectoryWatcher 实例
+    """
+    from file_watcher import watch_directory, DELETED
+    from hash_index import VALID_EXTENSIONS, get_hash_index
+    
+    def on_event(event, filename):
+        image_path = os.path.join(image_folder, filename)
+        if event == DELETED:
+            remove_image_from_index(image_folder, filename)
+            if persist:
+                get_hash_index().delete(image_folder, filename)
+        else:
+            add_image_to_index(image_folder, filename)
+            fingerprint = _image_hash_cache.peek(image_path)
+            if persist and fingerprint is not None:
+                get_hash_index().upsert(image_folder, filename, os.stat(image_path), fingerprint)
+        
+        if on_change:
+            on_change(event, filename)
+    
+    # 先启动监视器取得基线，再同步目录内容：两者之间新增的文件由同步补上，
+    # 之后的变化由监视器推送（回调需要 _bank_lock，会等同步完成后再执行）
+    with _bank_lock:
+        watcher = watch_directory(image_folder, on_event, extensions=VALID_EXTENSIONS, **watcher_options)
+        bank = get_bank(image_folder)
+        bank['watched'] = True
+    print(f"[Info] Watching {image_folder} ({watcher.mode})")
+    return watcher
+
+
+def _max_distance(threshold):
+    return int((1 - threshold) * HASH_BITS + 1e-9)
+
+
+def _search_bank(query_hash, image_folder, algorithm, threshold, top_k):
+    """在题库索引中查找相似度 >= threshold 的图片"""
+    max_distance = _max_distance(threshold)
+    
+    with _bank_lock:
+        index = get_bank_index(image_folder, algorithm)
+        if top_k:
+            matches = index.nearest(query_hash, top_k, max_distance)
+        else:
+            matches = index.radius_search(query_hash, max_distance)
+    
+    return [(filename, 1 - distance / HASH_BITS) for filename, distance in matches]
+
+
+def find_similar_images(query_image_path, image_folder, algorithm='phash', threshold=0.6, top_k=None):
     """
     在文件夹中查找相似图片
     
@@ -180,89 +629,267 @@ def find_similar_images(query_image_path, image_folder, algorithm='phash', thres
         query_image_path: 查询图片路径
         image_folder: 图片文件夹路径
         algorithm: 哈希算法
-        threshold: 相似度阈值
+        threshold: 相似度阈值（>= 0.77 或指定 top_k 时使用多索引哈希，
+                   更低的阈值在整个题库上做向量化线性扫描）
+        top_k: 最多返回的结果数（None 表示全部）
     
     Returns:
-        相似图片列表 [(文件名, 相似度), ...]
+        相似图片列表 [(文件名, 相似度), ...]，按相似度降序
     """
     query_hash = get_image_hash(query_image_path, algorithm)
     if query_hash is None:
         return []
     
-    results = []
+    return _search_bank(query_hash, image_folder, algorithm, threshold, top_k)
+
+
+def find_similar_from_bytes(query_bytes, image_folder, algorithm='phash', threshold=0.6, top_k=None):
+    """
+    从字节数据查找相似图片
+    """
+    query_hash = get_image_hash_from_bytes(query_bytes, algorithm)
+    if query_hash is None:
+        return []
     
-    # 支持的图片格式
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+    return _search_bank(query_hash, image_folder, algorithm, threshold, top_k)
+
+
+def find_similar_fused(query_bytes, image_folder, threshold=0.6, top_k=5, weights=None,
+                       min_votes=2, candidate_factor=4):
+    """
+    多指纹融合匹配
     
-    for filename in os.listdir(image_folder):
-        ext = os.path.splitext(filename)[1].lower()
-        if ext not in valid_extensions:
-            continue
+    先从三种哈希索引各取 top_k * candidate_factor 个近邻作为候选，
+    再对每个候选计算各项相似度：相似度 >= threshold 的指标记一票，
+    票数不足 min_votes 的候选被丢弃，其余按加权平均得分排序。
+    调整 weights / min_votes 不需要重新计算题库指纹。
+    
+    Args:
+        query_bytes: 查询图片字节数据
+        image_folder: 图片文件夹路径
+        threshold: 相似度阈值
+        top_k: 最多返回的结果数
+        weights: 各指标权重，默认 FUSION_WEIGHTS
+        min_votes: 最少投票数
+        candidate_factor: 每种哈希的候选倍数
+    
+    Returns:
+        [(文件名, 融合相似度), ...]，按相似度降序
+    """
+    query = get_fingerprint_from_bytes(query_bytes)
+    if query is None:
+        return []
+    
+    weights = weights or FUSION_WEIGHTS
+    total_weight = sum(weights.values())
+    max_distance = _max_distance(threshold)
+    
+    results = []
+    with _bank_lock:
+        bank = get_bank(image_folder)
+        indexes = bank['indexes']
         
-        image_path = os.path.join(image_folder, filename)
-        image_hash = get_image_hash(image_path, algorithm)
+        candidates = set()
+        for algorithm in HASH_ALGORITHMS:
+            for filename, _ in indexes[algorithm].nearest(query[algorithm], top_k * candidate_factor, max_distance):
+                candidates.add(filename)
         
-        if image_hash is not None:
-            similarity = calculate_similarity(query_hash, image_hash)
-            if similarity >= threshold:
-                results.append((filename, similarity))
+        for filename in candidates:
+            scores = {
+                algorithm: calculate_similarity(query[algorithm], indexes[algorithm].get(filename))
+                for algorithm in HASH_ALGORITHMS
+            }
+            scores['histogram'] = histogram_similarity(query['histogram'], bank['histograms'][filename])
+            
+            votes = sum(1 for value in scores.values() if value >= threshold)
+            if votes < min_votes:
+                continue
+            
+            fused = sum(weights.get(name, 0) * value for name, value in scores.items()) / total_weight
+            if fused >= threshold:
+                results.append((filename, fused))
     
-    # 按相似度降序排序
     results.sort(key=lambda x: x[1], reverse=True)
-    return results
+    return results[:top_k]
 
 
-def find_similar_from_bytes(query_bytes, image_folder, algorithm='phash', threshold=0.6):
+def find_similar_tiled(query_bytes, image_folder, top_k=5, min_score=0.1,
+                       max_distance=TILE_MATCH_DISTANCE):
     """
-    从字节数据查找相似图片
+    分块指纹匹配（适合局部拍摄、旋转拍摄的照片）
+    
+    查询图按 4 个方向旋转，在 TILE_QUERY_SCALES 各尺寸上以角点为中心切块，
+    每个查询分块在分块倒排索引中查找距离 <= max_distance 的题库分块。
+    每个查询角点对每张题库图片只计最佳一票（权重 1 - 距离/64），
+    得分 = 票数 / 查询角点数，取各旋转方向中的最高分；
+    某个方向的得分达到 TILE_CONFIDENT_SCORE 后不再尝试其余方向。
+    
+    题库锁只在每次倒排索引查询时持有，查询期间监视器更新和其他检索不会被整体阻塞；
+    各旋转方向、尺寸中重复的分块哈希只查询一次
+    
+    Returns:
+        [(文件名, 得分), ...]，按得分降序
     """
-    query_hash = get_image_hash_from_bytes(query_bytes, algorithm)
-    if query_hash is None:
+    try:
+        gray = _tile_image(_to_grayscale(decode_image_bytes(query_bytes)))
+    except Exception as e:
+        print(f"[Error] Failed to hash image from bytes: {e}")
         return []
     
-    results = []
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+    sides = [round(TILE_SIZE * scale) for scale in TILE_QUERY_SCALES]
+    with _bank_lock:
+        bank = get_bank(image_folder)
+    tile_index = bank['tile_index']
+    # 文件序号只增不减，file_names 只会追加，无需加锁读取
+    file_names = bank['file_names']
+    
+    # {分块哈希: [(文件名, 权重), ...]}
+    hits = {}
     
-    for filename in os.listdir(image_folder):
-        ext = os.path.splitext(filename)[1].lower()
-        if ext not in valid_extensions:
+    def tile_hits(tile_hash):
+        found = hits.get(tile_hash)
+        if found is None:
+            with _bank_lock:
+                matches = tile_index.radius_search(tile_hash, max_distance)
+            found = [(file_names[key // MAX_TILES], 1 - distance / HASH_BITS) for key, distance in matches]
+            hits[tile_hash] = found
+        return found
+    
+    best_scores = {}
+    for query_tiles, anchors in keypoint_tiles(gray, sides, rotations=range(4)):
+        if len(query_tiles) == 0:
             continue
         
-        image_path = os.path.join(image_folder, filename)
-        image_hash = get_image_hash(image_path, algorithm)
+        # {(角点序号, 文件名): 最佳权重}
+        best = {}
+        for tile_hash, anchor in zip(query_tiles.tolist(), anchors.tolist()):
+            for filename, weight in tile_hits(tile_hash):
+                vote_key = (anchor, filename)
+                if weight > best.get(vote_key, 0):
+                    best[vote_key] = weight
+        
+        votes = {}
+        for (_, filename), weight in best.items():
+            votes[filename] = votes.get(filename, 0) + weight
         
-        if image_hash is not None:
-            similarity = calculate_similarity(query_hash, image_hash)
-            if similarity >= threshold:
-                results.append((filename, similarity))
+        num_anchors = len(np.unique(anchors))
+        for filename, vote in votes.items():
+            score = vote / num_anchors
+            if score > best_scores.get(filename, 0):
+                best_scores[filename] = score
+        
+        if best_scores and max(best_scores.values()) >= TILE_CONFIDENT_SCORE:
+            break
     
+    results = [(filename, score) for filename, score in best_scores.items() if score >= min_score]
     results.sort(key=lambda x: x[1], reverse=True)
-    return results
+    return results[:top_k]
 
 
 def clear_cache():
     """清除哈希缓存"""
-    global _image_hash_cache
-    _image_hash_cache = {}
+    with _bank_lock:
+        _image_hash_cache.clear()
+        _decoded_cache.clear()
+        _bank_indexes.clear()
+
+
+def _fingerprint_file_batch(image_paths):
+    """批量计算指纹（进程池工作函数，必须位于模块顶层以便序列化）"""
+    return [(path, _fingerprint_file(path)) for path in image_paths]
+
+
+def _print_progress(done, total):
+    print(f"[Info] Hashed {done}/{total} images")
+
+
+def fingerprint_images(image_paths, workers=None, chunk_size=64, progress=_print_progress):
+    """
+    批量计算图片指纹，图片较多时分块分发到进程池并行解码
+    
+    Args:
+        image_paths: 图片路径列表
+        workers: 进程数（None 为 CPU 核数，1 为串行）
+        chunk_size: 每个任务包含的图片数
+        progress: 进度回调 progress(已完成数, 总数)，None 表示不报告
+    
+    Returns:
+        {图片路径: 指纹或None}
+    """
+    image_paths = list(image_paths)
+    total = len(image_paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    chunks = [image_paths[i:i + chunk_size] for i in range(0, total, chunk_size)]
+    results = {}
+    
+    # 大约每完成 10% 报告一次进度
+    report_step = max(1, total // 10)
+    next_report = report_step
+    
+    def collect(batch):
+        nonlocal next_report
+        results.update(batch)
+        if progress and (len(results) >= next_report or len(results) == total):
+            progress(len(results), total)
+            next_report = len(results) + report_step
+    
+    # 图片太少时进程启动开销不划算，直接串行
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            collect(_fingerprint_file_batch(chunk))
+        return results
+    
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        futures = [executor.submit(_fingerprint_file_batch, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            collect(future.result())
+    
+    return results
 
 
-def preload_image_hashes(image_folder, algorithm='phash'):
+def preload_image_hashes(image_folder, use_index=True, workers=None):
     """
-    预加载文件夹中所有图片的哈希值
+    预加载文件夹中所有图片的指纹
     用于启动时预热缓存
+    
+    use_index=True 时使用持久化指纹索引，只重新计算新增或修改过的图片，
+    需要计算的图片由 fingerprint_images 分发到 workers 个进程并行处理
     """
+    if use_index:
+        from hash_index import get_hash_index
+        
+        stats = get_hash_index().refresh(
+            image_folder,
+            lambda paths: fingerprint_images(paths, workers=workers)
+        )
+        fingerprints = stats['fingerprints']
+        for filename, fingerprint in fingerprints.items():
+            _image_hash_cache.put(os.path.join(image_folder, filename), fingerprint)
+        
+        _seed_bank(image_folder, fingerprints)
+        count = len(stats['fingerprints'])
+        print(f"[Info] Preloaded {count} image hashes from {image_folder} "
+              f"(new {stats['added']}, changed {stats['updated']}, "
+              f"removed {stats['removed']}, unchanged {stats['unchanged']})")
+        return count
+    
     valid_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
-    count = 0
+    image_paths = [
+        os.path.join(image_folder, filename)
+        for filename in os.listdir(image_folder)
+        if os.path.splitext(filename)[1].lower() in valid_extensions
+    ]
     
-    for filename in os.listdir(image_folder):
-        ext = os.path.splitext(filename)[1].lower()
-        if ext not in valid_extensions:
-            continue
-        
-        image_path = os.path.join(image_folder, filename)
-        get_image_hash(image_path, algorithm)
-        count += 1
+    fingerprints = {}
+    for image_path, fingerprint in fingerprint_images(image_paths, workers=workers).items():
+        if fingerprint is not None:
+            _image_hash_cache.put(image_path, fingerprint)
+            fingerprints[os.path.basename(image_path)] = fingerprint
+    count = len(fingerprints)
     
+    _seed_bank(image_folder, fingerprints)
     print(f"[Info] Preloaded {count} image hashes from {image_folder}")
     return count
 
@@ -0,0 +1,154 @@
+"""
+多模式关键词匹配（Aho-Corasick 自动机）
+把知识点标签、题型关键词、公式特征、学科关键词等词表编译进同一个自动机，
+一次线性扫描文本即可得到所有词表的全部命中，不再对每个词分别做子串查找
+
+自动机预先展开成确定性转移表（每个状态对所有出现过的字符都有转移），
+扫描时每个字符只需一次字典查询；未出现在任何关键词中的字符直接回到根状态
+"""
+import threading
+from collections import deque
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+
+class Keyword(NamedTuple):
+    """一个关键词及其所属词表"""
+    pattern: str
+    category: str
+    label: str
+    weight: float
+    case_sensitive: bool
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick 多模式匹配自动机
+
+    默认不区分大小写（文本和关键词都转成小写后匹配）；
+    区分大小写的关键词在小写文本上匹配后再按原文校验
+    """
+
+    def __init__(self):
+        self._keywords: Dict[Tuple[str, str, str], Keyword] = {}
+        self._lock = threading.Lock()
+        self._compiled = None
+
+    def __len__(self) -> int:
+        return len(self._keywords)
+
+    def add(self, pattern: str, category: str, label: str = None,
+            weight: float = 0.0, case_sensitive: bool = False):
+        """
+        登记关键词（同一词表中重复登记同一关键词和标签时覆盖）
+
+        Args:
+            pattern: 关键词
+            category: 所属词表名称
+            label: 标签（如学科名），默认为关键词本身
+            weight: 权重
+            case_sensitive: 是否区分大小写
+        """
+        if not pattern:
+            return
+        label = pattern if label is None else label
+        with self._lock:
+            self._keywords[(pattern, category, label)] = Keyword(
+                pattern, category, label, weight, case_sensitive
+            )
+            self._compiled = None
+
+    def add_vocabulary(self, category: str, patterns, case_sensitive: bool = False):
+        """
+        登记一组关键词
+
+        Args:
+            patterns: {关键词: 权重}、[(关键词, 权重), ...] 或 [关键词, ...]
+        """
+        items = patterns.items() if isinstance(patterns, dict) else patterns
+        for item in items:
+            pattern, weight = item if isinstance(item, tuple) else (item, 0.0)
+            self.add(pattern, category, weight=weight, case_sensitive=case_sensitive)
+
+    def _compile(self):
+        """构建字典树、失败指针，并展开成确定性转移表"""
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[Keyword]] = [[]]
+        for keyword in self._keywords.values():
+            node = 0
+            for ch in keyword.pattern.lower():
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                node = nxt
+            outputs[node].append(keyword)
+
+        # 广度优先计算失败指针，并把失败状态的转移和输出合并进来
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            transitions = dict(delta[fail[node]])
+            transitions.update(goto[node])
+            delta[node] = transitions
+            outputs[node] = outputs[node] + outputs[fail[node]]
+            for ch, child in goto[node].items():
+                fail[child] = delta[fail[node]].get(ch, 0)
+                queue.append(child)
+
+        # 输出按关键词长度保存，便于由结束位置推出起始位置
+        outputs = [tuple((len(k.pattern.lower()), k) for k in out) for out in outputs]
+        return delta, outputs
+
+    def scan(self, text: str) -> List[Tuple[int, Keyword]]:
+        """
+        扫描文本，返回全部命中 [(起始位置, 关键词), ...]（按结束位置排序，重叠命中全部返回）
+        """
+        with self._lock:
+            if self._compiled is None:
+                self._compiled = self._compile()
+            delta, outputs = self._compiled
+
+        text = text or ''
+        lower = text.lower()
+        # 大小写转换改变了长度时（极少见的字符），区分大小写的关键词改用子串检查
+        aligned = len(lower) == len(text)
+
+        hits = []
+        node = 0
+        for end, ch in enumerate(lower, 1):
+            node = delta[node].get(ch, 0)
+            if not outputs[node]:
+                continue
+            for length, keyword in outputs[node]:
+                start = end - length
+                if keyword.case_sensitive:
+                    if aligned:
+                        if text[start:end] != keyword.pattern:
+                            continue
+                    elif keyword.pattern not in text:
+                        continue
+                hits.append((start, keyword))
+        return hits
+
+    def hits(self, text: str) -> Dict[Tuple[str, str], Set[str]]:
+        """文本中出现的关键词，按词表和标签分组 {(词表名称, 标签): {关键词, ...}}"""
+        result: Dict[Tuple[str, str], Set[str]] = {}
+        for _, keyword in self.scan(text):
+            result.setdefault((keyword.category, keyword.label), set()).add(keyword.pattern)
+        return result
+
+
+# 全局实例：各模块在导入时登记自己的词表，共用同一个自动机
+_keyword_automaton = None
+
+
+def get_keyword_automaton() -> KeywordAutomaton:
+    """获取共享的关键词自动机"""
+    global _keyword_automaton
+    if _keyword_automaton is None:
+        _keyword_automaton = KeywordAutomaton()
+    return _keyword_automaton
@@ -4,7 +4,6 @@
 """
 import numpy as np
 from typing import List, Dict, Tuple, Optional
-from sklearn.metrics.pairwise import cosine_similarity
 import cv2
 
 try:
@@ -22,8 +21,12 @@ except ImportError:
     TORCH_AVAILABLE = False
     print("Warning: PyTorch not installed. 图像匹配功能将受限")
 
-from config import MATCHING_CONFIG, TEXT_EMBEDDING_MODEL, IMAGE_FEATURE_MODEL
+from config import MATCHING_CONFIG, RETRIEVAL_CONFIG, TEXT_EMBEDDING_MODEL, IMAGE_FEATURE_MODEL
 from database import QuestionDatabase
+from embedding_store import EmbeddingStore, top_k_indices
+from ann_index import load_or_build_index
+from projection import get_image_projection
+from retrieval import CandidateSet, RetrievalPipeline, fuse_results
 
 
 class QuestionMatcher:
@@ -55,8 +58,15 @@ class QuestionMatcher:
             self.image_model = None
             self.image_transform = None
         
-        # 加载题库嵌入
+        # ML 分类器（首次使用时加载）
+        self._ml_matcher = None
+        
+        # 图像特征降维投影（未拟合时为 None，直接使用原始特征）
+        self.image_projection = get_image_projection()
+        
+        # 加载题库嵌入和第一阶段候选索引
         self.load_question_embeddings()
+        self.retrieval = RetrievalPipeline(db)
     
     def _load_image_model(self):
         """加载预训练的图像特征提取模型"""
@@ -86,22 +96,16 @@ class QuestionMatcher:
     
     def load_question_embeddings(self):
         """从数据库加载所有题目的嵌入向量"""
-        question_ids, text_embeddings, image_embeddings = self.db.get_embeddings()
+        # 嵌入文件以内存映射打开（已归一化的连续矩阵），检索时只需一次矩阵-向量乘法
+        self.question_ids, self.text_store, self.image_store = self.db.get_embedding_stores()
         
-        self.question_ids = question_ids
-        self.text_embeddings = [e for e in text_embeddings if e is not None]
-        self.image_embeddings = [e for e in image_embeddings if e is not None]
-        
-        # 转换为numpy数组用于批量计算
-        if self.text_embeddings:
-            self.text_embeddings_matrix = np.vstack(self.text_embeddings)
-        else:
-            self.text_embeddings_matrix = None
+        # 题库图像嵌入必须与查询使用同一个投影版本
+        if not self.db.check_image_projection(self.image_projection.version if self.image_projection else None):
+            self.image_store = EmbeddingStore()
         
-        if self.image_embeddings:
-            self.image_embeddings_matrix = np.vstack(self.image_embeddings)
-        else:
-            self.image_embeddings_matrix = None
+        # 整库检索用的向量索引（题库较大时为近似最近邻索引）
+        self.text_index = load_or_build_index(self.text_store, 'text')
+        self.image_index = load_or_build_index(self.image_store, 'image')
     
     def extract_text_embedding(self, text: str) -> Optional[np.ndarray]:
         """提取文本嵌入向量"""
@@ -116,7 +120,22 @@ class QuestionMatcher:
             return None
     
     def extract_image_embedding(self, image_path: str) -> Optional[np.ndarray]:
-        """提取图像特征向量"""
+        """提取用于检索的图像嵌入（原始特征经降维投影）"""
+        return self.project_image_features(self.extract_image_features(image_path))
+    
+    def project_image_features(self, features: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """对原始图像特征应用当前投影（导入和查询共用，保证两边一致）"""
+        if features is None or self.image_projection is None:
+            return features
+        if features.size != self.image_projection.source_dim:
+            print(f"[Warning] Image feature dimension {features.size} does not match projection "
+                  f"{self.image_projection.version}")
+            return None
+        projected = self.image_projection.apply(features)
+        return projected / (np.linalg.norm(projected) + 1e-8)
+    
+    def extract_image_features(self, image_path: str) -> Optional[np.ndarray]:
+        """提取原始图像特征向量（未降维）"""
         if not self.image_model or not self.image_transform:
             return None
         
@@ -147,11 +166,28 @@ class QuestionMatcher:
             print(f"图像特征提取失败: {e}")
             return None
     
+    def _index_candidates(
+        self,
+        text_embedding: Optional[np.ndarray],
+        image_embedding: Optional[np.ndarray]
+    ) -> List[str]:
+        """由文本和图像向量索引各取最相似的 rerank_limit 道题作为候选"""
+        limit = RETRIEVAL_CONFIG['rerank_limit']
+        candidates = {}
+        if text_embedding is not None:
+            for qid, _ in self.text_index.search(text_embedding, limit):
+                candidates[qid] = True
+        if image_embedding is not None:
+            for qid, _ in self.image_index.search(image_embedding, limit):
+                candidates[qid] = True
+        return list(candidates)
+    
     def find_similar_questions(
         self, 
         text_embedding: Optional[np.ndarray] = None,
         image_embedding: Optional[np.ndarray] = None,
-        top_k: int = None
+        top_k: int = None,
+        candidates: Optional[List[str]] = None
     ) -> List[Dict]:
         """
         查找相似题目
@@ -160,6 +196,7 @@ class QuestionMatcher:
             text_embedding: 文本嵌入向量
             image_embedding: 图像嵌入向量
             top_k: 返回前K个结果
+            candidates: 只对这些题目打分（None 表示由向量索引在整个题库中检索候选）
             
         Returns:
             匹配结果列表，包含题目ID、相似度等信息
@@ -171,29 +208,29 @@ class QuestionMatcher:
         image_weight = MATCHING_CONFIG['image_weight']
         threshold = MATCHING_CONFIG['similarity_threshold']
         
+        if candidates is None:
+            candidates = self._index_candidates(text_embedding, image_embedding)
+        question_ids = list(candidates)
+        if not question_ids:
+            return []
+        text_rows = self.text_store.rows_of(question_ids)
+        image_rows = self.image_store.rows_of(question_ids)
+        
         # 计算文本相似度
         text_similarities = None
-        if text_embedding is not None and self.text_embeddings_matrix is not None:
-            text_similarities = cosine_similarity(
-                text_embedding.reshape(1, -1), 
-                self.text_embeddings_matrix
-            )[0]
+        if text_embedding is not None and len(self.text_store):
+            text_similarities = self.text_store.similarities(text_embedding, text_rows)
         
         # 计算图像相似度
         image_similarities = None
-        if image_embedding is not None and self.image_embeddings_matrix is not None:
-            image_similarities = cosine_similarity(
-                image_embedding.reshape(1, -1),
-                self.image_embeddings_matrix
-            )[0]
+        if image_embedding is not None and len(self.image_store):
+            image_similarities = self.image_store.similarities(image_embedding, image_rows)
         
         # 综合相似度
         if text_similarities is not None and image_similarities is not None:
-            # 确保两个数组长度一致
-            min_len = min(len(text_similarities), len(image_similarities))
             combined_similarities = (
-                text_weight * text_similarities[:min_len] + 
-                image_weight * image_similarities[:min_len]
+                text_weight * text_similarities + 
+                image_weight * image_similarities
             )
         elif text_similarities is not None:
             combined_similarities = text_similarities
@@ -202,17 +239,13 @@ class QuestionMatcher:
         else:
             return []
         
-        # 获取Top-K结果
-        top_indices = np.argsort(combined_similarities)[::-1][:top_k]
+        # 获取Top-K结果（先按阈值过滤，再用 argpartition 选出前K个）
+        top_indices = top_k_indices(combined_similarities, top_k, threshold)
         
         results = []
         for idx in top_indices:
             similarity = float(combined_similarities[idx])
-            
-            if similarity < threshold:
-                continue
-            
-            question_id = self.question_ids[idx]
+            question_id = question_ids[idx]
             question = self.db.get_question_by_id(question_id)
             
             if question:
@@ -226,26 +259,60 @@ class QuestionMatcher:
         
         return results
     
+    def _get_ml_matcher(self):
+        """ML 分类器（加载一次后复用）"""
+        if self._ml_matcher is None:
+            from ml_matcher import MLMatcher
+            self._ml_matcher = MLMatcher()
+        return self._ml_matcher
+    
+    def gather_candidates(self, image_path: str, ocr_text: str = None, formulas=()) -> CandidateSet:
+        """第一阶段：由图像哈希、全文检索、公式索引和 MinHash 收集候选题目"""
+        image_bytes = None
+        try:
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        except Exception as e:
+            print(f"[Warning] Failed to read query image: {e}")
+        return self.retrieval.gather(ocr_text or '', formulas, image_bytes)
+    
     def match_question(
         self, 
         image_path: str, 
         ocr_text: str = None,
-        use_ml: bool = True
+        use_ml: bool = True,
+        candidates: Optional[CandidateSet] = None,
+        formulas=()
     ) -> List[Dict]:
         """
         匹配题目（主接口，支持ML增强）
         
+        第一阶段收集候选，第二阶段只对候选计算嵌入相似度和ML评分；
+        没有候选时按 RETRIEVAL_CONFIG['fallback_full_scan'] 决定是否扫描全部题库
+        
         Args:
             image_path: 上传的题目图片路径
             ocr_text: OCR识别的文本（可选，如果不提供会自动识别）
             use_ml: 是否使用机器学习增强匹配
+            candidates: 已收集的第一阶段候选（None 时自动收集）
+            formulas: OCR 单独识别出的公式（用于公式索引候选）
             
         Returns:
             匹配结果列表
         """
-        from .config import config
+        from config import config
+        
+        # 第一阶段：候选收集
+        if candidates is None:
+            candidates = self.gather_candidates(image_path, ocr_text, formulas)
+        if len(candidates):
+            candidate_ids = candidates.question_ids(RETRIEVAL_CONFIG['rerank_limit'])
+        elif RETRIEVAL_CONFIG['fallback_full_scan']:
+            candidate_ids = None
+        else:
+            return []
         
-        # 提取特征
+        # 第二阶段：提取特征，只对候选打分
         text_embedding = None
         if ocr_text:
             text_embedding = self.extract_text_embedding(ocr_text)
@@ -255,21 +322,23 @@ class QuestionMatcher:
         # 查找相似题目
         results = self.find_similar_questions(
             text_embedding=text_embedding,
-            image_embedding=image_embedding
+            image_embedding=image_embedding,
+            candidates=candidate_ids
         )
         
         # ML增强：重新计算相似度
         if use_ml and config.ENABLE_ML_MATCHING and text_embedding is not None:
             try:
-                from .ml_matcher import MLMatcher
-                ml_matcher = MLMatcher()
+                ml_matcher = self._get_ml_matcher()
                 
                 if ml_matcher.classifier is not None:
                     # 使用ML模型重新评分
-                    for result in results:
+                    for result in results[:RETRIEVAL_CONFIG['ml_limit']]:
                         q = result['question']
-                        # 获取候选题目的embedding
-                        candidate_embedding = self.text_embeddings[self.question_ids.index(q['question_id'])]
+                        # 获取候选题目的embedding（还原为原始长度）
+                        candidate_embedding = self.text_store.vector(q['question_id'], normalized=False)
+                        if candidate_embedding is None:
+                            continue
                         
                         # ML预测相似度
                         ml_similarity = ml_matcher.predict_similarity(
@@ -290,7 +359,8 @@ class QuestionMatcher:
             except Exception as e:
                 print(f"⚠️  ML增强失败: {e}")
         
-        return results
+        # 第一阶段各来源的排名与嵌入相似度排名做倒数名次融合
+        return fuse_results(candidates, results)
     
     def add_question_to_index(self, question_data: Dict):
         """
@@ -299,8 +369,13 @@ class QuestionMatcher:
         Args:
             question_data: 题目数据
         """
-        # 重新加载嵌入
-        self.load_question_embeddings()
+        # 增量更新向量索引和候选索引
+        question_id = question_data['question_id']
+        self.text_index.add(question_id, question_data.get('text_embedding'))
+        self.image_index.add(question_id, question_data.get('image_embedding'))
+        if question_id not in self.question_ids:
+            self.question_ids.append(question_id)
+        self.retrieval.add_question(question_data)
 
 
 class SimpleTextMatcher:
@@ -0,0 +1,163 @@
+"""
+MinHash / LSH 近似重复检测
+题目文本切成字符 3-gram 集合后计算 MinHash 签名（NUM_PERM 个 32 位最小哈希值），
+两个签名相同位置取值相等的比例即 Jaccard 相似度的估计。
+LSH 把签名分成 LSH_BANDS 段，任一段完全相同的题目进入同一个桶，
+查询时只比较同桶题目，候选生成的代价与题库大小无关
+"""
+import threading
+import zlib
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from text_index import normalize_text
+
+# 签名长度（排列数）和分段：32 段 × 4 行，相似度约 0.42 以上的题目大概率成为候选
+NUM_PERM = 128
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERM // LSH_BANDS
+
+# 字符 shingle 长度
+SHINGLE_SIZE = 3
+
+# 哈希参数的随机种子：修改 NUM_PERM 或种子后，已存储的签名需要重新计算
+MINHASH_SEED = 20240601
+
+# 默认的近似重复阈值（估计 Jaccard 相似度）
+DUPLICATE_THRESHOLD = 0.5
+
+_rng = np.random.default_rng(MINHASH_SEED)
+# 乘移位哈希 h(x) = (a*x + b) >> 32，a 为奇数，uint64 乘法自然取模 2^64
+_HASH_A = _rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """规范化文本的字符 shingle 集合（文本短于 size 时整体作为一个 shingle）"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def compute_signature(text: str) -> Optional[np.ndarray]:
+    """计算文本的 MinHash 签名（uint32 数组），空文本返回 None"""
+    grams = shingles(text)
+    if not grams:
+        return None
+    values = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams),
+                         dtype=np.uint64, count=len(grams))
+    hashed = (_HASH_A[:, None] * values[None, :] + _HASH_B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def signature_from_bytes(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """从数据库 BLOB 还原签名，长度不符（参数已变化）时返回 None"""
+    if not data or len(data) != NUM_PERM * 4:
+        return None
+    return np.frombuffer(data, dtype=np.uint32)
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """由两个签名估计 Jaccard 相似度"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class MinHashLSH:
+    """MinHash 签名的 LSH 分段索引"""
+
+    def __init__(self, bands: int = LSH_BANDS, rows: int = LSH_ROWS):
+        if bands * rows > NUM_PERM:
+            raise ValueError("bands * rows must not exceed NUM_PERM")
+        self.bands = bands
+        self.rows = rows
+        self._lock = threading.Lock()
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[Hashable]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key) -> bool:
+        return key in self._signatures
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, signature: Optional[np.ndarray]):
+        """登记或更新签名（签名为 None 时删除）"""
+        with self._lock:
+            self._remove(key)
+            if signature is None:
+                return
+            self._signatures[key] = signature
+            for band, band_key in zip(self._buckets, self._band_keys(signature)):
+                band.setdefault(band_key, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket = band[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del band[band_key]
+
+    def candidates(self, signature: np.ndarray) -> Set[Hashable]:
+        """与签名至少有一段完全相同的题目"""
+        found = set()
+        with self._lock:
+            for band, band_key in zip(self._buckets, self._band_keys(signature)):
+                found.update(band.get(band_key, ()))
+        return found
+
+    def query(self, signature: Optional[np.ndarray], threshold: float = DUPLICATE_THRESHOLD,
+              exclude: Hashable = None) -> List[Tuple[Hashable, float]]:
+        """近似重复候选 [(键, 估计相似度), ...]，按相似度降序"""
+        if signature is None:
+            return []
+        matches = []
+        for key in self.candidates(signature):
+            if key == exclude:
+                continue
+            similarity = estimate_similarity(signature, self._signatures[key])
+            if similarity >= threshold:
+                matches.append((key, similarity))
+        matches.sort(key=lambda m: (-m[1], str(m[0])))
+        return matches
+
+    def query_text(self, text: str, threshold: float = DUPLICATE_THRESHOLD) -> List[Tuple[Hashable, float]]:
+        return self.query(compute_signature(text), threshold)
+
+    def duplicate_pairs(self, threshold: float = DUPLICATE_THRESHOLD) -> List[Tuple[Hashable, Hashable, float]]:
+        """题库内的近似重复对 [(键1, 键2, 估计相似度), ...]，按相似度降序"""
+        with self._lock:
+            pairs = set()
+            for band in self._buckets:
+                for bucket in band.values():
+                    if len(bucket) > 1:
+                        members = sorted(bucket, key=str)
+                        pairs.update((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+            signatures = dict(self._signatures)
+
+        result = []
+        for a, b in pairs:
+            similarity = estimate_similarity(signatures[a], signatures[b])
+            if similarity >= threshold:
+                result.append((a, b, similarity))
+        result.sort(key=lambda p: (-p[2], str(p[0]), str(p[1])))
+        return result
+
+
+def build_lsh(texts: Iterable[Tuple[Hashable, str]]) -> MinHashLSH:
+    """由 [(键, 文本), ...] 建立 LSH 索引"""
+    lsh = MinHashLSH()
+    for key, text in texts:
+        lsh.add(key, compute_signature(text))
+    return lsh
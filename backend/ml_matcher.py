@@ -11,7 +11,7 @@ from pathlib import Path
 from typing import List, Tuple, Optional, Dict, Any
 import json
 
-from .config import config
+from config import config
 
 
 class MLMatcher:
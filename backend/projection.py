@@ -0,0 +1,137 @@
+"""
+图像特征降维投影
+在题库的原始图像特征（ResNet 2048 维）上离线拟合 PCA（可选白化），
+投影到 PROJECTION_CONFIG['dim'] 维；导入题目和查询时使用同一个投影，
+图像检索的内存和计算量随维度成比例下降。
+
+投影矩阵带版本号（维度 + 内容摘要），图像嵌入文件的元数据记录写入时使用的版本，
+版本不一致的嵌入不能与当前投影后的查询向量比较
+"""
+import hashlib
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from config import PROJECTION_CONFIG
+
+# 拟合时最多使用的样本数
+FIT_SAMPLES = 20000
+FIT_SEED = 20240601
+
+# 白化时加到特征值上的平滑项（相对最大特征值）
+WHITEN_EPSILON = 1e-4
+
+
+class PCAProjection:
+    """y = (x - mean) @ components.T"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, explained: float = 0.0,
+                 whiten: bool = False):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # (dim, source_dim)
+        self.explained = float(explained)  # 保留的方差比例
+        self.whiten = bool(whiten)
+        digest = hashlib.sha1(self.mean.tobytes() + self.components.tobytes()).hexdigest()[:10]
+        self.version = f"pca{self.source_dim}x{self.dim}{'w' if self.whiten else ''}-{digest}"
+
+    @property
+    def source_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, dim: int, whiten: bool = False) -> 'PCAProjection':
+        """
+        在 (n, source_dim) 的原始特征上拟合
+
+        特征先做 L2 归一化（与检索时的余弦相似度一致），
+        协方差矩阵特征分解后取特征值最大的 dim 个方向
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if len(matrix) > FIT_SAMPLES:
+            rng = np.random.default_rng(FIT_SEED)
+            matrix = matrix[np.sort(rng.choice(len(matrix), FIT_SAMPLES, replace=False))]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+
+        dim = min(dim, matrix.shape[1])
+        mean = matrix.mean(axis=0)
+        centered = (matrix - mean).astype(np.float64)
+        covariance = centered.T @ centered / max(len(matrix) - 1, 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:dim]
+        eigenvalues = np.maximum(eigenvalues[order], 0.0)
+        components = eigenvectors[:, order].T
+        explained = float(eigenvalues.sum() / max(np.maximum(np.linalg.eigvalsh(covariance), 0).sum(), 1e-12))
+        if whiten:
+            components = components / np.sqrt(eigenvalues + WHITEN_EPSILON * eigenvalues[0])[:, None]
+        return cls(mean, components, explained, whiten)
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """投影一个向量 (source_dim,) 或一批向量 (n, source_dim)，输入先做 L2 归一化"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        single = vectors.ndim == 1
+        vectors = np.atleast_2d(vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        projected = (vectors / norms - self.mean) @ self.components.T
+        return projected[0] if single else projected
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, mean=self.mean, components=self.components,
+                 explained=self.explained, whiten=self.whiten, version=self.version)
+
+    @classmethod
+    def load(cls, path: str) -> 'PCAProjection':
+        data = np.load(path)
+        projection = cls(data['mean'], data['components'], float(data['explained']), bool(data['whiten']))
+        if str(data['version']) != projection.version:
+            raise ValueError(f"projection {path} is corrupted (version mismatch)")
+        return projection
+
+
+def neighbour_recall(original: np.ndarray, projected: np.ndarray, queries: np.ndarray, k: int = 10) -> float:
+    """
+    投影前后最近邻的重合率：以题库中的 queries 行为查询（排除自身），
+    比较原始空间和投影空间中余弦相似度前 k 名的交集比例
+    """
+    def top_k(matrix, rows):
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        scores = matrix[rows] @ matrix.T
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return np.argpartition(-scores, k, axis=1)[:, :k]
+
+    k = min(k, len(original) - 1)
+    if k <= 0 or len(queries) == 0:
+        return 1.0
+    truth = top_k(np.asarray(original, dtype=np.float32), queries)
+    found = top_k(np.asarray(projected, dtype=np.float32), queries)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(truth.tolist(), found.tolist())]))
+
+
+_projection = None
+_projection_loaded = False
+_projection_lock = threading.Lock()
+
+
+def get_image_projection() -> Optional[PCAProjection]:
+    """当前使用的图像投影（未启用或尚未拟合时为 None）"""
+    global _projection, _projection_loaded
+    with _projection_lock:
+        if not _projection_loaded:
+            _projection_loaded = True
+            path = PROJECTION_CONFIG['path']
+            if PROJECTION_CONFIG['enabled'] and os.path.exists(path):
+                try:
+                    _projection = PCAProjection.load(path)
+                    print(f"[Info] Loaded image projection {_projection.version}")
+                except Exception as e:
+                    print(f"[Warning] Failed to load image projection {path}: {e}")
+        return _projection
@@ -0,0 +1,250 @@
+"""
+两阶段检索
+第一阶段由图像哈希、全文检索、公式索引、MinHash 等廉价索引各自给出少量候选，
+用倒数名次融合（RRF）合并成不超过 candidate_limit 道题的候选集；
+第二阶段的嵌入向量、ML 分类器和 Ollama 重排只对候选集打分，
+昂贵打分的代价随候选数而不是题库大小增长
+"""
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import RETRIEVAL_CONFIG, QUESTION_BANK_DIR
+from formula_index import extract_formulas, get_formula_index
+from minhash_index import MinHashLSH, compute_signature
+
+try:
+    from image_matcher import find_similar_fused, preload_image_hashes, watch_image_folder
+    IMAGE_MATCHER_AVAILABLE = True
+except ImportError:
+    IMAGE_MATCHER_AVAILABLE = False
+
+# 图像哈希候选的融合相似度阈值
+IMAGE_CANDIDATE_THRESHOLD = 0.5
+
+
+Ranked = List[Tuple[str, float]]
+
+# 已预加载并监视的图片目录 {目录绝对路径: DirectoryWatcher}，多个检索管线共用
+_image_watchers: Dict = {}
+_image_watchers_lock = threading.Lock()
+
+
+def watch_question_images(image_folder: str):
+    """
+    预加载题库图片指纹（持久化指纹索引 + 多进程计算）并监视目录（每个目录只执行一次）
+
+    之后题库索引由监视器推送变化，检索时不再扫描目录
+    """
+    if not IMAGE_MATCHER_AVAILABLE or not os.path.isdir(image_folder):
+        return None
+    key = os.path.abspath(image_folder)
+    with _image_watchers_lock:
+        watcher = _image_watchers.get(key)
+        if watcher is None:
+            try:
+                preload_image_hashes(image_folder)
+                watcher = watch_image_folder(image_folder)
+                _image_watchers[key] = watcher
+            except Exception as e:
+                print(f"[Warning] Failed to preload question images {image_folder}: {e}")
+        return watcher
+
+
+def reciprocal_rank_fusion(sources: Iterable[Tuple[str, Ranked]],
+                           k: Optional[int] = None,
+                           weights: Optional[Dict[str, float]] = None
+                           ) -> List[Tuple[str, float, Dict[str, float]]]:
+    """
+    倒数名次融合（RRF）
+
+    每个来源只贡献名次：第 r 名（从 1 开始）得 权重 / (k + r)，题目的融合分数为各来源贡献之和。
+    各来源的分数尺度不同也无需归一化，新增来源不会改变其他来源的相对排名
+
+    Args:
+        sources: [(来源名称, [(question_id, 分数), ...]), ...]，每个列表按相关度降序
+        k: 融合常数，默认 RETRIEVAL_CONFIG['rrf_k']
+        weights: 各来源权重，默认 RETRIEVAL_CONFIG['fusion_weights']（未列出的来源为 1.0）
+
+    Returns:
+        [(question_id, 融合分数, {来源: 原始分数}), ...]，按融合分数降序，
+        同分时按来源顺序和名次先出现的在前
+    """
+    k = RETRIEVAL_CONFIG['rrf_k'] if k is None else k
+    weights = RETRIEVAL_CONFIG['fusion_weights'] if weights is None else weights
+
+    fused: Dict[str, float] = {}
+    source_scores: Dict[str, Dict[str, float]] = {}
+    for name, matches in sources:
+        weight = weights.get(name, 1.0)
+        seen = set()
+        for rank, (question_id, score) in enumerate(matches, 1):
+            # 同一来源重复给出同一题时只计排名最高的一次
+            if question_id in seen:
+                continue
+            seen.add(question_id)
+            fused[question_id] = fused.get(question_id, 0.0) + weight / (k + rank)
+            source_scores.setdefault(question_id, {})[name] = score
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return [(question_id, score, source_scores[question_id]) for question_id, score in ranked]
+
+
+class CandidateSet:
+    """第一阶段的候选题目（按融合分数降序），并记录每个来源给出的分数"""
+
+    def __init__(self, sources: List[Tuple[str, Ranked]] = ()):
+        # 参与融合的各来源候选列表（已截断到 source_limit）
+        self.sources = list(sources)
+        self._fused: Dict[str, float] = {}
+        self._scores: Dict[str, Dict[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._fused)
+
+    def __contains__(self, question_id) -> bool:
+        return question_id in self._fused
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fused)
+
+    def add(self, question_id: str, fused_score: float, scores: Dict[str, float]):
+        self._fused[question_id] = fused_score
+        self._scores[question_id] = scores
+
+    def question_ids(self, limit: Optional[int] = None) -> List[str]:
+        return list(self._fused)[:limit]
+
+    def fused_score(self, question_id: str) -> float:
+        return self._fused.get(question_id, 0.0)
+
+    def scores(self, question_id: str) -> Dict[str, float]:
+        """{来源: 原始分数}"""
+        return self._scores.get(question_id, {})
+
+    def fuse(self, name: str, matches: Ranked) -> List[Tuple[str, float, Dict[str, float]]]:
+        """把第二阶段的排序结果作为新来源，与第一阶段各来源一起重新融合"""
+        return reciprocal_rank_fusion(self.sources + [(name, matches)])
+
+
+def fuse_results(candidates: CandidateSet, results: List[Dict], name: str = 'embedding') -> List[Dict]:
+    """
+    把第二阶段的结果（按 similarity 降序的字典列表）与第一阶段各来源融合后重新排序
+
+    只保留第二阶段给出的结果；每个结果增加 fusion_score 和 source_scores（各来源原始分数，便于调试）
+    """
+    if not len(candidates) or not results:
+        return results
+    by_id = {r['question_id']: r for r in results}
+    fused = []
+    for question_id, fused_score, scores in candidates.fuse(
+            name, [(r['question_id'], r['similarity']) for r in results]):
+        result = by_id.get(question_id)
+        if result is not None:
+            result['fusion_score'] = fused_score
+            result['source_scores'] = scores
+            fused.append(result)
+    return fused
+
+
+def gather_candidates(sources: Iterable[Tuple[str, Ranked]],
+                      limit: Optional[int] = None,
+                      source_limit: Optional[int] = None) -> CandidateSet:
+    """
+    合并各来源的候选
+
+    各来源取前 source_limit 个候选做倒数名次融合，按融合分数取前 limit 道题
+
+    Args:
+        sources: [(来源名称, [(question_id, 分数), ...]), ...]，每个列表按相关度降序
+        limit: 候选总数上限
+        source_limit: 每个来源的候选数上限
+    """
+    limit = RETRIEVAL_CONFIG['candidate_limit'] if limit is None else limit
+    source_limit = RETRIEVAL_CONFIG['source_limit'] if source_limit is None else source_limit
+
+    truncated = [(name, list(matches[:source_limit])) for name, matches in sources]
+    candidates = CandidateSet(truncated)
+    for question_id, fused_score, scores in reciprocal_rank_fusion(truncated)[:limit]:
+        candidates.add(question_id, fused_score, scores)
+    return candidates
+
+
+class RetrievalPipeline:
+    """题库数据库上的第一阶段候选收集"""
+
+    def __init__(self, db, image_folder: str = QUESTION_BANK_DIR, config: Optional[Dict] = None):
+        """
+        Args:
+            db: QuestionDatabase 实例
+            image_folder: 题目图片目录（图片文件名即题号）
+            config: 覆盖 RETRIEVAL_CONFIG 中的部分预算
+        """
+        self.db = db
+        self.image_folder = image_folder
+        self.config = dict(RETRIEVAL_CONFIG, **(config or {}))
+        self.formula_index = get_formula_index()
+        self.near_duplicates = MinHashLSH()
+        self.reload()
+        watch_question_images(image_folder)
+
+    def reload(self):
+        """重新读取题库的 MinHash 签名（公式索引为全局共享实例，为空时才从数据库建立）"""
+        near_duplicates = MinHashLSH()
+        for question_id, signature in self.db.get_minhash_signatures().items():
+            near_duplicates.add(question_id, signature)
+        self.near_duplicates = near_duplicates
+        if len(self.formula_index) == 0:
+            self.formula_index.load_from_database(self.db.db_path)
+
+    def add_question(self, question_data: Dict):
+        """把新导入的题目加入公式索引和 MinHash 索引"""
+        question_id = question_data['question_id']
+        ocr_text = question_data.get('ocr_text') or ''
+        formulas = extract_formulas(ocr_text)
+        if question_data.get('latex_formula'):
+            formulas.append(question_data['latex_formula'])
+        self.formula_index.add(question_id, formulas)
+        self.near_duplicates.add(question_id, compute_signature(ocr_text))
+
+    def image_candidates(self, image_bytes: Optional[bytes]) -> List[Tuple[str, float]]:
+        """图像多指纹融合检索的候选 [(question_id, 相似度), ...]"""
+        if not image_bytes or not IMAGE_MATCHER_AVAILABLE or not os.path.isdir(self.image_folder):
+            return []
+        try:
+            matches = find_similar_fused(image_bytes, self.image_folder,
+                                         threshold=IMAGE_CANDIDATE_THRESHOLD,
+                                         top_k=self.config['source_limit'])
+        except Exception as e:
+            print(f"[Warning] Image candidate search failed: {e}")
+            return []
+        return [(os.path.splitext(filename)[0], similarity) for filename, similarity in matches]
+
+    def text_candidates(self, ocr_text: str) -> List[Tuple[str, float]]:
+        """全文检索的候选 [(question_id, -bm25), ...]（分数越大越相关）"""
+        if not ocr_text:
+            return []
+        return [(r['question_id'], -r['score'])
+                for r in self.db.search_text(ocr_text, limit=self.config['source_limit'])]
+
+    def gather(self, ocr_text: str = '', formulas: Iterable[str] = (),
+               image_bytes: Optional[bytes] = None) -> CandidateSet:
+        """
+        第一阶段：收集候选题目
+
+        Args:
+            ocr_text: OCR 识别文本
+            formulas: OCR 单独识别出的公式
+            image_bytes: 查询图片的字节数据
+        """
+        ocr_text = ocr_text or ''
+        sources = [
+            ('formula', self.formula_index.lookup_text(ocr_text, formulas)),
+            ('image', self.image_candidates(image_bytes)),
+            ('text', self.text_candidates(ocr_text)),
+            ('near_duplicate', self.near_duplicates.query_text(ocr_text)),
+        ]
+        candidates = gather_candidates(sources, self.config['candidate_limit'], self.config['source_limit'])
+        print(f"[Info] Retrieval stage 1: {len(candidates)} candidates "
+              f"({', '.join(f'{name}={len(matches)}' for name, matches in sources)})")
+        return candidates
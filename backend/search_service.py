@@ -1,14 +1,44 @@
 import sqlite3
 import os
-from typing import List, Dict, Any
+import unicodedata
+from typing import List, Dict, Any, Optional, Set
+
+from database import QuestionDatabase
+
+
+def _read_answer(answer_path: Optional[str]) -> str:
+    if answer_path and os.path.exists(answer_path):
+        try:
+            with open(answer_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except Exception as e:
+            print(f"[Warning] Failed to read answer {answer_path}: {e}")
+    return ''
+
+
+def _trigrams(text: str) -> Set[str]:
+    """与全文检索查询相同的切分方式：按空白分段后取每段的 3 字符子串"""
+    grams = set()
+    for segment in unicodedata.normalize('NFKC', text or '').lower().split():
+        grams.update(segment[i:i + 3] for i in range(len(segment) - 2))
+    return grams
+
 
 class SearchService:
     def __init__(self):
         self.db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'database.db')
+        self._db: Optional[QuestionDatabase] = None
+
+    def _get_db(self) -> QuestionDatabase:
+        if self._db is None:
+            self._db = QuestionDatabase(self.db_path)
+        return self._db
 
-    def search_questions(self, text: str) -> List[Dict[str, Any]]:
+    def search_questions(self, text: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
-        根据文本搜索题目
+        根据文本搜索题目（FTS5 trigram 全文检索，按 bm25 排序）
+
+        similarity 为查询 trigram 被题目文本和答案覆盖的比例
         """
         results = []
         if not os.path.exists(self.db_path):
@@ -16,44 +46,41 @@ class SearchService:
             return results
 
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # 简单的关键词匹配逻辑
-            # 实际项目中应使用向量搜索或全文检索
-            
-            # 1. 尝试精确包含
-            cursor.execute("SELECT * FROM questions WHERE content LIKE ? LIMIT 5", (f"%{text}%",))
-            rows = cursor.fetchall()
-            
-            if not rows and len(text) > 2:
-                # 2. 尝试部分匹配
-                keyword = text[:5] # 取前5个字
-                cursor.execute("SELECT * FROM questions WHERE content LIKE ? LIMIT 5", (f"%{keyword}%",))
-                rows = cursor.fetchall()
-            
-            if not rows:
-                # 3. 如果还是没有，随机返回几个作为演示
-                cursor.execute("SELECT * FROM questions ORDER BY RANDOM() LIMIT 3")
-                rows = cursor.fetchall()
-                similarity_base = 0.4 # 随机的相似度低
-            else:
-                similarity_base = 0.9 # 匹配到的相似度高
-
-            for row in rows:
+            db = self._get_db()
+            query_grams = _trigrams(text)
+            for match in db.search_text(text, limit=top_k):
+                question = db.get_question_by_id(match['question_id'])
+                if not question:
+                    continue
+                content = question.get('ocr_text') or ''
+                answer = question.get('answer_text') or _read_answer(question.get('answer_path'))
+                covered = query_grams & _trigrams(f"{content}\n{question.get('latex_formula') or ''}\n{answer}")
                 results.append({
-                    'question_id': row['question_id'],
-                    'category': row['category'],
-                    'content': row['content'],
-                    'answer': row['answer'],
-                    'similarity': similarity_base
+                    'question_id': match['question_id'],
+                    'category': match['category'],
+                    'content': content,
+                    'answer': answer,
+                    'similarity': round(len(covered) / len(query_grams), 4) if query_grams else 0.0
                 })
-                
-            conn.close()
+
+            if not results:
+                # 没有任何匹配时随机返回几个作为演示
+                conn = sqlite3.connect(self.db_path)
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("SELECT question_id, category, ocr_text, answer_path FROM questions ORDER BY RANDOM() LIMIT 3")
+                for row in cursor.fetchall():
+                    results.append({
+                        'question_id': row['question_id'],
+                        'category': row['category'],
+                        'content': row['ocr_text'] or '',
+                        'answer': _read_answer(row['answer_path']),
+                        'similarity': 0.4  # 随机的相似度低
+                    })
+                conn.close()
         except Exception as e:
             print(f"Search error: {e}")
-            
+
         return results
 
 # 单例实例
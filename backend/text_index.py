@@ -0,0 +1,237 @@
+"""
+BM25 文本倒排索引
+以字符 2-gram/3-gram 为词项（中文不需要分词，LaTeX 公式片段也能直接匹配），
+倒排表按文档编号递增存放，文档编号差值和词频用变长整数(varint)压缩，
+查询时只解码查询词项的倒排表，累加 BM25 分数后取 Top-K
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 默认 n-gram 长度
+NGRAM_SIZES = (2, 3)
+
+# 已删除文档占比超过该值时重新压缩倒排表
+COMPACT_RATIO = 0.2
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """全角转半角、统一小写、去掉空白"""
+    return _WHITESPACE.sub('', unicodedata.normalize('NFKC', text or '').lower())
+
+
+def char_ngrams(text: str, sizes: Iterable[int] = NGRAM_SIZES) -> Counter:
+    """规范化后的字符 n-gram 及其出现次数（文本短于 n 时整体作为一个词项）"""
+    text = normalize_text(text)
+    grams = Counter()
+    for n in sizes:
+        if len(text) < n:
+            if text:
+                grams[text] += 1
+            continue
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def encode_varint(value: int, out: bytearray):
+    """把非负整数按 7 位一组追加到 out（低位在前，最高位为 1 表示后面还有字节）"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """向量化解码一串 varint，返回 uint64 数组"""
+    raw = np.frombuffer(bytes(data), dtype=np.uint8)
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    shifts = (np.arange(raw.size) - np.repeat(starts, lengths)) * 7
+    parts = (raw & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+class _Posting:
+    """
+    单个词项的压缩倒排表：交替存放 (文档编号差值, 词频)
+    df 为包含该词项的存活文档数（已删除文档仍留在倒排表中，直到重新压缩）
+    """
+
+    __slots__ = ('data', 'last_doc', 'df')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.last_doc = -1
+        self.df = 0
+
+    def append(self, doc: int, tf: int):
+        encode_varint(doc - self.last_doc - 1, self.data)
+        encode_varint(tf, self.data)
+        self.last_doc = doc
+        self.df += 1
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        values = decode_varints(self.data)
+        docs = np.cumsum(values[0::2].astype(np.int64) + 1) - 1
+        return docs, values[1::2].astype(np.float64)
+
+
+class BM25Index:
+    """
+    字符 n-gram BM25 索引
+
+    文档以任意可哈希的键标识；更新文档时旧版本标记删除、新版本追加到倒排表末尾，
+    删除比例过高时整体重新压缩
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, ngram_sizes: Iterable[int] = NGRAM_SIZES):
+        self.k1 = k1
+        self.b = b
+        self.ngram_sizes = tuple(ngram_sizes)
+
+        self._lock = threading.RLock()
+        self._postings: Dict[str, _Posting] = {}
+        self._doc_keys: List[Optional[Hashable]] = []
+        self._doc_ids: Dict[Hashable, int] = {}
+        self._doc_lengths = np.zeros(0, dtype=np.float64)
+        self._doc_terms: List[Optional[Counter]] = []
+        self._total_length = 0
+        self._deleted = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def __contains__(self, key) -> bool:
+        return key in self._doc_ids
+
+    @property
+    def avg_length(self) -> float:
+        return self._total_length / len(self._doc_ids) if self._doc_ids else 0.0
+
+    def add(self, key, text: str):
+        """新增或更新一个文档"""
+        terms = char_ngrams(text, self.ngram_sizes)
+        with self._lock:
+            self._remove(key)
+            self._append(key, terms)
+            if self._deleted > COMPACT_RATIO * max(len(self._doc_keys), 1):
+                self._compact()
+
+    def remove(self, key) -> bool:
+        with self._lock:
+            removed = self._remove(key)
+            if removed and self._deleted > COMPACT_RATIO * max(len(self._doc_keys), 1):
+                self._compact()
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_keys = []
+            self._doc_ids.clear()
+            self._doc_lengths = np.zeros(0, dtype=np.float64)
+            self._doc_terms = []
+            self._total_length = 0
+            self._deleted = 0
+
+    def _append(self, key, terms: Counter):
+        doc = len(self._doc_keys)
+        for term, tf in terms.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = _Posting()
+            posting.append(doc, tf)
+
+        length = sum(terms.values())
+        if doc == len(self._doc_lengths):
+            grown = np.zeros(max(64, doc * 2), dtype=np.float64)
+            grown[:doc] = self._doc_lengths
+            self._doc_lengths = grown
+        self._doc_lengths[doc] = length
+        self._doc_keys.append(key)
+        self._doc_terms.append(terms)
+        self._doc_ids[key] = doc
+        self._total_length += length
+
+    def _remove(self, key) -> bool:
+        doc = self._doc_ids.pop(key, None)
+        if doc is None:
+            return False
+        self._total_length -= int(self._doc_lengths[doc])
+        for term in self._doc_terms[doc]:
+            self._postings[term].df -= 1
+        self._doc_keys[doc] = None
+        self._doc_terms[doc] = None
+        self._deleted += 1
+        return True
+
+    def _compact(self):
+        """丢弃已删除文档，按原顺序重新编号并重建倒排表"""
+        live = [(key, terms) for key, terms in zip(self._doc_keys, self._doc_terms) if key is not None]
+        self.clear()
+        for key, terms in live:
+            self._append(key, terms)
+
+    def _idf(self, df: int) -> float:
+        n = len(self._doc_ids)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[Hashable, float, float]]:
+        """
+        BM25 检索
+
+        Returns:
+            [(文档键, BM25分数, 归一化分数), ...]，按分数降序。
+            归一化分数 = BM25分数 / 查询词项 idf 之和（截断到 1），
+            表示查询中按信息量加权后被该文档覆盖的比例
+        """
+        query_terms = char_ngrams(query, self.ngram_sizes)
+        with self._lock:
+            if not query_terms or not self._doc_ids:
+                return []
+
+            avg_length = self.avg_length
+            if avg_length == 0:
+                # 所有文档都为空，没有可命中的词项
+                return []
+            norm = self.k1 * (1 - self.b + self.b * self._doc_lengths / avg_length)
+
+            doc_parts = []
+            score_parts = []
+            idf_total = 0.0
+            for term, qtf in query_terms.items():
+                posting = self._postings.get(term)
+                if posting is None or posting.df == 0:
+                    continue
+                idf = self._idf(posting.df)
+                idf_total += idf * qtf
+                docs, tfs = posting.decode()
+                doc_parts.append(docs)
+                score_parts.append(qtf * idf * tfs * (self.k1 + 1) / (tfs + norm[docs]))
+
+            if not doc_parts:
+                return []
+
+            # 只对命中的文档累加，代价与查询词项的倒排表长度成正比
+            docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+
+            alive = np.array([self._doc_keys[d] is not None for d in docs], dtype=bool)
+            docs, scores = docs[alive], scores[alive]
+            if len(docs) > top_k:
+                top = np.argpartition(-scores, top_k - 1)[:top_k]
+                docs, scores = docs[top], scores[top]
+            order = np.argsort(-scores, kind='stable')
+
+            return [(self._doc_keys[docs[i]], float(scores[i]), min(float(scores[i]) / idf_total, 1.0))
+                    for i in order]
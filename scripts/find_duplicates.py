@@ -0,0 +1,80 @@
+"""
+查找题库中的近似重复题目
+对题目 OCR 文本（或答案文本）计算 MinHash 签名，用 LSH 生成候选对，
+输出估计相似度不低于阈值的题目对
+"""
+import os
+import sys
+import json
+import argparse
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BACKEND_DIR = os.path.join(PROJECT_ROOT, 'backend')
+
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from minhash_index import DUPLICATE_THRESHOLD, MinHashLSH, build_lsh
+
+DEFAULT_ANSWERS_DIR = os.path.join(PROJECT_ROOT, 'data', 'answers')
+
+
+def load_database_lsh(db_path=None) -> MinHashLSH:
+    """题库数据库中题目 OCR 文本的 LSH 索引"""
+    from database import QuestionDatabase, DATABASE_PATH
+
+    db = QuestionDatabase(db_path or DATABASE_PATH)
+    lsh = MinHashLSH()
+    for question_id, signature in db.get_minhash_signatures().items():
+        lsh.add(question_id, signature)
+    return lsh
+
+
+def load_answers_lsh(answers_dir: str) -> MinHashLSH:
+    """答案目录中答案文本的 LSH 索引"""
+    texts = []
+    for filename in sorted(os.listdir(answers_dir)):
+        if not filename.endswith('.txt'):
+            continue
+        with open(os.path.join(answers_dir, filename), 'r', encoding='utf-8') as f:
+            texts.append((os.path.splitext(filename)[0], f.read()))
+    return build_lsh(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查找题库中的近似重复题目')
+    parser.add_argument('--source', '-s', choices=['db', 'answers'], default='db',
+                        help='比较题库数据库中的OCR文本(db)或答案文件(answers)')
+    parser.add_argument('--db', help='数据库路径（默认 data/database.db）')
+    parser.add_argument('--answers-dir', '-a', default=DEFAULT_ANSWERS_DIR,
+                        help='答案文本目录')
+    parser.add_argument('--threshold', '-t', type=float, default=DUPLICATE_THRESHOLD,
+                        help='估计相似度阈值 (0-1)')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出')
+
+    args = parser.parse_args()
+
+    if args.source == 'db':
+        lsh = load_database_lsh(args.db)
+    else:
+        if not os.path.exists(args.answers_dir):
+            print(f"错误: 答案目录不存在: {args.answers_dir}")
+            return
+        lsh = load_answers_lsh(args.answers_dir)
+
+    pairs = lsh.duplicate_pairs(args.threshold)
+
+    if args.json:
+        print(json.dumps([{'a': a, 'b': b, 'similarity': round(sim, 3)} for a, b, sim in pairs],
+                         ensure_ascii=False, indent=2))
+        return
+
+    print(f"共 {len(lsh)} 道题目，相似度 ≥ {args.threshold} 的近似重复: {len(pairs)} 对\n")
+    for a, b, similarity in pairs:
+        print(f"  {similarity:.2f}  {a}  ↔  {b}")
+
+
+if __name__ == '__main__':
+    main()
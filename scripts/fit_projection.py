@@ -0,0 +1,107 @@
+"""
+拟合图像特征降维投影
+在题库的原始图像特征上拟合 PCA（可选白化），报告保留的方差和投影前后最近邻重合率，
+保存带版本号的投影矩阵，并用新投影重写题库的图像嵌入
+"""
+import os
+import sys
+import glob
+import shutil
+import argparse
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BACKEND_DIR = os.path.join(PROJECT_ROOT, 'backend')
+
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from config import ANN_CONFIG, PROJECTION_CONFIG
+from database import QuestionDatabase, DATABASE_PATH
+from projection import PCAProjection, neighbour_recall
+
+
+def load_raw_features(db: QuestionDatabase):
+    """
+    题库的原始图像特征
+
+    旧题库只有未投影的 image 嵌入时，先把它们复制为原始特征（image_raw），之后可反复重新拟合
+    """
+    raw = db.get_embedding_store('image_raw')
+    if len(raw):
+        return raw
+    image = db.get_embedding_store('image')
+    if len(image) and db.get_embedding_meta('image').get('projection') is None:
+        count = db.replace_embeddings('image_raw', ((q, image.vector(q, normalized=False))
+                                                    for q in image.question_ids))
+        print(f"已将 {count} 个未投影的图像嵌入保存为原始特征")
+        return db.get_embedding_store('image_raw')
+    return raw
+
+
+def reproject(db: QuestionDatabase, raw, projection: PCAProjection):
+    """用投影重写题库图像嵌入，并删除按旧嵌入建立的向量索引"""
+    projected = projection.apply(raw.matrix)
+    count = db.replace_embeddings('image', zip(raw.question_ids, projected), projection=projection.version)
+    for path in glob.glob(os.path.join(ANN_CONFIG['index_dir'], 'image.*')):
+        os.remove(path)
+    print(f"已用投影 {projection.version} 重写 {count} 个图像嵌入")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='拟合图像特征降维投影')
+    parser.add_argument('--db', help='数据库路径（默认 data/database.db）')
+    parser.add_argument('--dim', '-d', type=int, default=PROJECTION_CONFIG['dim'],
+                        help='降维后的维度')
+    parser.add_argument('--whiten', action='store_true', default=PROJECTION_CONFIG['whiten'],
+                        help='白化（各主成分方差归一）')
+    parser.add_argument('--eval-queries', type=int, default=200,
+                        help='评估最近邻重合率使用的查询数')
+    parser.add_argument('--dry-run', action='store_true', help='只评估，不保存投影也不重写嵌入')
+    parser.add_argument('--reproject', action='store_true',
+                        help='不重新拟合，用当前投影文件重写题库图像嵌入')
+
+    args = parser.parse_args()
+
+    db = QuestionDatabase(args.db or DATABASE_PATH)
+    raw = load_raw_features(db)
+    if len(raw) == 0:
+        print("错误: 题库中没有原始图像特征，请先导入题目")
+        return
+
+    path = PROJECTION_CONFIG['path']
+    if args.reproject:
+        if not os.path.exists(path):
+            print(f"错误: 投影文件不存在: {path}")
+            return
+        reproject(db, raw, PCAProjection.load(path))
+        return
+
+    print(f"在 {len(raw)} 个 {raw.dim} 维原始特征上拟合 {args.dim} 维投影...")
+    projection = PCAProjection.fit(raw.matrix, args.dim, whiten=args.whiten)
+    projected = projection.apply(raw.matrix)
+
+    rng = np.random.default_rng(0)
+    queries = rng.choice(len(raw), min(args.eval_queries, len(raw)), replace=False)
+    recall = neighbour_recall(raw.matrix, projected, queries, k=10)
+    print(f"  版本: {projection.version}")
+    print(f"  保留方差: {projection.explained:.1%}")
+    print(f"  最近邻重合率 recall@10: {recall:.3f}（{len(queries)} 个查询）")
+    print(f"  每题图像嵌入: {raw.dim * 4} → {projection.dim * 4} 字节")
+
+    if args.dry_run:
+        return
+
+    # 每个版本单独保留一份，当前使用的投影复制到配置路径
+    versioned = os.path.join(os.path.dirname(path), f"image_pca.{projection.version}.npz")
+    projection.save(versioned)
+    shutil.copyfile(versioned, path)
+    print(f"投影已保存: {versioned}")
+    reproject(db, raw, projection)
+
+
+if __name__ == '__main__':
+    main()
@@ -56,6 +56,14 @@ def import_questions(
     
     print(f"找到 {len(image_files)} 个题目图片")
     
+    # 图像嵌入文件记录所用的投影版本，已有嵌入与当前投影不一致时不能继续追加
+    projection_version = matcher.image_projection.version if matcher.image_projection else None
+    if not db.check_image_projection(projection_version):
+        print(f"错误: 题库图像嵌入的投影版本与当前投影 ({projection_version}) 不一致")
+        print("请先运行 python scripts/fit_projection.py --reproject")
+        return
+    db.set_embedding_meta('image', projection=projection_version)
+    
     imported_count = 0
     failed_count = 0
     
@@ -112,8 +120,9 @@ def import_questions(
             
             text_embedding = matcher.extract_text_embedding(text_for_embedding) if text_for_embedding else None
             
-            # 提取图像嵌入
-            image_embedding = matcher.extract_image_embedding(str(image_file))
+            # 提取图像嵌入（原始特征另存，用于重新拟合降维投影）
+            image_features = matcher.extract_image_features(str(image_file))
+            image_embedding = matcher.project_image_features(image_features)
             
             # 准备题目数据
             question_data = {
@@ -124,6 +133,7 @@ def import_questions(
                 'latex_formula': latex_formula,
                 'text_embedding': text_embedding,
                 'image_embedding': image_embedding,
+                'image_raw_embedding': image_features,
                 'category': category,
                 'difficulty': None,
                 'tags': [],
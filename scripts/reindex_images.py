@@ -0,0 +1,51 @@
+"""
+重建题目图片指纹索引
+批量上传题目图片后运行，多进程并行计算新增或修改过的图片指纹
+"""
+import os
+import sys
+import time
+import argparse
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BACKEND_DIR = os.path.join(PROJECT_ROOT, 'backend')
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from image_matcher import preload_image_hashes
+from hash_index import get_hash_index
+
+QUESTION_IMAGES_DIR = os.path.join(PROJECT_ROOT, 'data', 'question_images')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重建题目图片指纹索引')
+    parser.add_argument('--image-dir', '-i',
+                       default=QUESTION_IMAGES_DIR,
+                       help='题目图片目录')
+    parser.add_argument('--workers', '-w', type=int,
+                       help='并行进程数（默认为CPU核数）')
+    parser.add_argument('--full', action='store_true',
+                       help='清空索引后全部重新计算')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.image_dir):
+        print(f"错误: 图片目录不存在: {args.image_dir}")
+        return
+
+    if args.full:
+        print("清空现有索引...")
+        get_hash_index().clear()
+
+    start = time.time()
+    count = preload_image_hashes(args.image_dir, workers=args.workers)
+
+    print("=" * 50)
+    print(f"索引完成: {count} 张图片, 用时 {time.time() - start:.1f} 秒")
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
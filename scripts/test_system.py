@@ -5,8 +5,9 @@
 import os
 import sys
 
-# 添加父目录到路径
+# 添加父目录和 backend 目录到路径（backend 模块之间按顶层模块名互相导入）
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
 
 def test_environment():
@@ -216,6 +217,457 @@ def test_database():
     print()
 
 
+def test_text_scoring():
+    """测试向量化文本打分与逐文件计算结果一致"""
+    print("=" * 60)
+    print("🧮 文本打分一致性测试")
+    print("=" * 60)
+    
+    try:
+        import random
+        import tempfile
+        from backend.answer_corpus import (
+            AnswerCorpus, calculate_text_similarity, TYPE_KEYWORDS, MATH_PATTERNS
+        )
+        
+        rng = random.Random(0)
+        vocabulary = list(TYPE_KEYWORDS) + [p for p, _ in MATH_PATTERNS] + ['函数', '区间', '电', 'Z']
+        
+        def random_text():
+            parts = [rng.choice(vocabulary) if rng.random() < 0.7 else str(rng.randint(0, 50))
+                     for _ in range(rng.randint(0, 40))]
+            return ' '.join(parts)
+        
+        prefixes = ['calc', 'calculus', 'complex', 'physics', 'circuit', 'mechanics', 'misc']
+        
+        with tempfile.TemporaryDirectory() as answers_dir:
+            # 题库自带的答案 + 随机生成的答案
+            source_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'answers')
+            texts = {}
+            if os.path.isdir(source_dir):
+                for filename in os.listdir(source_dir):
+                    if filename.endswith('.txt'):
+                        with open(os.path.join(source_dir, filename), 'r', encoding='utf-8') as f:
+                            texts[os.path.splitext(filename)[0]] = f.read()
+            for i in range(300):
+                texts[f"{rng.choice(prefixes)}_gen_{i:03d}"] = random_text()
+            
+            for question_id, text in texts.items():
+                with open(os.path.join(answers_dir, f"{question_id}.txt"), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            
+            corpus = AnswerCorpus(answers_dir)
+            corpus.load()
+            
+            queries = ['', '求', '求函数 f(x) = x^3 - 3x^2 + 2 在区间 [0, 3] 上的最大值和最小值']
+            queries += [random_text() for _ in range(200)]
+            queries += [text[:rng.randint(0, 200)] for text in list(texts.values())[:50]]
+            
+            mismatches = 0
+            for query in queries:
+                for question_id, score in corpus.similarities(query):
+                    expected = calculate_text_similarity(question_id, query, answers_dir)
+                    if score != expected:
+                        mismatches += 1
+            
+            total = len(queries) * len(corpus)
+            if mismatches == 0:
+                print(f"✓ 向量化打分与逐文件计算完全一致（{len(queries)} 个查询 × {len(corpus)} 个答案）")
+            else:
+                print(f"✗ 有 {mismatches}/{total} 个分数不一致")
+        
+    except Exception as e:
+        print(f"✗ 文本打分测试失败: {e}")
+    
+    print()
+
+
+def test_text_index():
+    """测试 BM25 倒排索引的排序、删除/重新压缩和 varint 编解码"""
+    print("=" * 60)
+    print("📇 BM25 文本索引测试")
+    print("=" * 60)
+    
+    try:
+        import random
+        import warnings
+        from backend.text_index import BM25Index, encode_varint, decode_varints
+        
+        rng = random.Random(0)
+        
+        # 1. varint 编解码往返（含多字节和 64 位附近的大数）
+        values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32, 2 ** 63 - 1]
+        values += [rng.randrange(0, 2 ** rng.randint(1, 62)) for _ in range(2000)]
+        data = bytearray()
+        for value in values:
+            encode_varint(value, data)
+        decoded = decode_varints(bytes(data)).tolist()
+        assert decoded == values, "varint 往返结果不一致"
+        assert decode_varints(b'').size == 0
+        print(f"✓ varint 编解码往返一致（{len(values)} 个整数）")
+        
+        # 2. BM25 排序：完整包含查询的文档排第一，无关文档不出现
+        index = BM25Index()
+        index.add('q1', '求函数 f(x) = x^2 在 x=1 处的导数')
+        index.add('q2', '求函数的定义域')
+        index.add('q3', '电路中电阻的串联与并联')
+        results = index.search('函数 f(x) = x^2 的导数', top_k=10)
+        keys = [key for key, _, _ in results]
+        assert keys[:2] == ['q1', 'q2'], f"排序错误: {keys}"
+        assert 'q3' not in keys
+        assert all(0 < similarity <= 1 for _, _, similarity in results)
+        assert all(a[1] >= b[1] for a, b in zip(results, results[1:]))
+        print("✓ BM25 排序正确")
+        
+        # 3. 删除与更新：已删除文档不再返回，分数与只含存活文档的新索引相同（含重新压缩）
+        alphabet = '函数导数积分极限电路电阻电容力学质点速度'
+        docs = {f"d{i}": ''.join(rng.choice(alphabet) for _ in range(rng.randint(5, 30))) for i in range(200)}
+        index = BM25Index()
+        for key, text in docs.items():
+            index.add(key, text)
+        for key in rng.sample(sorted(docs), 120):
+            assert index.remove(key)
+            del docs[key]
+        for key in rng.sample(sorted(docs), 20):
+            docs[key] = ''.join(rng.choice(alphabet) for _ in range(10))
+            index.add(key, docs[key])
+        assert not index.remove('missing')
+        assert len(index) == len(docs)
+        assert index._deleted <= 0.2 * len(index._doc_keys) + 1, "删除比例过高时应重新压缩"
+        
+        fresh = BM25Index()
+        for key, text in docs.items():
+            fresh.add(key, text)
+        for _ in range(50):
+            query = ''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 8)))
+            got = {key: score for key, score, _ in index.search(query, top_k=len(docs))}
+            expected = {key: score for key, score, _ in fresh.search(query, top_k=len(docs))}
+            assert set(got) <= set(docs), "返回了已删除的文档"
+            assert got.keys() == expected.keys()
+            assert all(abs(got[key] - expected[key]) < 1e-9 for key in got)
+        print(f"✓ 删除、更新与重新压缩后结果与重建的索引一致（{len(docs)} 个文档）")
+        
+        # 4. 所有文档都为空时不产生 NaN
+        index = BM25Index()
+        index.add('a', '')
+        index.add('b', '')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            assert index.search('abc') == []
+        print("✓ 空文档索引检索正常")
+        
+    except AssertionError as e:
+        print(f"✗ BM25 索引测试失败: {e}")
+    except Exception as e:
+        print(f"✗ BM25 索引测试出错: {e}")
+    
+    print()
+
+
+def test_projection():
+    """测试图像降维投影的保存/读取往返和投影版本检查"""
+    print("=" * 60)
+    print("📐 图像降维投影测试")
+    print("=" * 60)
+    
+    try:
+        import tempfile
+        import numpy as np
+        from backend.projection import PCAProjection
+        from backend.database import QuestionDatabase
+        
+        rng = np.random.default_rng(0)
+        features = np.maximum(rng.standard_normal((500, 32)) @ rng.standard_normal((32, 512)), 0)
+        projection = PCAProjection.fit(features.astype(np.float32), 64)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            # 1. 保存后读取：版本号和投影结果不变
+            path = os.path.join(tmp, 'image_pca.npz')
+            projection.save(path)
+            loaded = PCAProjection.load(path)
+            assert loaded.version == projection.version, "读取后版本号不一致"
+            assert np.array_equal(loaded.apply(features), projection.apply(features)), "读取后投影结果不一致"
+            assert loaded.apply(features[0]).shape == (64,)
+            print(f"✓ 投影保存/读取往返一致（{projection.version}）")
+            
+            # 2. 题库图像嵌入记录的版本与当前投影比较
+            db = QuestionDatabase(os.path.join(tmp, 'database.db'))
+            assert db.check_image_projection(projection.version), "没有图像嵌入时应视为一致"
+            db.replace_embeddings('image', [(f"q{i}", v) for i, v in enumerate(projection.apply(features[:10]))],
+                                  projection=projection.version)
+            assert db.check_image_projection(loaded.version)
+            other = PCAProjection.fit(features[::2].astype(np.float32), 64)
+            assert other.version != projection.version
+            assert not db.check_image_projection(other.version), "版本不一致时应停用图像检索"
+            assert not db.check_image_projection(None)
+            print("✓ 投影版本检查正确")
+        
+    except AssertionError as e:
+        print(f"✗ 投影测试失败: {e}")
+    except Exception as e:
+        print(f"✗ 投影测试出错: {e}")
+    
+    print()
+
+
+def test_embedding_files():
+    """测试同一数据库路径上的两个 QuestionDatabase 实例写入嵌入文件时删除不会丢失"""
+    print("=" * 60)
+    print("🗂️  嵌入文件测试")
+    print("=" * 60)
+    
+    try:
+        import tempfile
+        import numpy as np
+        from backend.database import QuestionDatabase
+        
+        rng = np.random.default_rng(0)
+        
+        def question(question_id, embedded=True):
+            data = {'question_id': question_id, 'image_path': f"{question_id}.png", 'ocr_text': question_id}
+            if embedded:
+                for kind, dim in (('text', 8), ('image', 16), ('image_raw', 32)):
+                    data[f"{kind}_embedding"] = rng.standard_normal(dim).astype(np.float32)
+            return data
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'database.db')
+            first, second = QuestionDatabase(path), QuestionDatabase(path)
+            # second 先写入一次，缓存下当时的有效题号
+            second.insert_question(question('q0'))
+            first.insert_question(question('q1'))
+            first.insert_question(question('q2'))
+            
+            # 1. 另一个实例插入的题目：删除和不带嵌入的重新保存都要生效
+            assert second.delete_question('q1')
+            second.insert_question(question('q2', embedded=False))
+            fresh = QuestionDatabase(path)
+            _, text_store, image_store = fresh.get_embedding_stores()
+            assert text_store.question_ids == ['q0'] and image_store.question_ids == ['q0'], \
+                f"残留的嵌入: {text_store.question_ids}"
+            assert fresh.get_embedding_store('image_raw').question_ids == ['q0']
+            for kind in ('text', 'image', 'image_raw'):
+                assert fresh._embedding_file(kind).load_store().question_ids == ['q0'], f"{kind} 缺少删除标记"
+            print("✓ 另一个实例插入的题目被删除或去掉嵌入后不再出现")
+            
+            # 2. 另一个实例压缩文件后继续追加
+            first.insert_question(question('q3'))
+            first._embedding_file('image').compact()
+            assert second.delete_question('q3')
+            assert QuestionDatabase(path)._embedding_file('image').load_store().question_ids == ['q0']
+            print("✓ 另一个实例压缩文件后删除仍然生效")
+        
+    except AssertionError as e:
+        print(f"✗ 嵌入文件测试失败: {e}")
+    except Exception as e:
+        print(f"✗ 嵌入文件测试出错: {e}")
+    
+    print()
+
+
+def test_hamming_index():
+    """测试多索引哈希的半径查询和 Top-K 查询与线性扫描结果一致"""
+    print("=" * 60)
+    print("#️⃣  汉明空间索引测试")
+    print("=" * 60)
+    
+    try:
+        import random
+        from backend.hamming_index import MultiIndexHash, PackedHashMatrix
+        
+        # 200 个随机中心各翻转 0-20 位，条目数超过探测桶数，保证走倒排表
+        rng = random.Random(0)
+        centers = [rng.getrandbits(64) for _ in range(200)]
+        index = MultiIndexHash()
+        matrix = PackedHashMatrix()
+        for i in range(5000):
+            hash_value = rng.choice(centers)
+            for bit in rng.sample(range(64), rng.randint(0, 20)):
+                hash_value ^= 1 << bit
+            index.add(i, hash_value)
+            matrix.add(i, hash_value)
+        for key in rng.sample(range(5000), 500):
+            assert index.remove(key) and matrix.remove(key)
+        assert len(index) == len(matrix) == 4500
+        assert index.sublinear_radius == 15
+        
+        queries = [rng.choice(centers) ^ rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+                   for _ in range(50)]
+        for query in queries:
+            # 1. 半径查询：倒排表范围内、范围边界和线性扫描的半径
+            for max_distance in (0, 4, 8, 12, 15, 25):
+                got = index.radius_search(query, max_distance)
+                expected = matrix.radius_search(query, max_distance)
+                assert sorted(got) == sorted(expected), f"半径 {max_distance} 的结果不一致"
+                assert [d for _, d in got] == sorted(d for _, d in got), "结果未按距离排序"
+            
+            # 2. Top-K（距离相同的条目顺序可能不同，比较距离序列和每个键的距离）
+            for k, max_distance in ((1, None), (10, None), (10, 15), (50, 25)):
+                got = index.nearest(query, k, max_distance)
+                expected = matrix.nearest(query, k, max_distance)
+                assert [d for _, d in got] == [d for _, d in expected], f"Top-{k} 的距离不一致"
+                assert all(index.get(key) is not None and bin(index.get(key) ^ query).count('1') == d
+                           for key, d in got)
+        print(f"✓ 半径查询和 Top-K 查询与线性扫描一致（{len(index)} 个哈希 × {len(queries)} 个查询）")
+        
+    except AssertionError as e:
+        print(f"✗ 汉明空间索引测试失败: {e}")
+    except Exception as e:
+        print(f"✗ 汉明空间索引测试出错: {e}")
+    
+    print()
+
+
+def test_ann_index():
+    """测试向量索引相对精确检索（FlatIndex）的召回率"""
+    print("=" * 60)
+    print("🧭 向量索引测试")
+    print("=" * 60)
+    
+    try:
+        import numpy as np
+        from backend.embedding_store import EmbeddingStore
+        import tempfile
+        from backend.ann_index import (FlatIndex, IVFFlatIndex, HNSWIndex, SQ8Index, PQIndex,
+                                       HNSWLIB_AVAILABLE, load_or_build_index)
+        
+        # 50 个簇的随机向量，查询为题库向量加噪声
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((50, 64))
+        vectors = (centers[rng.integers(0, 50, 3000)] + 0.5 * rng.standard_normal((3000, 64))).astype(np.float32)
+        queries = vectors[rng.choice(3000, 100, replace=False)] + 0.3 * rng.standard_normal((100, 64))
+        
+        def make_store(count=len(vectors)):
+            store = EmbeddingStore()
+            for i, vector in enumerate(vectors[:count]):
+                store.add(f"q{i}", vector)
+            return store
+        
+        def build(cls, **kwargs):
+            index = cls(make_store(), **kwargs)
+            index.build()
+            return index
+        
+        flat = build(FlatIndex)
+        truth = [dict(flat.search(query, 10)) for query in queries]
+        
+        def recall(index):
+            hits = 0
+            for query, expected in zip(queries, truth):
+                results = index.search(query, 10)
+                hits += len(expected.keys() & {qid for qid, _ in results})
+                # 返回的相似度是 float32 向量上的精确余弦相似度
+                for qid, similarity in results:
+                    if qid in expected:
+                        assert abs(similarity - expected[qid]) < 1e-5, "相似度不是精确值"
+            return hits / (10 * len(queries))
+        
+        # 1. 压缩编码 + float32 重排
+        for name, index, minimum in [('SQ8', build(SQ8Index), 0.95),
+                                     ('PQ', build(PQIndex, subspaces=16), 0.9)]:
+            value = recall(index)
+            assert value >= minimum, f"{name} recall@10 过低: {value:.3f}"
+            print(f"✓ {name} 重排后 recall@10 = {value:.3f}")
+        
+        # 2. 倒排文件与 HNSW 图索引
+        value = recall(build(IVFFlatIndex, nprobe=8))
+        assert value >= 0.9, f"IVF recall@10 过低: {value:.3f}"
+        print(f"✓ IVF（nprobe=8）recall@10 = {value:.3f}")
+        if HNSWLIB_AVAILABLE:
+            value = recall(build(HNSWIndex))
+            assert value >= 0.9, f"HNSW recall@10 过低: {value:.3f}"
+            print(f"✓ HNSW recall@10 = {value:.3f}")
+        else:
+            print("⚠️  hnswlib 未安装，跳过 HNSW 测试")
+        
+        # 3. load_or_build_index：第一次训练并保存，第二次从文件读取；之后插入的题目可以检索到
+        backends = ['ivf', 'sq8', 'pq'] + (['hnsw'] if HNSWLIB_AVAILABLE else [])
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend in backends:
+                built = load_or_build_index(make_store(500), 'test', backend=backend, index_dir=tmp)
+                loaded = load_or_build_index(make_store(500), 'test', backend=backend, index_dir=tmp)
+                assert os.listdir(tmp), f"{backend} 索引文件未保存"
+                for index in (built, loaded):
+                    assert index.kind == backend
+                    index.add('new', queries[0])
+                    assert len(index) == 501
+                    results = index.search(queries[0], 5)
+                    assert results and results[0][0] == 'new', f"{backend} 插入的题目检索不到"
+                    assert abs(results[0][1] - 1.0) < 1e-5
+                    index.remove('new')
+                    assert 'new' not in {qid for qid, _ in index.search(queries[0], 5)}
+                for path in os.listdir(tmp):
+                    os.remove(os.path.join(tmp, path))
+        print(f"✓ 读取或新建索引后插入的题目可以检索到（{', '.join(backends)}）")
+        
+    except AssertionError as e:
+        print(f"✗ 向量索引测试失败: {e}")
+    except Exception as e:
+        print(f"✗ 向量索引测试出错: {e}")
+    
+    print()
+
+
+def test_retrieval_pipeline():
+    """测试检索管线预加载并监视题库图片目录后，检索时不再扫描目录"""
+    print("=" * 60)
+    print("🔎 两阶段检索测试")
+    print("=" * 60)
+    
+    try:
+        import io
+        import tempfile
+        import numpy as np
+        from PIL import Image
+        # 与 backend 模块使用同一份模块对象（backend 模块按顶层模块名互相导入）
+        import hash_index
+        import retrieval
+        from database import QuestionDatabase
+        
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = os.path.join(tmp, 'question_bank')
+            os.makedirs(folder)
+            images = {}
+            for i in range(6):
+                image = Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8).repeat(4, 0).repeat(4, 1))
+                buffer = io.BytesIO()
+                image.save(buffer, format='PNG')
+                images[f"q{i}"] = buffer.getvalue()
+                with open(os.path.join(folder, f"q{i}.png"), 'wb') as f:
+                    f.write(images[f"q{i}"])
+            
+            saved_index, saved_scan = hash_index._hash_index, hash_index.scan_image_folder
+            hash_index._hash_index = hash_index.ImageHashIndex(os.path.join(tmp, 'image_hash_index.db'))
+            scans = []
+            
+            def counting_scan(image_folder):
+                scans.append(image_folder)
+                return saved_scan(image_folder)
+            
+            try:
+                pipeline = retrieval.RetrievalPipeline(QuestionDatabase(os.path.join(tmp, 'database.db')),
+                                                       image_folder=folder)
+                hash_index.scan_image_folder = counting_scan
+                for _ in range(2):
+                    candidates = pipeline.gather(image_bytes=images['q3'])
+                    assert 'q3' in candidates, "图像候选中没有查询图片本身"
+                assert not scans, f"检索时扫描了 {len(scans)} 次题库目录"
+                print("✓ 连续两次检索都没有重新扫描题库目录")
+            finally:
+                hash_index._hash_index, hash_index.scan_image_folder = saved_index, saved_scan
+                watcher = retrieval._image_watchers.pop(os.path.abspath(folder), None)
+                if watcher is not None:
+                    watcher.stop()
+        
+    except AssertionError as e:
+        print(f"✗ 两阶段检索测试失败: {e}")
+    except Exception as e:
+        print(f"✗ 两阶段检索测试出错: {e}")
+    
+    print()
+
+
 def main():
     """运行所有测试"""
     print("\n" + "=" * 60)
@@ -226,6 +678,13 @@ def main():
     test_database()
     test_ocr()
     test_matching()
+    test_text_scoring()
+    test_text_index()
+    test_projection()
+    test_embedding_files()
+    test_hamming_index()
+    test_ann_index()
+    test_retrieval_pipeline()
     test_clip()
     test_ollama()
     